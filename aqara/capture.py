@@ -0,0 +1,220 @@
+"""
+Aqara Capture
+
+Record the raw traffic of a client and play it back offline, feature including
+- Append-only binary log of (monotonic time, source address, raw datagram)
+- Buffered writes, rotation by size
+- Client and devices of a capture rebuilt without gateways (capture_snapshot)
+- Replay into a client at the recorded pace, N times faster or at max speed
+
+    python -m aqara.capture FILE [FILE ...] [--speed N]
+
+File format: CAPTURE_MAGIC, then one record per datagram, a CAPTURE_RECORD
+header (time, IPv4 address, port, length) followed by the datagram.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import struct
+import time
+
+from aqara.decoder import AqaraDecoder
+from aqara.snapshot import SNAPSHOT_VERSION
+from aqara.const import (AQARA_CAPTURE_MAX_BYTES, AQARA_CAPTURE_BACKUPS,
+                         AQARA_CAPTURE_BUFFER_SIZE)
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"AQCAP1\n"
+CAPTURE_RECORD = struct.Struct("<d4sHH")
+
+def _pack_addr(addr):
+    """(ip, port) or ip -> (packed ip, port)"""
+    if isinstance(addr, tuple):
+        host, port = addr[0], addr[1]
+    else:
+        host, port = addr, 0
+    try:
+        return socket.inet_aton(host), port
+    except (OSError, TypeError):
+        return b"\0\0\0\0", port
+
+class CaptureWriter(object):
+    """Append datagrams to 'path', rotated to path.1 ... path.<backups> past max_bytes."""
+    def __init__(self, path, max_bytes=AQARA_CAPTURE_MAX_BYTES, backups=AQARA_CAPTURE_BACKUPS,
+                 buffer_size=AQARA_CAPTURE_BUFFER_SIZE):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._buffer_size = buffer_size
+        self._file = None
+        self._size = 0
+        self.records = 0
+        self._open()
+
+    @property
+    def path(self):
+        """property: path of the current file"""
+        return self._path
+
+    def write(self, data, addr, timestamp=None):
+        """Append a datagram received from 'addr'"""
+        if self._file is None:
+            return
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        packed_ip, port = _pack_addr(addr)
+        header = CAPTURE_RECORD.pack(timestamp, packed_ip, port, len(data))
+        self._file.write(header)
+        self._file.write(data)
+        self._size += len(header) + len(data)
+        self.records += 1
+        if self._size >= self._max_bytes:
+            self._rotate()
+
+    def flush(self):
+        """Write the buffered records"""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        """Flush and close"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        self._file = open(self._path, "ab", buffering=self._buffer_size)
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(CAPTURE_MAGIC)
+            self._size = len(CAPTURE_MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        if self._backups > 0:
+            for index in range(self._backups - 1, 0, -1):
+                older = "{}.{}".format(self._path, index)
+                if os.path.exists(older):
+                    os.replace(older, "{}.{}".format(self._path, index + 1))
+            os.replace(self._path, self._path + ".1")
+        else:
+            os.remove(self._path)
+        self._open()
+
+def read_capture(path):
+    """Yield the (time, (ip, port), data) of a capture, a truncated last record is skipped"""
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("not a capture: {}".format(path))
+        while True:
+            header = capture_file.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return
+            timestamp, packed_ip, port, length = CAPTURE_RECORD.unpack(header)
+            data = capture_file.read(length)
+            if len(data) < length:
+                _LOGGER.warning("read_capture(): %s ends with a truncated record", path)
+                return
+            yield timestamp, (socket.inet_ntoa(packed_ip), port), data
+
+def capture_snapshot(records):
+    """Return a snapshot of the gateways and devices heard in 'records'
+
+    Restored into a client (client.restore_snapshot), the captured reports
+    and heartbeats are handled as if the gateways had been discovered.
+    """
+    decoder = AqaraDecoder()
+    gateway_sids = {}
+    devices = {}
+    for _timestamp, addr, data in records:
+        cmd, sid = decoder.peek(data)
+        if sid is None or cmd not in ("iam", "heartbeat", "report", "read_ack"):
+            continue
+        try:
+            msg = decoder.decode(data)
+        except ValueError:
+            continue
+        model = msg.get("model")
+        if cmd == "iam" or model == "gateway":
+            gateway_sids[addr[0]] = sid
+        elif model is not None:
+            devices.setdefault(addr[0], {})[sid] = model
+    gateways = []
+    for ip in set(gateway_sids) | set(devices):
+        gateways.append({
+            # a gateway only heard through its devices is named after its address
+            "sid": gateway_sids.get(ip, ip),
+            "addr": ip,
+            "state": {},
+            "devices": [[sid, model, {}] for sid, model in devices.get(ip, {}).items()],
+        })
+    return {"version": SNAPSHOT_VERSION, "time": time.time(), "gateways": gateways}
+
+def feed(protocol, records):
+    """Hand every record to protocol.datagram_received at once, return the count"""
+    count = 0
+    datagram_received = protocol.datagram_received
+    for _timestamp, addr, data in records:
+        datagram_received(data, addr)
+        count += 1
+    return count
+
+@asyncio.coroutine
+def replay(protocol, records, speed=1.0, loop=None):
+    """Hand the records to protocol.datagram_received at 'speed' times the recorded pace
+
+    With speed None, at max speed, yielding to the loop between records.
+    Return the number of records.
+    """
+    loop = asyncio.get_event_loop() if loop is None else loop
+    started = loop.time()
+    first = None
+    count = 0
+    for timestamp, addr, data in records:
+        if speed is None:
+            yield from asyncio.sleep(0)
+        else:
+            if first is None:
+                first = timestamp
+            delay = started + (timestamp - first) / speed - loop.time()
+            if delay > 0:
+                yield from asyncio.sleep(delay)
+        protocol.datagram_received(data, addr)
+        count += 1
+    return count
+
+def main():
+    """Replay captures into a client without gateways and print the throughput"""
+    from aqara.client import AqaraClient
+    parser = argparse.ArgumentParser(description="Replay pyaqara captures offline")
+    parser.add_argument("files", nargs="+", help="capture files, oldest first")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="times the recorded pace (default: max speed)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    records = []
+    for path in args.files:
+        records.extend(read_capture(path))
+    client = AqaraClient()
+    # no gateway to talk to
+    client.unicast = lambda addr, msg: None
+    client.restore_snapshot(capture_snapshot(records))
+    for gateway in client.gateways.values():
+        gateway.refresh_scheduler.cancel()
+
+    started = time.perf_counter()
+    if args.speed is None:
+        count = feed(client, records)
+    else:
+        loop = asyncio.get_event_loop()
+        count = loop.run_until_complete(replay(client, records, args.speed, loop))
+    elapsed = time.perf_counter() - started
+    print("{} datagrams in {:.3f}s, {:.0f} datagrams/s".format(
+        count, elapsed, count / elapsed if elapsed else 0))
+
+if __name__ == '__main__':
+    main()
@@ -10,56 +10,259 @@ Feature includes:
 - Read values from a device (async)
 - Send control command to a device (async)
 - Heartbeat
+- Optional decoding in worker processes (see aqara.sharding)
+- Optional batched receive engine (see aqara.receiver)
+- Optional warm start from a registry snapshot (see aqara.snapshot)
+- Metrics: counters and latency histograms (see aqara.metrics)
+- Offline / online detection (see aqara.liveness)
+- Optional suppression of duplicate reports and heartbeats (see aqara.dedup)
+- Async event streams with bounded queues (see aqara.stream)
+- Capture of the raw traffic, for offline replay (see aqara.capture)
+- Outbound priority lanes: writes before reads before refresh / discovery
+- One client shared by the consumers of a process (see aqara.hub)
 
 """
 import asyncio
 import json
 import logging
+import time
 
-from pydispatch import dispatcher
+from aqara.dispatch import (dispatcher, MODE_INLINE)
+from aqara.log import LazyJSON
 from aqara.protocol import AqaraProtocol
 from aqara.gateway import AqaraGateway
-from aqara.const import (
-    LISTEN_IP, LISTEN_PORT,
-    AQARA_EVENT_NEW_GATEWAY
-)
+from aqara.device import add_model_columns
+from aqara.metrics import AqaraMetrics
+from aqara.liveness import LivenessTracker
+from aqara.dedup import DuplicateFilter
+from aqara.capture import CaptureWriter
+from aqara.scheduler import (OutboundScheduler, PRIORITY_CONTROL, PRIORITY_INTERACTIVE,
+                             PRIORITY_BACKGROUND)
+from aqara.stream import (EventHub, EVENT_NEW_GATEWAY, OVERFLOW_DROP_OLDEST)
+from aqara.store import DeviceStore
+from aqara.decoder import (AqaraMessage, JSON_BACKEND_AUTO)
+from aqara.crypto import CRYPTO_BACKEND_AUTO
+from aqara.sharding import (ShardPool, RECORD_MESSAGE, RECORD_DROPPED, SID_FILTERED_CMDS)
+from aqara.receiver import create_batch_endpoint
+from aqara.snapshot import (take_snapshot, save_snapshot, load_snapshot, restore_state)
+from aqara.const import (AQARA_EVENT_NEW_GATEWAY, AQARA_STREAM_QUEUE_SIZE)
 
 _LOGGER = logging.getLogger(__name__)
 
+# payload type of the routed commands, see add_route for the others
+_PAYLOAD_TYPES = {
+    "get_id_list_ack": list,
+    "read_ack": dict,
+    "write_ack": dict,
+    "report": dict,
+    "heartbeat": dict,
+}
+# multicast commands which may be received more than once
+_DEDUP_CMDS = frozenset(["report", "heartbeat"])
+
+def _dedup_key(msg):
+    data = msg.get("data")
+    if data is None and isinstance(msg, AqaraMessage):
+        # decoded by a shard worker
+        data = repr(msg.payload)
+    return (msg.get("sid"), msg["cmd"], data)
+
 def _extract_data(msg):
-    return json.loads(msg["data"])
+    if isinstance(msg, AqaraMessage):
+        return msg.payload
+    return json.loads(msg["data"]) if "data" in msg else None
 
 class AqaraClient(AqaraProtocol):
     """Aqara Client implementation."""
-    def __init__(self, gw_secrets=None):
-        super().__init__()
+    def __init__(self, gw_secrets=None, json_backend=JSON_BACKEND_AUTO,
+                 crypto_backend=CRYPTO_BACKEND_AUTO, snapshot_path=None, dedup_window=None,
+                 dedup_clock=time.monotonic):
+        super().__init__(json_backend)
+        self._crypto_backend = crypto_backend
+        self._snapshot_path = snapshot_path
         self.transport = None
         self._gw_secrets = {} if gw_secrets is None else gw_secrets
         self._gateways = {}
         self._device_to_gw = {}
+        self._store = DeviceStore()
+        self._metrics = AqaraMetrics()
+        self._liveness = LivenessTracker(self._store)
+        self._store.liveness = self._liveness
+        # every datagram to a gateway goes through its class lane
+        self._outbound = OutboundScheduler(self._transmit,
+                                           on_wait=self._metrics.outbound_wait.observe)
+        self._events = EventHub()
+        self._store.events = self._events
+        # drops repeated reports / heartbeats, e.g. on multi-homed hosts
+        self._dedup = None if dedup_window is None \
+            else DuplicateFilter(dedup_window, clock=dedup_clock)
+        self._shards = None
+        # cmd -> handler(sid, msg, data), see add_route
+        self._routes = {
+            "iam": self._route_iam,
+            "get_id_list_ack": self._route_get_id_list_ack,
+            "read_ack": self._route_read_ack,
+            "write_ack": self._route_write_ack,
+            "report": self._route_report,
+            "heartbeat": self._route_heartbeat,
+        }
 
     @property
     def gateways(self):
         """property: gateways"""
         return self._gateways
 
+    @property
+    def gateway_secrets(self):
+        """property: gw_sid -> secret"""
+        return self._gw_secrets
+
+    def set_gateway_secret(self, gw_sid, secret):
+        """Set the secret of gateway 'gw_sid', discovered or not"""
+        self._gw_secrets[gw_sid] = secret
+        if gw_sid in self._gateways:
+            self._gateways[gw_sid].set_secret(secret)
+
+    @property
+    def metrics(self):
+        """property: metrics of this client and its gateways"""
+        return self._metrics
+
+    @property
+    def liveness(self):
+        """property: liveness tracker of gateways and devices"""
+        return self._liveness
+
+    @property
+    def dedup(self):
+        """property: duplicate filter, None unless a dedup_window is set"""
+        return self._dedup
+
+    def events(self, filter=None, maxsize=AQARA_STREAM_QUEUE_SIZE, # pylint: disable=redefined-builtin
+               policy=OVERFLOW_DROP_OLDEST):
+        """Return a stream of the events for which filter(event) is true (all if None)
+
+        async for event in client.events(): ..., or event = yield from stream.get(),
+        see aqara.stream for the overflow policies. Close the stream when done.
+        """
+        return self._events.open(filter, maxsize, policy)
+
+    @property
+    def outbound(self):
+        """property: scheduler of the datagrams sent to gateways"""
+        return self._outbound
+
+    @property
+    def store(self):
+        """property: store holding the state of all devices"""
+        return self._store
+
     @asyncio.coroutine
-    def start(self, loop):
-        """Start listening on gateway events"""
-        listen = loop.create_datagram_endpoint(lambda: self, local_addr=(LISTEN_IP, LISTEN_PORT))
+    def start(self, loop, workers=0, batch_receive=False):
+        """Start listening on gateway events
+
+        With 'workers' > 0, datagrams sent to the listen port are received and
+        decoded by that many processes sharing the port, this client routes the
+        decoded messages and applies all updates (Linux only).
+
+        With 'batch_receive', all datagrams pending on the socket are read and
+        handled in one pass per wakeup (see aqara.receiver).
+
+        With a 'snapshot_path', the gateways and devices saved by the last
+        stop() are restored before gateways are discovered.
+        """
+        local_addr = self.listen_addr
+        if workers > 0:
+            if self.capture is not None:
+                raise RuntimeError('capture is not supported in sharded mode')
+            self._shards = ShardPool(workers, self.handle_decoded, self._decoder.backend,
+                                     local_addr)
+            self._shards.start(loop)
+            # the workers own the listen port, send from any port
+            local_addr = (local_addr[0], 0)
+        if batch_receive:
+            listen = create_batch_endpoint(loop, lambda: self, local_addr)
+        else:
+            listen = loop.create_datagram_endpoint(lambda: self, local_addr=local_addr)
         transport, _protocol = yield from listen
         self.transport = transport
+        self._events.transport = transport
+        self._liveness.start(loop)
+        if self._snapshot_path is not None:
+            snapshot = load_snapshot(self._snapshot_path)
+            if snapshot is not None:
+                self.restore_snapshot(snapshot)
+        self._sync_shards()
         self.discover_gateways()
         _LOGGER.info("started")
 
     def stop(self):
         """Stop listening to gateway events"""
+        if self._snapshot_path is not None:
+            self.save_snapshot()
+        self._liveness.stop()
+        self._outbound.cancel()
+        self.stop_capture()
+        if self._shards is not None:
+            self._shards.stop()
+            self._shards = None
         if self.transport is None:
             _LOGGER.info("not started")
         else:
             self.transport.close()
             _LOGGER.info("stopped")
 
+    def start_capture(self, path, **kwargs):
+        """Append every datagram received to capture 'path', see aqara.capture.CaptureWriter
+
+        Not supported in sharded mode (RuntimeError), the workers receive the datagrams.
+        """
+        if self._shards is not None:
+            raise RuntimeError('capture is not supported in sharded mode')
+        self.stop_capture()
+        self.capture = CaptureWriter(path, **kwargs)
+        _LOGGER.info("capturing to %s", path)
+
+    def stop_capture(self):
+        """Stop capturing, flush and close the capture"""
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def save_snapshot(self, path=None):
+        """Save gateways, devices and their state to 'path' (default: snapshot_path)"""
+        path = self._snapshot_path if path is None else path
+        try:
+            save_snapshot(take_snapshot(self), path)
+        except OSError as exc:
+            _LOGGER.error("can not save snapshot %s: %s", path, exc)
+
+    def restore_snapshot(self, snapshot):
+        """Create the gateways and devices of 'snapshot' with their last-known state
+
+        Events are sent as for discovered gateways and devices, live traffic then
+        updates them (a gateway which moved is rediscovered, see
+        on_gateway_discovered, detached devices are removed, see
+        on_devices_discovered).
+        """
+        for gw_entry in snapshot["gateways"]:
+            gw_sid = gw_entry["sid"]
+            if gw_sid in self._gateways:
+                continue
+            restore_state(self._store, gw_sid, gw_entry["state"])
+            gateway = self._add_gateway(gw_sid, gw_entry["addr"])
+            for sid, model, state in gw_entry["devices"]:
+                try:
+                    # model columns first, restore_state skips unknown columns
+                    add_model_columns(self._store, model)
+                except RuntimeError as exc:
+                    _LOGGER.warning("restore_snapshot(): %s [%s]", exc, sid)
+                    continue
+                restore_state(self._store, sid, state)
+                gateway.restore_device(model, sid)
+                self._device_to_gw[sid] = gateway
+        _LOGGER.info("restored %d gateways from snapshot", len(self._gateways))
+
     def discover_gateways(self):
         """Ask all gateways to respond identity."""
         _LOGGER.info('discovering gateways...')
@@ -69,15 +272,18 @@ class AqaraClient(AqaraProtocol):
     def discover_devices(self, gw_addr):
         """Ask a gateway to reply with the SID of all attached devices."""
         discover_devices_msg = {"cmd": "get_id_list"}
-        self.unicast(gw_addr, discover_devices_msg)
+        self._outbound.put(gw_addr, discover_devices_msg, PRIORITY_BACKGROUND)
 
-    def read_device(self, gw_addr, sid):
-        """Send a request to read device 'sid' on gateway 'gw_addr'"""
+    def read_device(self, gw_addr, sid, priority=PRIORITY_INTERACTIVE, on_sent=None):
+        """Send a request to read device 'sid' on gateway 'gw_addr', on_sent() once sent"""
         read_msg = {"cmd": "read", "sid": sid}
-        self.unicast(gw_addr, read_msg)
+        self._outbound.put(gw_addr, read_msg, priority, on_sent)
+
+    def write_device(self, gw_addr, model, sid, data, meta=None, on_sent=None):
+        """Send a request to write 'data' to device 'sid' on gateway 'gw_addr'
 
-    def write_device(self, gw_addr, model, sid, data, meta=None):
-        """Send a request to write 'data' to device 'sid' on gateway 'gw_addr'"""
+        on_sent() is called once the request is sent, see aqara.scheduler.
+        """
         write_msg = {
             "cmd": "write",
             "model": model,
@@ -88,52 +294,126 @@ class AqaraClient(AqaraProtocol):
         if meta != None:
             write_msg.update(meta)
 
-        self.unicast(gw_addr, write_msg)
+        self._outbound.put(gw_addr, write_msg, PRIORITY_CONTROL, on_sent)
+
+    def _transmit(self, gw_addr, msg):
+        """send a datagram released by the outbound scheduler"""
+        self.unicast(gw_addr, msg)
+
+    def accept_message(self, cmd, sid):
+        """Override: skip decoding reports and heartbeats of unknown devices"""
+        self._metrics.datagrams.inc(cmd)
+        if cmd in SID_FILTERED_CMDS and sid is not None and sid not in self._device_to_gw:
+            _LOGGER.debug("accept_message(): dropped %s of unknown sid %s", cmd, sid)
+            self._metrics.unknown_sids.inc(cmd)
+            return False
+        return True
+
+    def decode_error(self, data, src_addr, exc):
+        """Override: count the datagrams which can not be decoded"""
+        self._metrics.decode_errors.inc()
+        super().decode_error(data, src_addr, exc)
 
     def handle_message(self, msg, src_addr):
         """Override: handle_message implementation"""
         _LOGGER.debug("handle_message from %s", src_addr)
+        started = time.perf_counter()
 
-        cmd = msg["cmd"]
-        sid = msg["sid"]
-
-        if cmd == "iam":
-            addr = msg["ip"]
-            self.on_gateway_discovered(sid, addr)
-        elif cmd == "get_id_list_ack":
-            sids = _extract_data(msg)
-            self.on_devices_discovered(sid, sids)
-        elif cmd == "read_ack":
-            model = msg["model"]
-            data = _extract_data(msg)
-            self.on_read_ack(model, sid, data)
-        elif cmd == "write_ack":
-            if "model" not in msg:
-                _LOGGER.error("write error: %s", json.dumps(msg))
-                return
-            model = msg["model"]
-            data = _extract_data(msg)
-            self.on_write_ack(model, sid, data)
-        elif cmd == "report":
-            model = msg["model"]
-            data = _extract_data(msg)
-            self.on_report(model, sid, data)
-        elif cmd == "heartbeat":
-            model = msg["model"]
+        cmd = msg.get("cmd")
+        sid = msg.get("sid")
+        if cmd is None or sid is None:
+            self.decode_error(msg, src_addr, ValueError('missing cmd or sid'))
+            return
+        if self._dedup is not None and cmd in _DEDUP_CMDS \
+                and self._dedup.is_duplicate(_dedup_key(msg)):
+            _LOGGER.debug("handle_message(): dropped duplicate %s", cmd)
+            self._metrics.duplicates.inc(cmd)
+            return
+        try:
             data = _extract_data(msg)
-            gw_token = None if "token" not in msg else msg["token"]
-            self.on_heartbeat(model, sid, data, gw_token)
+        except (ValueError, TypeError) as exc:
+            self.decode_error(msg["data"], src_addr, exc)
+            return
+        if data is not None and not isinstance(data, _PAYLOAD_TYPES.get(cmd, object)):
+            self.decode_error(msg, src_addr, ValueError('unexpected payload of {}'.format(cmd)))
+            return
+        token = msg.get("token")
+        if token is not None:
+            self._on_token(sid, token)
+        route = self._routes.get(cmd)
+        if route is None:
+            _LOGGER.debug("handle_message(): no route for %s", cmd)
+            return
+        try:
+            route(sid, msg, data)
+        except (KeyError, TypeError, ValueError) as exc:
+            # e.g. a message without the fields of its command
+            self.decode_error(msg, src_addr, exc)
+            return
+        self._metrics.handler_latency.observe(time.perf_counter() - started, cmd)
+
+    def add_route(self, cmd, handler):
+        """Handle messages of 'cmd' with handler(sid, msg, data), replacing any handler"""
+        self._routes[cmd] = handler
+
+    def _route_iam(self, sid, msg, _data):
+        addr = msg["ip"]
+        if "port" in msg:
+            self.set_gateway_port(addr, int(msg["port"]))
+        self.on_gateway_discovered(sid, addr)
+
+    def _route_get_id_list_ack(self, sid, _msg, data):
+        self.on_devices_discovered(sid, data)
+
+    def _route_read_ack(self, sid, msg, data):
+        self.on_read_ack(msg["model"], sid, data)
+
+    def _route_write_ack(self, sid, msg, data):
+        if "model" not in msg:
+            _LOGGER.error("write error: %s", LazyJSON(msg))
+            self.on_write_error(sid, data or {})
+            return
+        self.on_write_ack(msg["model"], sid, data)
+
+    def _route_report(self, sid, msg, data):
+        self.on_report(msg["model"], sid, data)
+
+    def _route_heartbeat(self, sid, msg, data):
+        self.on_heartbeat(msg["model"], sid, data, msg.get("token"))
+
+    def handle_decoded(self, batch):
+        """Handle a batch of records of shard workers, see aqara.sharding.make_record"""
+        messages = []
+        for record in batch:
+            if record[0] == RECORD_MESSAGE:
+                _kind, src_addr, fields, payload = record
+                if self.accept_message(fields.get("cmd"), fields.get("sid")):
+                    messages.append((AqaraMessage.decoded(fields, payload), src_addr))
+            elif record[0] == RECORD_DROPPED:
+                _kind, cmd, sid = record
+                _LOGGER.debug("handle_decoded(): %s of unknown sid %s dropped by worker", cmd, sid)
+                self._metrics.datagrams.inc(cmd)
+                self._metrics.unknown_sids.inc(cmd)
+            else:
+                _kind, src_addr, data, cmd, reason = record
+                self._metrics.datagrams.inc(cmd)
+                self.decode_error(data, src_addr, ValueError(reason))
+        self.handle_messages(messages)
+        self._sync_shards()
+
+    def _sync_shards(self):
+        """push the known sids to the shard workers, which drop the reports of the others"""
+        if self._shards is not None:
+            self._shards.set_known_sids(self._device_to_gw)
 
     def on_gateway_discovered(self, gw_sid, gw_addr):
         """Called when a gateway is discovered"""
         _LOGGER.info("discovered gateway at %s [%s]", gw_sid, gw_addr)
-        gw_secret = None
-        if gw_sid in self._gw_secrets:
-            gw_secret = self._gw_secrets[gw_sid]
-        new_gateway = AqaraGateway(self, gw_sid, gw_addr, gw_secret)
-        self._gateways[gw_sid] = new_gateway
-        self._device_to_gw[gw_sid] = new_gateway
-        dispatcher.send(signal=AQARA_EVENT_NEW_GATEWAY, gateway=new_gateway, sender=self)
+        if gw_sid in self._gateways:
+            # known gateway, e.g. restored from a snapshot
+            self._gateways[gw_sid].update_addr(gw_addr)
+            return
+        self._add_gateway(gw_sid, gw_addr)
 
     def on_devices_discovered(self, gw_sid, sids):
         """Called when list of devices of gateway is returned."""
@@ -141,6 +421,10 @@ class AqaraClient(AqaraProtocol):
             _LOGGER.error("on_devices_discovered(): gateway %s not found", gw_sid)
             return
         gateway = self._gateways[gw_sid]
+        attached = set(sids)
+        for sid in [sid for sid in gateway.devices if sid != gw_sid and sid not in attached]:
+            gateway.remove_device(sid)
+            self._device_to_gw.pop(sid, None)
         for sid in sids:
             _LOGGER.info("found device %s on gateway %s", sid, gw_sid)
             self._device_to_gw[sid] = gateway
@@ -150,6 +434,7 @@ class AqaraClient(AqaraProtocol):
         """Called when a gateway send back ACK for a read request."""
         if sid not in self._device_to_gw:
             _LOGGER.error("on_read_ack(): sid not found %s", sid)
+            self._metrics.unknown_sids.inc("read_ack")
             return
 
         self._device_to_gw[sid].on_read_ack(model, sid, data)
@@ -158,13 +443,22 @@ class AqaraClient(AqaraProtocol):
         """Called when a gateway send back ACK for a write request."""
         if sid not in self._device_to_gw:
             _LOGGER.error("on_write_ack(): sid not found %s", sid)
+            self._metrics.unknown_sids.inc("write_ack")
             return
         self._device_to_gw[sid].on_write_ack(model, sid, data)
 
+    def on_write_error(self, sid, data):
+        """Called when a gateway rejects a write request."""
+        if sid not in self._device_to_gw:
+            _LOGGER.error("on_write_error(): sid not found %s", sid)
+            return
+        self._device_to_gw[sid].on_write_error(sid, data)
+
     def on_report(self, model, sid, data):
         """Called when a device sent a status report."""
         if sid not in self._device_to_gw:
             _LOGGER.warning("on_report(): sid not found %s", sid)
+            self._metrics.unknown_sids.inc("report")
             return
         self._device_to_gw[sid].on_device_report(model, sid, data)
 
@@ -172,12 +466,32 @@ class AqaraClient(AqaraProtocol):
         """Called when a heartbeat is received."""
         if sid not in self._device_to_gw:
             _LOGGER.warning("on_heartbeat(): sid not found %s", sid)
+            self._metrics.unknown_sids.inc("heartbeat")
             return
         self._device_to_gw[sid].on_device_heartbeat(model, sid, data, gw_token)
 
-    def subscribe(self, handle_new_gateway):
+    def _on_token(self, sid, token):
+        """hand the token of any message (not only heartbeats) to its gateway"""
+        gateway = self._device_to_gw.get(sid)
+        if gateway is not None:
+            gateway.on_token(token)
+
+    def _add_gateway(self, gw_sid, gw_addr):
+        gw_secret = None
+        if gw_sid in self._gw_secrets:
+            gw_secret = self._gw_secrets[gw_sid]
+        new_gateway = AqaraGateway(self, gw_sid, gw_addr, gw_secret, self._crypto_backend)
+        self._gateways[gw_sid] = new_gateway
+        self._device_to_gw[gw_sid] = new_gateway
+        self._liveness.track(new_gateway)
+        dispatcher.send(signal=AQARA_EVENT_NEW_GATEWAY, gateway=new_gateway, sender=self)
+        self._events.publish(EVENT_NEW_GATEWAY, gw_sid, new_gateway.model)
+        return new_gateway
+
+    def subscribe(self, handle_new_gateway, mode=MODE_INLINE):
         """Subscribe to gateway events."""
-        dispatcher.connect(handle_new_gateway, signal=AQARA_EVENT_NEW_GATEWAY, sender=self)
+        dispatcher.connect(handle_new_gateway, signal=AQARA_EVENT_NEW_GATEWAY, sender=self,
+                           mode=mode)
 
     def unsubscribe(self, handle_new_gateway):
         """Unsubscribe from gateway events."""
@@ -8,23 +8,107 @@ LISTEN_PORT = 9898
 
 GATEWAY_PORT = 9898
 
+# batched receive engine: datagrams handled per wakeup, receive buffer size
+RECEIVE_BATCH_SIZE = 256
+RECEIVE_BUFFER_SIZE = 65535
+
+# capture files: size before rotation (unit: bytes), rotated files kept and
+# write buffer (unit: bytes)
+AQARA_CAPTURE_MAX_BYTES = 64 * 1024 * 1024
+AQARA_CAPTURE_BACKUPS = 4
+AQARA_CAPTURE_BUFFER_SIZE = 64 * 1024
+
+# period of the traffic generator of the gateway simulator (unit: s)
+SIMULATOR_TICK = 0.01
+
 AQARA_DEVICE_HT = 'sensor_ht'
 AQARA_DEVICE_MOTION = 'motion'
 AQARA_DEVICE_MAGNET = 'magnet'
 AQARA_DEVICE_SWITCH = 'switch'
 AQARA_DEVICE_GATEWAY = 'gateway'
+AQARA_DEVICE_LEAK = 'sensor_wleak.aq1'
+AQARA_DEVICE_CUBE = 'cube'
+AQARA_DEVICE_PLUG = 'plug'
+AQARA_DEVICE_WALL_SWITCH = '86sw1'
+AQARA_DEVICE_WALL_SWITCH_DUAL = '86sw2'
+AQARA_DEVICE_WIRED_SWITCH = 'ctrl_neutral1'
+AQARA_DEVICE_WIRED_SWITCH_DUAL = 'ctrl_neutral2'
 
 AQARA_SWITCH_ACTION_CLICK = 'click'
 AQARA_SWITCH_ACTION_DOUBLE_CLICK = 'double_click'
 AQARA_SWITCH_ACTION_LONG_CLICK_PRESS = 'long_click_press'
 AQARA_SWITCH_ACTION_LONG_CLICK_RELEASE = 'long_click_release'
 
+AQARA_CUBE_ACTION_ROTATE = 'rotate'
+
 AQARA_MID_STOP = 10000
 
+# seconds to wait for the ack of a read / write
+AQARA_REQUEST_TIMEOUT = 5
+
+# pacing of the device refresh after get_id_list_ack
+AQARA_REFRESH_WINDOW = 4
+AQARA_REFRESH_RATE = 20
+AQARA_REFRESH_RETRY_TIMEOUT = 1.0
+AQARA_REFRESH_MAX_RETRIES = 3
+
+# pacing of writes, one write in flight per gateway
+AQARA_WRITE_RATE = 10
+AQARA_WRITE_ACK_TIMEOUT = 1.0
+
+# writes issued before the gateway token arrives are held (unit: s), longer
+# than two gateway heartbeats (every 10s), the first of which carries a token
+AQARA_TOKEN_WAIT = 25.0
+
+# outbound datagrams: total and per gateway rate (unit: per s), burst sent
+# without pacing
+AQARA_OUTBOUND_RATE = 100
+AQARA_OUTBOUND_GATEWAY_RATE = 50
+AQARA_OUTBOUND_BURST = 8
+
+# number of round-trip latencies kept per gateway
+AQARA_LATENCY_SAMPLES = 100
+
+# duplicate reports / heartbeats: window from the first copy (unit: s) and
+# number of keys remembered
+AQARA_DEDUP_WINDOW = 1.0
+AQARA_DEDUP_CAPACITY = 4096
+
+# workers of the thread / process pools of offloaded receivers (see aqara.dispatch)
+AQARA_EXECUTOR_WORKERS = 4
+
+# events queued per event stream (see aqara.stream)
+AQARA_STREAM_QUEUE_SIZE = 1024
+
+# liveness: timer wheel resolution (unit: s) and size, silence before a
+# device is offline per model (unit: s), gateways heartbeat every 10s and
+# sensors about every hour
+AQARA_LIVENESS_TICK = 1.0
+AQARA_LIVENESS_SLOTS = 512
+AQARA_LIVENESS_DEFAULT_INTERVAL = 7200
+AQARA_LIVENESS_INTERVALS = {
+    'gateway': 35,
+    'plug': 1800,
+    'ctrl_neutral1': 1800,
+    'ctrl_neutral2': 1800,
+}
+
+# histogram buckets of the metrics (unit: s)
+AQARA_LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                         0.05, 0.1, 0.5, 1.0, 5.0)
+AQARA_HEARTBEAT_GAP_BUCKETS = (5.0, 10.0, 11.0, 15.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# samples kept per device and field when the device history is enabled
+AQARA_HISTORY_SIZE = 256
+AQARA_HISTORY_FIELDS = ("voltage", "temperature", "humidity")
+
 AQARA_ENCRYPT_IV = b'\x17\x99\x6d\x09\x3d\x28\xdd\xb3\xba\x69\x5a\x2e\x6f\x58\x56\x2e'
 
 AQARA_EVENT_NEW_GATEWAY = 'aqara_new_gateway'
 AQARA_EVENT_NEW_DEVICE = 'aqara_new_device'
+AQARA_EVENT_REFRESH_PROGRESS = 'aqara_refresh_progress'
+AQARA_EVENT_AVAILABILITY = 'aqara_availability'
+AQARA_EVENT_FIELD_CHANGE = 'aqara_field_change'
 
 AQARA_DATA_VOLTAGE = "voltage"
 AQARA_DATA_STATUS = "status"
@@ -33,3 +117,10 @@ AQARA_DATA_HUMIDITY = "humidity"
 AQARA_DATA_ACTION = "action"
 AQARA_DATA_RGB = "rgb"
 AQARA_DATA_ILLUMINATION = "illumination"
+AQARA_DATA_ROTATE = "rotate"
+AQARA_DATA_INUSE = "inuse"
+AQARA_DATA_LOAD_POWER = "load_power"
+AQARA_DATA_POWER_CONSUMED = "power_consumed"
+AQARA_DATA_CHANNEL_0 = "channel_0"
+AQARA_DATA_CHANNEL_1 = "channel_1"
+AQARA_DATA_DUAL_CHANNEL = "dual_channel"
@@ -0,0 +1,99 @@
+"""
+Aqara Crypto
+
+Derive the write key of a gateway from its token, feature including
+- Pluggable AES backend: pycrypto / pycryptodome ("Crypto" package) or cryptography
+- Backends are imported lazily, on first use, and checked against a known answer
+"""
+
+import binascii
+
+from aqara.const import AQARA_ENCRYPT_IV
+
+CRYPTO_BACKEND_AUTO = "auto"
+CRYPTO_BACKEND_PYCRYPTO = "pycrypto"
+CRYPTO_BACKEND_CRYPTOGRAPHY = "cryptography"
+
+# order of preference when CRYPTO_BACKEND_AUTO is requested
+CRYPTO_BACKENDS = (CRYPTO_BACKEND_PYCRYPTO, CRYPTO_BACKEND_CRYPTOGRAPHY)
+
+# AES-128-CBC of a zero block, zero key and AQARA_ENCRYPT_IV
+_KNOWN_ANSWER = (b'\x00' * 16, b'\x00' * 16, '80623816fda0f721bb8142a8420411b1')
+
+_LOADED = {}
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+def _pycrypto_encrypt():
+    """AES-CBC with pycrypto, or pycryptodome which provides the same package"""
+    from Crypto.Cipher import AES
+
+    def encrypt(secret, data):
+        return AES.new(secret, AES.MODE_CBC, IV=AQARA_ENCRYPT_IV).encrypt(data)
+    return encrypt
+
+def _cryptography_encrypt():
+    """AES-CBC with cryptography"""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import (Cipher, algorithms, modes)
+    backend = default_backend()
+
+    def encrypt(secret, data):
+        encryptor = Cipher(algorithms.AES(secret), modes.CBC(AQARA_ENCRYPT_IV), backend).encryptor()
+        return encryptor.update(data) + encryptor.finalize()
+    return encrypt
+
+_BACKEND_LOADERS = {
+    CRYPTO_BACKEND_PYCRYPTO: _pycrypto_encrypt,
+    CRYPTO_BACKEND_CRYPTOGRAPHY: _cryptography_encrypt
+}
+
+def load_crypto_backend(name=CRYPTO_BACKEND_AUTO):
+    """Return the AES-CBC 'encrypt(secret, data)' function of backend 'name'.
+
+    Raise ImportError if the backend is not installed, ValueError if unknown.
+    """
+    if name in _LOADED:
+        return _LOADED[name]
+    if name == CRYPTO_BACKEND_AUTO:
+        for candidate in CRYPTO_BACKENDS:
+            try:
+                encrypt = load_crypto_backend(candidate)
+            except ImportError:
+                continue
+            _LOADED[name] = encrypt
+            return encrypt
+        raise ImportError('No AES backend installed, install one of: {}'.format(
+            ", ".join(CRYPTO_BACKENDS)))
+    if name not in _BACKEND_LOADERS:
+        raise ValueError('Unsupported crypto backend: {}'.format(name))
+    encrypt = _BACKEND_LOADERS[name]()
+    secret, data, expected = _KNOWN_ANSWER
+    try:
+        result = binascii.hexlify(encrypt(secret, data)).decode("utf-8")
+    except Exception as exc: # pylint: disable=broad-except
+        # e.g. a pycrypto build which does not work with this python version
+        raise ImportError('Crypto backend {} is not usable: {}'.format(name, exc))
+    if result != expected:
+        raise ImportError('Crypto backend {} failed its self test'.format(name))
+    _LOADED[name] = encrypt
+    return encrypt
+
+def available_crypto_backends():
+    """List the names of the crypto backends installed."""
+    names = []
+    for name in CRYPTO_BACKENDS:
+        try:
+            load_crypto_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def make_key(secret, token, backend=CRYPTO_BACKEND_AUTO):
+    """Return the write key (hex string) for gateway 'secret' and 'token'"""
+    encrypt = load_crypto_backend(backend)
+    return binascii.hexlify(encrypt(_to_bytes(secret), _to_bytes(token))).decode("utf-8")
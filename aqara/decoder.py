@@ -0,0 +1,139 @@
+"""
+Aqara Decoder
+
+Turn raw datagrams into messages, feature including
+- Pluggable JSON backend (orjson, ujson or the stdlib json module)
+- Decode straight from bytes, no intermediate str
+- Lazy decoding of the nested "data" payload
+- Peek at "cmd" / "sid" without decoding the datagram
+"""
+
+import json
+import re
+
+JSON_BACKEND_AUTO = "auto"
+JSON_BACKEND_ORJSON = "orjson"
+JSON_BACKEND_UJSON = "ujson"
+JSON_BACKEND_STDLIB = "json"
+
+# order of preference when JSON_BACKEND_AUTO is requested
+JSON_BACKENDS = (JSON_BACKEND_ORJSON, JSON_BACKEND_UJSON, JSON_BACKEND_STDLIB)
+
+_CMD_RE = re.compile(rb'"cmd"\s*:\s*"([^"\\]*)"')
+_SID_RE = re.compile(rb'"sid"\s*:\s*"([^"\\]*)"')
+
+_UNSET = object()
+
+def _stdlib_loads(data):
+    """json.loads which also accepts bytes on python < 3.6"""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+def load_json_backend(name=JSON_BACKEND_AUTO):
+    """Return the 'loads' function of JSON backend 'name'.
+
+    Raise ImportError if the backend is not installed, ValueError if unknown.
+    """
+    if name == JSON_BACKEND_AUTO:
+        for candidate in JSON_BACKENDS:
+            try:
+                return load_json_backend(candidate)
+            except ImportError:
+                continue
+    if name == JSON_BACKEND_ORJSON:
+        import orjson
+        return orjson.loads
+    if name == JSON_BACKEND_UJSON:
+        import ujson
+        return ujson.loads
+    if name == JSON_BACKEND_STDLIB:
+        return _stdlib_loads
+    raise ValueError('Unsupported JSON backend: {}'.format(name))
+
+def available_json_backends():
+    """List the names of the JSON backends installed."""
+    names = []
+    for name in JSON_BACKENDS:
+        try:
+            load_json_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+class AqaraMessage(dict):
+    """A decoded message.
+
+    Behaves as the plain dict of the outer message, the nested "data" field
+    stays an undecoded string until 'payload' is accessed.
+    """
+    __slots__ = ('_loads', '_payload')
+
+    def __init__(self, fields, loads=_stdlib_loads):
+        super().__init__(fields)
+        self._loads = loads
+        self._payload = _UNSET
+
+    @classmethod
+    def decoded(cls, fields, payload):
+        """Build a message from its outer fields and its already decoded payload"""
+        msg = cls(fields)
+        msg._payload = payload # pylint: disable=protected-access
+        return msg
+
+    @property
+    def cmd(self):
+        """property: cmd"""
+        return self.get("cmd")
+
+    @property
+    def sid(self):
+        """property: sid"""
+        return self.get("sid")
+
+    @property
+    def payload(self):
+        """property: decoded "data" field (decoded on first access)"""
+        if self._payload is _UNSET:
+            raw = self.get("data")
+            if isinstance(raw, (str, bytes)):
+                self._payload = self._loads(raw)
+            else:
+                self._payload = raw
+        return self._payload
+
+class AqaraDecoder(object):
+    """Datagram decoder with a pluggable JSON backend."""
+    def __init__(self, backend=JSON_BACKEND_AUTO):
+        self._loads = load_json_backend(backend)
+        self._backend = backend
+
+    @property
+    def backend(self):
+        """property: backend"""
+        return self._backend
+
+    def loads(self, data):
+        """Decode a JSON document with the selected backend."""
+        return self._loads(data)
+
+    @staticmethod
+    def peek(data):
+        """Return (cmd, sid) of a raw datagram without decoding it.
+
+        Either value is None if it can not be found.
+        """
+        cmd = _CMD_RE.search(data)
+        sid = _SID_RE.search(data)
+        return (
+            None if cmd is None else cmd.group(1).decode('utf-8'),
+            None if sid is None else sid.group(1).decode('utf-8')
+        )
+
+    def decode(self, data):
+        """Decode a raw datagram into an AqaraMessage, ValueError if it is not a JSON object."""
+        fields = self._loads(data)
+        if not isinstance(fields, dict):
+            raise ValueError('not a JSON object: {}'.format(type(fields).__name__))
+        return AqaraMessage(fields, self._loads)
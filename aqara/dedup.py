@@ -0,0 +1,53 @@
+"""
+Aqara Dedup
+
+Drop repeated copies of a multicast message, feature including
+- Keys expire 'window' seconds after their first copy
+- Bounded: the oldest keys are evicted past 'capacity'
+- Count of the duplicates dropped
+"""
+
+import time
+from collections import OrderedDict
+
+from aqara.const import (AQARA_DEDUP_WINDOW, AQARA_DEDUP_CAPACITY)
+
+class DuplicateFilter(object):
+    """Time-expiring set of the keys seen in the last 'window' seconds."""
+    def __init__(self, window=AQARA_DEDUP_WINDOW, capacity=AQARA_DEDUP_CAPACITY,
+                 clock=time.monotonic):
+        self._window = window
+        self._capacity = capacity
+        self._clock = clock
+        # key -> expiry, in order of expiry as the window is constant
+        self._expiry = OrderedDict()
+        self.dropped = 0
+
+    @property
+    def window(self):
+        """property: window (unit: s)"""
+        return self._window
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def is_duplicate(self, key):
+        """Return True if 'key' was seen within the window, else remember it"""
+        now = self._clock()
+        expiry = self._expiry
+        while expiry:
+            oldest = next(iter(expiry))
+            if expiry[oldest] > now:
+                break
+            del expiry[oldest]
+        if key in expiry:
+            self.dropped += 1
+            return True
+        expiry[key] = now + self._window
+        if len(expiry) > self._capacity:
+            expiry.popitem(last=False)
+        return False
+
+    def clear(self):
+        """Forget every key"""
+        self._expiry.clear()
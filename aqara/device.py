@@ -1,9 +1,24 @@
-"""Aqara Devices"""
+"""
+Aqara Devices
+
+Devices are thin __slots__ views, their state lives in the DeviceStore of
+the client (see aqara.store).
+
+Device classes are looked up by model in DEVICE_REGISTRY, new models are added
+with register_device_model. Each class maps the keys of its payloads to store
+columns and parsers (FIELDS), applied by do_update.
+
+do_update / do_heartbeat return the changed columns, update and heartbeat
+signals are only sent when something changed. Columns of EVENT_FIELDS (e.g.
+button actions) count as changed on every message which carries them.
+"""
 
-import json
 import logging
+import time
 
-from pydispatch import dispatcher
+from aqara.dispatch import (dispatcher, MODE_INLINE)
+from aqara.log import (message_enabled, log_message)
+from aqara.stream import (EVENT_UPDATE, EVENT_HEARTBEAT)
 from aqara.const import (
     AQARA_DEVICE_HT,
     AQARA_DEVICE_MOTION,
@@ -13,10 +28,27 @@ from aqara.const import (
     AQARA_SWITCH_ACTION_DOUBLE_CLICK,
     AQARA_SWITCH_ACTION_LONG_CLICK_PRESS,
     AQARA_SWITCH_ACTION_LONG_CLICK_RELEASE,
+    AQARA_CUBE_ACTION_ROTATE,
+    AQARA_DEVICE_LEAK,
+    AQARA_DEVICE_CUBE,
+    AQARA_DEVICE_PLUG,
+    AQARA_DEVICE_WALL_SWITCH,
+    AQARA_DEVICE_WALL_SWITCH_DUAL,
+    AQARA_DEVICE_WIRED_SWITCH,
+    AQARA_DEVICE_WIRED_SWITCH_DUAL,
+    AQARA_EVENT_AVAILABILITY,
+    AQARA_EVENT_FIELD_CHANGE,
     AQARA_DATA_VOLTAGE,
     AQARA_DATA_STATUS,
     AQARA_DATA_TEMPERATURE,
-    AQARA_DATA_HUMIDITY
+    AQARA_DATA_HUMIDITY,
+    AQARA_DATA_ROTATE,
+    AQARA_DATA_INUSE,
+    AQARA_DATA_LOAD_POWER,
+    AQARA_DATA_POWER_CONSUMED,
+    AQARA_DATA_CHANNEL_0,
+    AQARA_DATA_CHANNEL_1,
+    AQARA_DATA_DUAL_CHANNEL
 )
 
 HASS_UPDATE_SIGNAL = "update_hass_sensor"
@@ -31,31 +63,118 @@ BUTTON_ACTION_MAP = {
     "long_click_release": AQARA_SWITCH_ACTION_LONG_CLICK_RELEASE
 }
 
+# switch actions as stored in the "action" column (index, -1 for None)
+BUTTON_ACTIONS = (
+    AQARA_SWITCH_ACTION_CLICK,
+    AQARA_SWITCH_ACTION_DOUBLE_CLICK,
+    AQARA_SWITCH_ACTION_LONG_CLICK_PRESS,
+    AQARA_SWITCH_ACTION_LONG_CLICK_RELEASE
+)
+BUTTON_ACTION_CODES = {action: code for code, action in enumerate(BUTTON_ACTIONS)}
+
+CUBE_ACTIONS = (
+    "flip90", "flip180", "move", "tap_twice", "shake_air", "swing", "alert", "free_fall",
+    AQARA_CUBE_ACTION_ROTATE
+)
+CUBE_ACTION_CODES = {action: code for code, action in enumerate(CUBE_ACTIONS)}
+
+WALL_SWITCH_ACTIONS = ("click", "double_click", "long_click", "both_click")
+
+# model -> device class, see register_device_model
+DEVICE_REGISTRY = {}
+
+def register_device_model(model, device_class):
+    """Create the devices of 'model' as device_class(gateway, sid, model)"""
+    device_class._decoders = tuple( # pylint: disable=protected-access
+        (key, column, parse) for key, (column, parse) in device_class.FIELDS.items())
+    DEVICE_REGISTRY[model] = device_class
+    return device_class
+
+def field_signal(field):
+    """Return the signal sent when column 'field' of a device changes"""
+    return (AQARA_EVENT_FIELD_CHANGE, field)
+
+def add_model_columns(store, model):
+    """Add the columns of the devices of 'model' to 'store', e.g. before restoring their state"""
+    device_class = DEVICE_REGISTRY.get(model)
+    if device_class is None:
+        raise RuntimeError('Unsupported device type: {}'.format(model))
+    for name, (typecode, default) in device_class.COLUMNS.items():
+        store.add_column(name, typecode, default)
+
 def create_device(gateway, model, sid):
     """Device factory"""
-    if model == AQARA_DEVICE_HT:
-        return AqaraHTSensor(gateway, sid)
-    elif model == AQARA_DEVICE_MOTION:
-        return AqaraMotionSensor(gateway, sid)
-    elif model == AQARA_DEVICE_MAGNET:
-        return AqaraContactSensor(gateway, sid)
-    elif model == AQARA_DEVICE_SWITCH:
-        return AqaraSwitchSensor(gateway, sid)
-    else:
+    device_class = DEVICE_REGISTRY.get(model)
+    if device_class is None:
         raise RuntimeError('Unsupported device type: {} [{}]'.format(model, sid))
+    return device_class(gateway, sid, model)
+
+# parsers of raw payload values, None (or ValueError / TypeError) for an
+# invalid value (see FIELDS)
+
+def parse_centi(str_value):
+    """parse values in hundredths, e.g. sensor_ht "2351" -> 23.5"""
+    return round(int(str_value) / 100, 1)
+
+def parse_angle(str_value):
+    """parse a rotation angle, e.g. "-45" or "45,500" (angle, duration)"""
+    return int(str(str_value).split(",")[0])
+
+def parse_flag(true_value, false_value):
+    """Return a parser of values which are 'true_value' or 'false_value'"""
+    return {true_value: True, false_value: False}.get
+
+def parse_code(values):
+    """Return a parser of the index of a value in 'values'"""
+    codes = {value: code for code, value in enumerate(values)}
+    return codes.get
+
+def decode_code(values, code):
+    """Return the value of index 'code' in 'values', None for -1"""
+    return None if code < 0 else values[code]
+
+# decoders of stored values into the values of the properties (see DECODERS)
+
+def decode_codes(values):
+    """Return a decoder of the index of a value in 'values'"""
+    return lambda code: decode_code(values, code)
+
+def decode_flag(value):
+    """decode a flag column, 1 -> True"""
+    return value == 1
+
+def decode_unset(value):
+    """decode a column where 0 is unset, 0 -> None"""
+    return None if value == 0 else value
 
 class AqaraBaseDevice(object):
     """AqaraBaseDevice"""
+    __slots__ = ('_gateway', '_model', '_store', '_index', '__weakref__')
+    # raw payload key -> (store column, parser), applied by do_update
+    FIELDS = {}
+    # columns of the model missing from STORE_COLUMNS: name -> (typecode, default)
+    COLUMNS = {}
+    # heartbeats carry the same state as reports
+    HEARTBEAT_STATE = False
+    # columns of events, changed whenever they are received
+    EVENT_FIELDS = frozenset()
+    # store column -> decoder of its values, as returned by the property
+    DECODERS = {"voltage": decode_unset}
+    # FIELDS as a tuple of (key, column, parser), see register_device_model
+    _decoders = ()
+
     def __init__(self, model, gateway, sid):
         self._gateway = gateway
         self._model = model
-        self._sid = sid
-        self._voltage = None
+        self._store = gateway.store
+        for name, (typecode, default) in self.COLUMNS.items():
+            self._store.add_column(name, typecode, default)
+        self._index = self._store.add(sid)
 
     @property
     def sid(self):
         """property: sid"""
-        return self._sid
+        return self._store.sid(self._index)
 
     @property
     def model(self):
@@ -65,151 +184,405 @@ class AqaraBaseDevice(object):
     @property
     def voltage(self):
         """property: voltage"""
-        return self._voltage
+        voltage = self._store.voltage[self._index]
+        return None if voltage == 0 else voltage
+
+    @property
+    def available(self):
+        """property: not reported offline by the liveness tracker"""
+        return self._store.offline[self._index] == 0
+
+    @property
+    def last_seen(self):
+        """property: time of the last report or heartbeat (unit: s since epoch)"""
+        last_seen = self._store.last_seen[self._index]
+        return None if last_seen == 0 else last_seen
 
-    def subscribe_update(self, handle_update):
-        """subscribe to sensor update event"""
-        dispatcher.connect(handle_update, signal=HASS_UPDATE_SIGNAL, sender=self)
+    def subscribe_update(self, handle_update, mode=MODE_INLINE):
+        """subscribe to sensor update event, see aqara.dispatch for the modes"""
+        dispatcher.connect(handle_update, signal=HASS_UPDATE_SIGNAL, sender=self, mode=mode)
 
     def unsubscribe_update(self, handle_update):
         """unsubscribe from sensor update event"""
         dispatcher.disconnect(handle_update, signal=HASS_UPDATE_SIGNAL, sender=self)
 
-    def subscribe_heartbeat(self, handle_heartbeat):
+    def subscribe_heartbeat(self, handle_heartbeat, mode=MODE_INLINE):
         """subscirbe to sensor heartbeat event"""
-        dispatcher.connect(handle_heartbeat, signal=HASS_HEARTBEAT_SIGNAL, sender=self)
+        dispatcher.connect(handle_heartbeat, signal=HASS_HEARTBEAT_SIGNAL, sender=self,
+                           mode=mode)
 
     def unsubscribe_heartbeat(self, handle_heartbeat):
         """unsubscribe from sensor heartbeat event"""
         dispatcher.disconnect(handle_heartbeat, signal=HASS_HEARTBEAT_SIGNAL, sender=self)
 
+    def subscribe_field(self, field, handle_change, mode=MODE_INLINE):
+        """subscribe to changes of column 'field', handle_change(field, old, new)"""
+        dispatcher.connect(handle_change, signal=field_signal(field), sender=self, mode=mode)
+
+    def unsubscribe_field(self, field, handle_change):
+        """unsubscribe from changes of column 'field'"""
+        dispatcher.disconnect(handle_change, signal=field_signal(field), sender=self)
+
+    def subscribe_availability(self, handle_availability, mode=MODE_INLINE):
+        """subscribe to offline / online events, handle_availability(available)"""
+        dispatcher.connect(handle_availability, signal=AQARA_EVENT_AVAILABILITY, sender=self,
+                           mode=mode)
+
+    def unsubscribe_availability(self, handle_availability):
+        """unsubscribe from offline / online events"""
+        dispatcher.disconnect(handle_availability, signal=AQARA_EVENT_AVAILABILITY, sender=self)
+
     def update_now(self):
         """force read sensor data"""
-        self._gateway.read_device(self._sid)
+        self._gateway.read_device(self.sid)
 
     def on_update(self, data):
         """handler for sensor data update"""
-        self.log_info("on_update: {}".format(json.dumps(data)))
-        if AQARA_DATA_VOLTAGE in data:
-            self._voltage = data[AQARA_DATA_VOLTAGE]
-        self.do_update(data)
-        dispatcher.send(signal=HASS_UPDATE_SIGNAL, sender=self)
+        if message_enabled(logging.INFO):
+            log_message(logging.INFO, "on_update", self.sid, self._model, data)
+        now = time.time()
+        self.seen(now)
+        changes = self.do_update(data)
+        self._update_voltage(data, changes)
+        if self._store.history is not None:
+            self._store.history.record(self._index, data, now)
+        self._notify(HASS_UPDATE_SIGNAL, EVENT_UPDATE, changes)
 
     def on_heartbeat(self, data):
         """handler for heartbeat"""
-        self.log_info("on_heartbeat: {}".format(json.dumps(data)))
-        if AQARA_DATA_VOLTAGE in data:
-            self._voltage = data[AQARA_DATA_VOLTAGE]
-        self.do_heartbeat(data)
-        dispatcher.send(signal=HASS_HEARTBEAT_SIGNAL, sender=self)
+        if message_enabled(logging.INFO):
+            log_message(logging.INFO, "on_heartbeat", self.sid, self._model, data)
+        now = time.time()
+        self.seen(now)
+        changes = self.do_heartbeat(data)
+        self._update_voltage(data, changes)
+        if self._store.history is not None:
+            self._store.history.record(self._index, data, now)
+        self._notify(HASS_HEARTBEAT_SIGNAL, EVENT_HEARTBEAT, changes)
+
+    def seen(self, now):
+        """stamp last_seen, back online if the device was offline"""
+        self._store.last_seen[self._index] = now
+        if self._store.offline[self._index]:
+            self._store.liveness.seen(self)
 
     def do_update(self, data):
-        """update sensor state according to data"""
-        pass
+        """update sensor state according to data, see FIELDS
+
+        Return the changes as {column: (old value, new value)}, values as
+        returned by the properties (see DECODERS), None if unknown (every
+        change is notified).
+        """
+        columns = self._store.columns_by_name
+        changes = {}
+        for key, column, parse in self._decoders:
+            raw = data.get(key)
+            if raw is None:
+                continue
+            try:
+                value = parse(raw)
+            except (ValueError, TypeError):
+                value = None
+            if value is None:
+                self.log_warning('invalid %s: %s', key, raw)
+                continue
+            self._set(columns[column], column, value, changes)
+        return changes
 
     def do_heartbeat(self, data):
-        """update heartbeat"""
-        pass
-
-    def log_warning(self, msg):
-        """log warning"""
-        self._log(_LOGGER.warning, msg)
-
-    def log_info(self, msg):
+        """update heartbeat, return the changes like do_update"""
+        if self.HEARTBEAT_STATE:
+            return self.do_update(data)
+        return {}
+
+    def _set(self, values, column, value, changes):
+        """set the column 'values' of this device, record a change in 'changes'"""
+        index = self._index
+        old = values[index]
+        values[index] = value
+        # read back, the store casts to the column type
+        new = values[index]
+        if new != old or column in self.EVENT_FIELDS:
+            decode = self.DECODERS.get(column)
+            if decode is not None:
+                old, new = decode(old), decode(new)
+            changes[column] = (old, new)
+
+    def _update_voltage(self, data, changes):
+        if AQARA_DATA_VOLTAGE in data:
+            voltage = int(data[AQARA_DATA_VOLTAGE])
+            if changes is None:
+                self._store.voltage[self._index] = voltage
+            else:
+                self._set(self._store.voltage, "voltage", voltage, changes)
+
+    def _notify(self, signal, kind, changes):
+        """send 'signal' and the field signals, unless nothing changed"""
+        if changes is not None:
+            if not changes:
+                return
+            for field, (old, new) in changes.items():
+                dispatcher.send(signal=field_signal(field), sender=self,
+                                field=field, old=old, new=new)
+        dispatcher.send(signal=signal, sender=self, changes=changes)
+        events = self._store.events
+        if events is not None and events.streams:
+            events.publish(kind, self.sid, self._model, changes)
+
+    def log_warning(self, msg, *args):
+        """log warning, msg % args is only formatted if the record is emitted"""
+        self._log(logging.WARNING, msg, args)
+
+    def log_info(self, msg, *args):
         """log info"""
-        self._log(_LOGGER.info, msg)
+        self._log(logging.INFO, msg, args)
 
-    def log_debug(self, msg):
+    def log_debug(self, msg, *args):
         """log debug"""
-        self._log(_LOGGER.debug, msg)
+        self._log(logging.DEBUG, msg, args)
 
-    def _log(self, log_func, msg):
+    def _log(self, level, msg, args):
         """log"""
-        log_func('%s [%s]: %s', self.sid, self.model, msg)
+        if not _LOGGER.isEnabledFor(level):
+            return
+        if args:
+            _LOGGER.log(level, '%s [%s]: ' + msg, self.sid, self.model, *args)
+        else:
+            _LOGGER.log(level, '%s [%s]: %s', self.sid, self.model, msg)
 
 class AqaraHTSensor(AqaraBaseDevice):
     """AqaraHTSensor"""
-    def __init__(self, gateway, sid):
-        super().__init__(AQARA_DEVICE_HT, gateway, sid)
-        self._temperature = 0
-        self._humidity = 0
+    __slots__ = ()
+    FIELDS = {
+        AQARA_DATA_TEMPERATURE: ("temperature", parse_centi),
+        AQARA_DATA_HUMIDITY: ("humidity", parse_centi),
+    }
+    # heartbeat for HT sensor contains the same data as report
+    HEARTBEAT_STATE = True
+
+    parse_value = staticmethod(parse_centi)
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_HT):
+        super().__init__(model, gateway, sid)
 
     @property
     def temperature(self):
         """property: temperature (unit: C)"""
-        return self._temperature
+        return self._store.temperature[self._index]
 
     @property
     def humidity(self):
         """property: humidity (unit: %)"""
-        return self._humidity
-
-    def do_update(self, data):
-        if AQARA_DATA_TEMPERATURE in data:
-            self._temperature = self.parse_value(data[AQARA_DATA_TEMPERATURE])
-        if AQARA_DATA_HUMIDITY in data:
-            self._humidity = self.parse_value(data[AQARA_DATA_HUMIDITY])
-
-    def do_heartbeat(self, data):
-        # heartbeat for HT sensor contains the same data as report
-        self.do_update(data)
-
-    @staticmethod
-    def parse_value(str_value):
-        """parse sensor_ht values"""
-        return round(int(str_value) / 100, 1)
-
+        return self._store.humidity[self._index]
 
 class AqaraContactSensor(AqaraBaseDevice):
     """AqaraContactSensor"""
-    def __init__(self, gateway, sid):
-        super().__init__(AQARA_DEVICE_MAGNET, gateway, sid)
-        self._triggered = False
+    __slots__ = ()
+    FIELDS = {AQARA_DATA_STATUS: ("triggered", parse_flag("open", "close"))}
+    DECODERS = dict(AqaraBaseDevice.DECODERS, triggered=decode_flag)
+    HEARTBEAT_STATE = True
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_MAGNET):
+        super().__init__(model, gateway, sid)
 
     @property
     def triggered(self):
         """property: triggered (bool)"""
-        return self._triggered
-
-    def do_update(self, data):
-        if AQARA_DATA_STATUS in data:
-            self._triggered = data[AQARA_DATA_STATUS] == "open"
-
-    def do_heartbeat(self, data):
-        self.do_update(data)
+        return self._store.triggered[self._index] == 1
 
 class AqaraMotionSensor(AqaraBaseDevice):
     """AqaraMotionSensor"""
-    def __init__(self, gateway, sid):
-        super().__init__(AQARA_DEVICE_MOTION, gateway, sid)
-        self._triggered = False
+    __slots__ = ()
+    FIELDS = {AQARA_DATA_STATUS: ("triggered", parse_flag("motion", "no_motion"))}
+    DECODERS = dict(AqaraBaseDevice.DECODERS, triggered=decode_flag)
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_MOTION):
+        super().__init__(model, gateway, sid)
 
     @property
     def triggered(self):
         """property: triggered (bool)"""
-        return self._triggered
+        return self._store.triggered[self._index] == 1
 
     def do_update(self, data):
-        if AQARA_DATA_STATUS in data:
-            self._triggered = data[AQARA_DATA_STATUS] == "motion"
-        else:
-            self._triggered = False
+        # any other report, e.g. {"no_motion": "120"}, clears the motion
+        motion = data.get(AQARA_DATA_STATUS) == "motion"
+        changes = {}
+        self._set(self._store.triggered, "triggered", motion, changes)
+        if motion and not changes:
+            # motion again, e.g. to extend an occupancy timer
+            changes["triggered"] = (True, True)
+        return changes
+
+class AqaraLeakSensor(AqaraContactSensor):
+    """AqaraLeakSensor"""
+    __slots__ = ()
+    FIELDS = {AQARA_DATA_STATUS: ("triggered", parse_flag("leak", "no_leak"))}
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_LEAK):
+        super().__init__(gateway, sid, model)
 
 class AqaraSwitchSensor(AqaraBaseDevice):
-    """AqaraMotionSensor"""
-    def __init__(self, gateway, sid):
-        super().__init__(AQARA_DEVICE_SWITCH, gateway, sid)
-        self._action = None
+    """AqaraSwitchSensor"""
+    __slots__ = ()
+    FIELDS = {AQARA_DATA_STATUS: ("action", parse_code(BUTTON_ACTIONS))}
+    EVENT_FIELDS = frozenset(["action"])
+    DECODERS = dict(AqaraBaseDevice.DECODERS, action=decode_codes(BUTTON_ACTIONS))
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_SWITCH):
+        super().__init__(model, gateway, sid)
 
     @property
     def action(self):
         """property: last_action"""
-        return self._action
+        return decode_code(BUTTON_ACTIONS, self._store.action[self._index])
+
+class AqaraCube(AqaraBaseDevice):
+    """AqaraCube"""
+    __slots__ = ()
+    FIELDS = {
+        AQARA_DATA_STATUS: ("action", parse_code(CUBE_ACTIONS)),
+        AQARA_DATA_ROTATE: ("rotation", parse_angle),
+    }
+    COLUMNS = {"rotation": ('h', 0)}
+    EVENT_FIELDS = frozenset(["action", "rotation"])
+    DECODERS = dict(AqaraBaseDevice.DECODERS, action=decode_codes(CUBE_ACTIONS))
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_CUBE):
+        super().__init__(model, gateway, sid)
+
+    @property
+    def action(self):
+        """property: last action (flip90, rotate, shake_air, ...)"""
+        return decode_code(CUBE_ACTIONS, self._store.action[self._index])
+
+    @property
+    def rotation(self):
+        """property: angle of the last rotation (unit: degree)"""
+        return self._store.rotation[self._index]
 
     def do_update(self, data):
-        if AQARA_DATA_STATUS in data:
-            status = data[AQARA_DATA_STATUS]
-            if status in BUTTON_ACTION_MAP:
-                self._action = BUTTON_ACTION_MAP[status]
-            else:
-                self.log_warning('invalid status: {}' % status)
+        changes = super().do_update(data)
+        if "rotation" in changes:
+            self._set(self._store.action, "action", CUBE_ACTION_CODES[AQARA_CUBE_ACTION_ROTATE],
+                      changes)
+        return changes
+
+class AqaraPlug(AqaraBaseDevice):
+    """AqaraPlug"""
+    __slots__ = ()
+    FIELDS = {
+        AQARA_DATA_STATUS: ("power_on", parse_flag("on", "off")),
+        AQARA_DATA_INUSE: ("in_use", parse_flag("1", "0")),
+        AQARA_DATA_LOAD_POWER: ("load_power", float),
+        AQARA_DATA_POWER_CONSUMED: ("power_consumed", float),
+    }
+    COLUMNS = {
+        "power_on": ('b', 0),
+        "in_use": ('b', 0),
+        "load_power": ('d', 0.0),
+        "power_consumed": ('d', 0.0),
+    }
+    DECODERS = dict(AqaraBaseDevice.DECODERS, power_on=decode_flag, in_use=decode_flag)
+    HEARTBEAT_STATE = True
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_PLUG):
+        super().__init__(model, gateway, sid)
+
+    @property
+    def is_on(self):
+        """property: plug switched on (bool)"""
+        return self._store.power_on[self._index] == 1
+
+    @property
+    def in_use(self):
+        """property: a load is drawing power (bool)"""
+        return self._store.in_use[self._index] == 1
+
+    @property
+    def load_power(self):
+        """property: load power (unit: W)"""
+        return self._store.load_power[self._index]
+
+    @property
+    def power_consumed(self):
+        """property: energy consumed (unit: Wh)"""
+        return self._store.power_consumed[self._index]
+
+    def turn_on(self):
+        """switch the plug on"""
+        self._gateway.write_device(self, {AQARA_DATA_STATUS: "on"})
+
+    def turn_off(self):
+        """switch the plug off"""
+        self._gateway.write_device(self, {AQARA_DATA_STATUS: "off"})
+
+class AqaraWallSwitch(AqaraBaseDevice):
+    """AqaraWallSwitch, wireless (86sw1, 86sw2)"""
+    __slots__ = ()
+    FIELDS = {
+        AQARA_DATA_CHANNEL_0: ("action", parse_code(WALL_SWITCH_ACTIONS)),
+        AQARA_DATA_CHANNEL_1: ("action_1", parse_code(WALL_SWITCH_ACTIONS)),
+        AQARA_DATA_DUAL_CHANNEL: ("action_both", parse_code(WALL_SWITCH_ACTIONS)),
+    }
+    COLUMNS = {"action_1": ('b', -1), "action_both": ('b', -1)}
+    EVENT_FIELDS = frozenset(["action", "action_1", "action_both"])
+    DECODERS = dict(AqaraBaseDevice.DECODERS, action=decode_codes(WALL_SWITCH_ACTIONS),
+                    action_1=decode_codes(WALL_SWITCH_ACTIONS),
+                    action_both=decode_codes(WALL_SWITCH_ACTIONS))
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_WALL_SWITCH):
+        super().__init__(model, gateway, sid)
+
+    @property
+    def action(self):
+        """property: last action of the (left) button"""
+        return decode_code(WALL_SWITCH_ACTIONS, self._store.action[self._index])
+
+    @property
+    def action_1(self):
+        """property: last action of the right button (86sw2)"""
+        return decode_code(WALL_SWITCH_ACTIONS, self._store.action_1[self._index])
+
+    @property
+    def action_both(self):
+        """property: last action of both buttons together (86sw2)"""
+        return decode_code(WALL_SWITCH_ACTIONS, self._store.action_both[self._index])
+
+class AqaraWiredWallSwitch(AqaraBaseDevice):
+    """AqaraWiredWallSwitch (ctrl_neutral1, ctrl_neutral2)"""
+    __slots__ = ()
+    FIELDS = {
+        AQARA_DATA_CHANNEL_0: ("channel_0", parse_flag("on", "off")),
+        AQARA_DATA_CHANNEL_1: ("channel_1", parse_flag("on", "off")),
+    }
+    COLUMNS = {"channel_0": ('b', 0), "channel_1": ('b', 0)}
+    DECODERS = dict(AqaraBaseDevice.DECODERS, channel_0=decode_flag, channel_1=decode_flag)
+    HEARTBEAT_STATE = True
+
+    def __init__(self, gateway, sid, model=AQARA_DEVICE_WIRED_SWITCH):
+        super().__init__(model, gateway, sid)
+
+    def is_channel_on(self, channel=0):
+        """Check if 'channel' (0 or 1) is switched on"""
+        return self._store.column("channel_{}".format(channel))[self._index] == 1
+
+    def turn_on(self, channel=0):
+        """switch 'channel' on"""
+        self._gateway.write_device(self, {"channel_{}".format(channel): "on"})
+
+    def turn_off(self, channel=0):
+        """switch 'channel' off"""
+        self._gateway.write_device(self, {"channel_{}".format(channel): "off"})
+
+register_device_model(AQARA_DEVICE_HT, AqaraHTSensor)
+register_device_model(AQARA_DEVICE_MOTION, AqaraMotionSensor)
+register_device_model(AQARA_DEVICE_MAGNET, AqaraContactSensor)
+register_device_model(AQARA_DEVICE_SWITCH, AqaraSwitchSensor)
+register_device_model(AQARA_DEVICE_LEAK, AqaraLeakSensor)
+register_device_model(AQARA_DEVICE_CUBE, AqaraCube)
+register_device_model(AQARA_DEVICE_PLUG, AqaraPlug)
+register_device_model(AQARA_DEVICE_WALL_SWITCH, AqaraWallSwitch)
+register_device_model(AQARA_DEVICE_WALL_SWITCH_DUAL, AqaraWallSwitch)
+register_device_model(AQARA_DEVICE_WIRED_SWITCH, AqaraWiredWallSwitch)
+register_device_model(AQARA_DEVICE_WIRED_SWITCH_DUAL, AqaraWiredWallSwitch)
@@ -0,0 +1,311 @@
+"""
+Aqara Event Bus
+
+Signal dispatcher used for gateway, device and sensor events, feature including
+- Receivers indexed by (signal, sender), one dict lookup per send
+- Receiver signatures inspected once, when connected
+- Weak references to receivers and senders
+- Per receiver execution mode: inline, on the loop, in a thread or process
+  pool, in order per sender
+- Time spent per receiver (see timings)
+
+It follows the pydispatch calling convention: receivers are called with the
+keyword arguments they accept out of 'signal', 'sender' and the named
+arguments of send().
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import logging
+import time
+import weakref
+
+from aqara.const import AQARA_EXECUTOR_WORKERS
+
+_LOGGER = logging.getLogger(__name__)
+
+# called by send()
+MODE_INLINE = "inline"
+# called soon by the event loop
+MODE_LOOP = "loop"
+# called in a thread pool, one call at a time per sender
+MODE_THREAD = "thread"
+# called in a process pool, one call at a time per sender. The receiver and
+# the arguments must be picklable, the sender is passed as its sid.
+MODE_PROCESS = "process"
+
+MODES = (MODE_INLINE, MODE_LOOP, MODE_THREAD, MODE_PROCESS)
+
+def _receiver_id(receiver):
+    """identity of a receiver, bound methods are identified by (object, function)"""
+    if inspect.ismethod(receiver):
+        return (id(receiver.__self__), id(receiver.__func__))
+    return id(receiver)
+
+def _receiver_name(receiver):
+    name = getattr(receiver, "__qualname__", None)
+    if name is None:
+        return repr(receiver)
+    return "{}.{}".format(getattr(receiver, "__module__", "?"), name)
+
+def _call(receiver, args):
+    """call in an executor, module level to be picklable
+
+    Return (response, elapsed), timed in the worker so the time spent queued
+    in the executor is not accounted to the receiver.
+    """
+    started = time.perf_counter()
+    response = receiver(**args)
+    return response, time.perf_counter() - started
+
+def _accepted_names(receiver):
+    """keyword arguments accepted by 'receiver', None if it accepts any"""
+    try:
+        signature = inspect.signature(receiver)
+    except (TypeError, ValueError):
+        return None
+    names = []
+    for param in signature.parameters.values():
+        if param.kind == param.VAR_KEYWORD:
+            return None
+        if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+            names.append(param.name)
+    return tuple(names)
+
+class _Receiver(object):
+    """A connected receiver with its precomputed call signature."""
+    __slots__ = ('receiver_id', 'names', 'mode', 'name', 'calls', 'seconds', 'slowest',
+                 '_ref', '_strong')
+
+    def __init__(self, receiver, weak, on_dead, mode=MODE_INLINE):
+        self.receiver_id = _receiver_id(receiver)
+        self.names = _accepted_names(receiver)
+        self.mode = mode
+        self.name = _receiver_name(receiver)
+        self.calls = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self._ref = None
+        self._strong = receiver
+        if weak:
+            ref_type = weakref.WeakMethod if inspect.ismethod(receiver) else weakref.ref
+            try:
+                self._ref = ref_type(receiver, lambda _ref: on_dead(self))
+                self._strong = None
+            except TypeError:
+                # not weak referenceable (e.g. builtins), keep a strong reference
+                pass
+
+    def resolve(self):
+        """Return the receiver, None if it has been garbage collected"""
+        if self._strong is not None:
+            return self._strong
+        return self._ref()
+
+    def call(self, receiver, args):
+        """Call 'receiver' with the arguments it accepts out of 'args'"""
+        names = self.names
+        if names is None:
+            return receiver(**args)
+        if not names:
+            return receiver()
+        return receiver(**{name: args[name] for name in names if name in args})
+
+    def arguments(self, args):
+        """Return a copy of the arguments accepted out of 'args'"""
+        names = self.names
+        if names is None:
+            return dict(args)
+        return {name: args[name] for name in names if name in args}
+
+    def record(self, elapsed):
+        """Account a call which took 'elapsed' seconds"""
+        self.calls += 1
+        self.seconds += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+
+class EventBus(object):
+    """Event bus keyed on (signal, sender)."""
+    def __init__(self):
+        self._receivers = {}
+        self._senders = {}
+        # time inline receivers, offloaded receivers are always timed
+        self.timing = False
+        self._executors = {}
+        # (receiver id, sender id) -> deque of pending offloaded calls
+        self._serial = {}
+
+    def connect(self, receiver, signal, sender, weak=True, mode=MODE_INLINE):
+        """Connect 'receiver' to 'signal' sent by 'sender', called as per 'mode'."""
+        if mode not in MODES:
+            raise ValueError('Unsupported execution mode: {}'.format(mode))
+        key = (signal, id(sender))
+        receiver_id = _receiver_id(receiver)
+        receivers = self._receivers.get(key, ())
+        if any(entry.receiver_id == receiver_id for entry in receivers):
+            return
+
+        def on_dead(entry):
+            self._remove(key, entry)
+
+        entry = _Receiver(receiver, weak, on_dead, mode)
+        # copy on write, so send() can iterate without copying
+        self._receivers[key] = tuple(receivers) + (entry,)
+        self._track_sender(sender, signal)
+
+    def disconnect(self, receiver, signal, sender):
+        """Disconnect 'receiver' from 'signal' sent by 'sender'."""
+        key = (signal, id(sender))
+        receiver_id = _receiver_id(receiver)
+        for entry in self._receivers.get(key, ()):
+            if entry.receiver_id == receiver_id:
+                self._remove(key, entry)
+                return
+
+    def send(self, signal, sender, **named):
+        """Send 'signal' from 'sender' to all connected receivers.
+
+        Return a list of (receiver, response) like pydispatch, the response
+        of a receiver in a pool is a future, None on the loop.
+        """
+        receivers = self._receivers.get((signal, id(sender)))
+        if not receivers:
+            return []
+        named['signal'] = signal
+        named['sender'] = sender
+        responses = []
+        for entry in receivers:
+            receiver = entry.resolve()
+            if receiver is None:
+                continue
+            if entry.mode != MODE_INLINE:
+                response = self._offload(entry, receiver, named, sender)
+            elif self.timing:
+                started = time.perf_counter()
+                response = entry.call(receiver, named)
+                entry.record(time.perf_counter() - started)
+            else:
+                response = entry.call(receiver, named)
+            responses.append((receiver, response))
+        return responses
+
+    def timings(self):
+        """Return [(receiver name, mode, calls, seconds, slowest call)], slowest total first"""
+        entries = set()
+        for receivers in self._receivers.values():
+            entries.update(receivers)
+        timings = [(entry.name, entry.mode, entry.calls, entry.seconds, entry.slowest)
+                   for entry in entries if entry.calls]
+        return sorted(timings, key=lambda timing: timing[3], reverse=True)
+
+    def set_executor(self, mode, executor):
+        """Run the receivers of MODE_THREAD or MODE_PROCESS in 'executor'"""
+        self._executors[mode] = executor
+
+    def shutdown(self, wait=True):
+        """Shut the thread and process pools down"""
+        executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=wait)
+
+    def _executor(self, mode):
+        executor = self._executors.get(mode)
+        if executor is None:
+            if mode == MODE_THREAD:
+                executor = concurrent.futures.ThreadPoolExecutor(AQARA_EXECUTOR_WORKERS)
+            else:
+                executor = concurrent.futures.ProcessPoolExecutor(AQARA_EXECUTOR_WORKERS)
+            self._executors[mode] = executor
+        return executor
+
+    def _offload(self, entry, receiver, named, sender):
+        args = entry.arguments(named)
+        loop = asyncio.get_event_loop()
+        if entry.mode == MODE_LOOP:
+            loop.call_soon(self._run, entry, receiver, args)
+            return None
+        if entry.mode == MODE_PROCESS and "sender" in args:
+            args["sender"] = getattr(sender, "sid", None)
+        future = asyncio.Future(loop=loop)
+        key = (entry.receiver_id, id(sender))
+        pending = self._serial.get(key)
+        if pending is None:
+            pending = self._serial[key] = collections.deque()
+        pending.append((entry, receiver, args, future))
+        if len(pending) == 1:
+            self._submit(key, loop)
+        return future
+
+    @staticmethod
+    def _run(entry, receiver, args):
+        started = time.perf_counter()
+        try:
+            receiver(**args)
+        except Exception: # pylint: disable=broad-except
+            _LOGGER.exception("receiver %s failed", entry.name)
+        entry.record(time.perf_counter() - started)
+
+    def _submit(self, key, loop):
+        """run the first pending call of 'key', the next one once it is done"""
+        entry, receiver, args, _future = self._serial[key][0]
+        try:
+            running = loop.run_in_executor(self._executor(entry.mode), _call, receiver, args)
+        except Exception as exc: # pylint: disable=broad-except
+            # e.g. a receiver which can not be pickled
+            running = asyncio.Future(loop=loop)
+            running.set_exception(exc)
+        running.add_done_callback(lambda done: self._done(key, loop, done))
+
+    def _done(self, key, loop, done):
+        pending = self._serial[key]
+        entry, _receiver, _args, future = pending.popleft()
+        if done.exception() is not None:
+            _LOGGER.error("receiver %s failed: %r", entry.name, done.exception())
+            future.set_result(None)
+        else:
+            response, elapsed = done.result()
+            entry.record(elapsed)
+            future.set_result(response)
+        if pending:
+            self._submit(key, loop)
+        else:
+            del self._serial[key]
+
+    def has_receivers(self, signal, sender):
+        """Check if any receiver is connected to 'signal' sent by 'sender'."""
+        return bool(self._receivers.get((signal, id(sender))))
+
+    def receivers(self, signal, sender):
+        """List the live receivers of 'signal' sent by 'sender'."""
+        resolved = (entry.resolve() for entry in self._receivers.get((signal, id(sender)), ()))
+        return [receiver for receiver in resolved if receiver is not None]
+
+    def _remove(self, key, entry):
+        receivers = tuple(other for other in self._receivers.get(key, ()) if other is not entry)
+        if receivers:
+            self._receivers[key] = receivers
+        else:
+            self._receivers.pop(key, None)
+
+    def _track_sender(self, sender, signal):
+        """forget about the receivers of 'sender' once it is garbage collected"""
+        sender_id = id(sender)
+        if sender_id in self._senders:
+            self._senders[sender_id].add(signal)
+            return
+        try:
+            weakref.finalize(sender, self._forget_sender, sender_id)
+        except TypeError:
+            # not weak referenceable, receivers live as long as the bus
+            return
+        self._senders[sender_id] = set([signal])
+
+    def _forget_sender(self, sender_id):
+        for signal in self._senders.pop(sender_id, ()):
+            self._receivers.pop((signal, sender_id), None)
+
+# pylint: disable=invalid-name
+dispatcher = EventBus()
@@ -7,21 +7,33 @@ Features:
 - Call discovery
 - Persist list of sensors
 - Control gateway lights
+- Awaitable read / write requests
+- Paced refresh of all devices
+- Coalescing write queue, writes held until the first token arrives
+- Devices restored from a snapshot (see aqara.snapshot)
+- Metrics: messages, ack round-trip times, heartbeat gaps
+- Liveness of the gateway and its devices (see aqara.liveness)
 
 """
 
-import json
+import asyncio
 import logging
-import binascii
+import time
 
-from Crypto.Cipher import AES
-from pydispatch import dispatcher
+from aqara.dispatch import (dispatcher, MODE_INLINE)
+from aqara.log import (message_enabled, log_message, LazyJSON)
+from aqara.crypto import (make_key, CRYPTO_BACKEND_AUTO)
 from aqara.device import (create_device, AqaraBaseDevice)
+from aqara.request import RequestTracker
+from aqara.scheduler import (RefreshScheduler, WriteQueue, PRIORITY_INTERACTIVE,
+                             PRIORITY_BACKGROUND)
+from aqara.stream import EVENT_NEW_DEVICE
 from aqara.const import (
-    AQARA_ENCRYPT_IV,
+    AQARA_REQUEST_TIMEOUT,
     AQARA_DEVICE_GATEWAY,
     AQARA_MID_STOP,
     AQARA_EVENT_NEW_DEVICE,
+    AQARA_EVENT_REFRESH_PROGRESS,
     AQARA_DATA_RGB,
     AQARA_DATA_ILLUMINATION
 )
@@ -30,9 +42,9 @@ _LOGGER = logging.getLogger(__name__)
 
 class AqaraGateway(AqaraBaseDevice):
     """Aqara Gateway implementation."""
-    def __init__(self, client, sid, addr, secret):
-        super().__init__(AQARA_DEVICE_GATEWAY, self, sid)
+    def __init__(self, client, sid, addr, secret, crypto_backend=CRYPTO_BACKEND_AUTO):
         self._client = client
+        super().__init__(AQARA_DEVICE_GATEWAY, self, sid)
         self._addr = addr
 
         # enable encryption if secret is set
@@ -41,11 +53,26 @@ class AqaraGateway(AqaraBaseDevice):
             _LOGGER.info("Encryption enabled for gateway %s", sid)
         else:
             _LOGGER.info("Encryption disabled for gateway %s", sid)
+        self._crypto_backend = crypto_backend
         self._token = None
+        self._key = None
         self._rgbw = 0
         self._illumination = 0
         self._devices = {}
         self._devices[sid] = self
+        self._reads = RequestTracker("read")
+        self._writes = WriteQueue(self._send_write)
+        if secret != None:
+            # writes wait for the first token, see _set_token
+            self._writes.hold()
+        self._refresh = RefreshScheduler(self._read_background, self._on_refresh_progress)
+        self._metrics = client.metrics
+        self._last_heartbeat = None
+
+    @property
+    def store(self):
+        """property: store holding the state of the devices"""
+        return self._client.store
 
     @property
     def devices(self):
@@ -67,25 +94,68 @@ class AqaraGateway(AqaraBaseDevice):
         """property: illumination"""
         return self._illumination
 
+    @property
+    def read_requests(self):
+        """property: read requests in flight, with their latency samples"""
+        return self._reads
+
+    @property
+    def write_requests(self):
+        """property: write queue, with the latency samples of acknowledged writes"""
+        return self._writes
+
+    @property
+    def refresh_scheduler(self):
+        """property: scheduler of device refreshes (window, rate, retries)"""
+        return self._refresh
+
     def connect(self):
         """Start the gateway"""
         self.discover_devices()
-        self.read_device(self._sid)
+        self.read_device(self.sid)
 
     def discover_devices(self):
         """discover devices attached to this gateway"""
         self.log_info('discovering devices...')
         self._client.discover_devices(self._addr)
 
-    def read_device(self, sid):
+    def read_device(self, sid, priority=PRIORITY_INTERACTIVE, on_sent=None):
         """force read the value of a device attached to this gateway"""
-        self._client.read_device(self._addr, sid)
+        self._client.read_device(self._addr, sid, priority, on_sent)
+
+    def _read_background(self, sid, on_sent):
+        """read of the device refresh"""
+        self.read_device(sid, PRIORITY_BACKGROUND, on_sent)
+
+    def write_device(self, device, data, meta=None):
+        """write data to device, pending writes to the same fields are replaced"""
+        self._writes.put(device, data, meta)
+
+    @asyncio.coroutine
+    def read(self, sid, timeout=AQARA_REQUEST_TIMEOUT):
+        """Read device 'sid', return the data of its read_ack.
+
+        Concurrent reads of the same sid share a single request.
+        """
+        future = self._reads.pending(sid)
+        if future is None:
+            self.read_device(sid)
+            future = self._reads.start(sid, timeout)
+        else:
+            self._reads.extend(sid, timeout)
+        return (yield from asyncio.wait_for(asyncio.shield(future), timeout))
 
-    def write_device(self, device, data, meta):
-        """write data to device"""
-        if self._secret != None:
-            data["key"] = self._make_key()
-        self._client.write_device(self._addr, device.model, device.sid, data, meta)
+    @asyncio.coroutine
+    def write(self, device, data, meta=None, timeout=AQARA_REQUEST_TIMEOUT):
+        """Write 'data' to 'device', return the data of its write_ack.
+
+        Before the gateway token is known, the write is sent once it arrives,
+        'timeout' then runs from the end of the hold window at the latest.
+        """
+        if self._writes.held:
+            timeout += self._writes.hold_timeout
+        future = self._writes.put(device, data, meta, track=True)
+        return (yield from asyncio.wait_for(asyncio.shield(future), timeout))
 
     def set_light(self, rgbw):
         """Set gateway light (rgbw)"""
@@ -107,66 +177,146 @@ class AqaraGateway(AqaraBaseDevice):
         """Stop playing ringtone"""
         self._set_mid(AQARA_MID_STOP)
 
+    @asyncio.coroutine
+    def wait_refreshed(self):
+        """Wait until all devices are read, return (done, failed)"""
+        return (yield from self._refresh.wait())
+
     def on_devices_discovered(self, sids):
         """Callback when devices are discovered"""
-        for sid in sids:
-            self._client.read_device(self._addr, sid)
+        self._metrics.gateway_messages.inc(self.sid, "get_id_list_ack")
+        self._refresh.refresh(sids)
 
     def on_read_ack(self, model, sid, data):
         """Callback on read_ack"""
-        self.log_debug("on_read_ack: [{}] {}: {}".format(model, sid, json.dumps(data)))
+        if message_enabled(logging.DEBUG):
+            log_message(logging.DEBUG, "read_ack", sid, model, data)
+        self._metrics.gateway_messages.inc(self.sid, "read_ack")
+        if self._reads.resolve(sid, data):
+            self._metrics.ack_latency.observe(self._reads.last_latency, self.sid, "read")
+        self._refresh.ack(sid)
         if model == "gateway" and sid == self.sid:
             # handle read_ack for gateway itself
             self.on_update(data)
         else:
             # handle read_ack for devices attached to this gateway
             if sid not in self._devices:
-                new_device = create_device(self, model, sid)
-                self.log_info("added new device {} [{}]".format(sid, model))
-                self._devices[sid] = new_device
-                dispatcher.send(signal=AQARA_EVENT_NEW_DEVICE, device=new_device, sender=self)
+                self._add_device(model, sid)
             self._try_update_device(model, sid, data)
 
     def on_write_ack(self, model, sid, data):
         """Callback on write_ack"""
-        self.log_debug("on_write_ack: {} [{}]: {}".format(sid, model, json.dumps(data)))
+        if message_enabled(logging.DEBUG):
+            log_message(logging.DEBUG, "write_ack", sid, model, data)
+        self._metrics.gateway_messages.inc(self.sid, "write_ack")
+        if self._writes.ack(sid, data):
+            self._metrics.ack_latency.observe(self._writes.last_latency, self.sid, "write")
         if model == "gateway" and sid == self.sid:
             # handle write_ack for gateway
             self.on_update(data)
 
+    def on_write_error(self, sid, data):
+        """Callback on write_ack reporting an error"""
+        self.log_warning("on_write_error: %s: %s", sid, LazyJSON(data))
+        self._metrics.gateway_messages.inc(self.sid, "write_error")
+        self._writes.reject(sid, RuntimeError('write error: {}'.format(data.get("error"))))
+
     def on_device_report(self, model, sid, data):
         """Callback on report"""
-        self.log_debug("on_report: {} [{}]: {}".format(sid, model, json.dumps(data)))
+        if message_enabled(logging.DEBUG):
+            log_message(logging.DEBUG, "report", sid, model, data)
+        self._metrics.gateway_messages.inc(self.sid, "report")
         self._try_update_device(model, sid, data)
 
     def on_device_heartbeat(self, model, sid, data, gw_token):
         """Callback on heartbeat"""
-        self.log_debug("on_heartbeat: {} [{}]: {}".format(sid, model, json.dumps(data)))
-        if sid == self._sid:
+        if message_enabled(logging.DEBUG):
+            log_message(logging.DEBUG, "heartbeat", sid, model, data)
+        self._metrics.gateway_messages.inc(self.sid, "heartbeat")
+        if sid == self.sid:
             # handle as gateway heartbeat
-            self._token = gw_token
+            now = time.time()
+            self.seen(now)
+            if self._last_heartbeat is not None:
+                self._metrics.heartbeat_gap.observe(now - self._last_heartbeat, self.sid)
+            self._last_heartbeat = now
+            self.on_token(gw_token)
         else:
             # handle as device heartbeat
             self._try_heartbeat_device(model, sid, data)
 
     def do_update(self, data):
-        if AQARA_DATA_RGB in data:
+        changes = {}
+        if AQARA_DATA_RGB in data and data[AQARA_DATA_RGB] != self._rgbw:
+            changes["rgbw"] = (self._rgbw, data[AQARA_DATA_RGB])
             self._rgbw = data[AQARA_DATA_RGB]
-        if AQARA_DATA_ILLUMINATION in data:
+        if AQARA_DATA_ILLUMINATION in data and data[AQARA_DATA_ILLUMINATION] != self._illumination:
+            changes["illumination"] = (self._illumination, data[AQARA_DATA_ILLUMINATION])
             self._illumination = data[AQARA_DATA_ILLUMINATION]
+        return changes
 
-    def subscribe(self, handle_new_device):
+    def subscribe(self, handle_new_device, mode=MODE_INLINE):
         """Subscribe to new device event."""
-        dispatcher.connect(handle_new_device, signal=AQARA_EVENT_NEW_DEVICE, sender=self)
+        dispatcher.connect(handle_new_device, signal=AQARA_EVENT_NEW_DEVICE, sender=self,
+                           mode=mode)
 
     def unsubscribe(self, handle_new_device):
         """Unsubscribe from new device event."""
         dispatcher.disconnect(handle_new_device, signal=AQARA_EVENT_NEW_DEVICE, sender=self)
 
+    def subscribe_refresh(self, handle_progress, mode=MODE_INLINE):
+        """Subscribe to device refresh progress (done, failed, total, complete)."""
+        dispatcher.connect(handle_progress, signal=AQARA_EVENT_REFRESH_PROGRESS, sender=self,
+                           mode=mode)
+
+    def unsubscribe_refresh(self, handle_progress):
+        """Unsubscribe from device refresh progress."""
+        dispatcher.disconnect(handle_progress, signal=AQARA_EVENT_REFRESH_PROGRESS, sender=self)
+
+    def restore_device(self, model, sid):
+        """Add a device known from a snapshot, its state is already in the store"""
+        if sid in self._devices:
+            return self._devices[sid]
+        return self._add_device(model, sid)
+
+    def remove_device(self, sid):
+        """Forget a device which is no longer attached to this gateway"""
+        device = self._devices.pop(sid, None)
+        if device is not None:
+            self.log_info("removed device %s [%s]", sid, device.model)
+            if self.store.liveness is not None:
+                self.store.liveness.untrack(device)
+        return device
+
+    def update_addr(self, addr):
+        """Called when the gateway answers discovery, rediscover devices if it moved"""
+        if addr == self._addr:
+            return
+        self.log_info("moved from %s to %s", self._addr, addr)
+        self._addr = addr
+        self.connect()
+
+    def _add_device(self, model, sid):
+        new_device = create_device(self, model, sid)
+        self.log_info("added new device %s [%s]", sid, model)
+        self._devices[sid] = new_device
+        if self.store.liveness is not None:
+            self.store.liveness.track(new_device)
+        dispatcher.send(signal=AQARA_EVENT_NEW_DEVICE, device=new_device, sender=self)
+        if self.store.events is not None:
+            self.store.events.publish(EVENT_NEW_DEVICE, sid, model)
+        return new_device
+
+    def _on_refresh_progress(self, done, failed, total, complete):
+        if complete:
+            self.log_info("refreshed %s devices, %s failed", done, failed)
+        dispatcher.send(signal=AQARA_EVENT_REFRESH_PROGRESS, sender=self,
+                        done=done, failed=failed, total=total, complete=complete)
+
     def _try_update_device(self, model, sid, data):
         """Update device data"""
         if sid not in self._devices:
-            self.log_warning('unregistered device: {} [{}]'.format(model, sid))
+            self.log_warning('unregistered device: %s [%s]', model, sid)
             return
         self._devices[sid].on_update(data)
 
@@ -174,17 +324,62 @@ class AqaraGateway(AqaraBaseDevice):
     def _try_heartbeat_device(self, model, sid, data):
         """Send heartbeat to device"""
         if sid not in self._devices:
-            self.log_warning('unregistered device: {} [{}]'.format(model, sid))
+            self.log_warning('unregistered device: %s [%s]', model, sid)
             return
         self._devices[sid].on_heartbeat(data)
 
+    def _send_write(self, device, data, meta, on_sent=None):
+        """send a write from the write queue"""
+        if self._secret != None:
+            data["key"] = self._make_key()
+        self._client.write_device(self._addr, device.model, device.sid, data, meta,
+                                  on_sent=on_sent)
+
+    def on_token(self, token):
+        """Callback on a token, carried by heartbeats, get_id_list_ack, read_ack..."""
+        if token is not None:
+            self._set_token(token)
+
+    def set_secret(self, secret):
+        """Set the secret (None: encryption disabled), writes wait for a token if needed"""
+        if secret == self._secret:
+            return
+        self._secret = secret
+        self._key = None
+        if secret is None:
+            self._writes.release()
+            return
+        self._writes.hold()
+        self._derive_key()
+
+    def _set_token(self, token):
+        """store a new token, derive its write key and send the writes held for it"""
+        if token == self._token:
+            return
+        self._token = token
+        self._key = None
+        self._derive_key()
+
+    def _derive_key(self):
+        """derive the key ahead of the next write, release the writes held for it"""
+        if self._secret is None or self._token is None:
+            return
+        try:
+            self._make_key()
+        except Exception as exc: # pylint: disable=broad-except
+            self.log_warning("can not derive write key: %s", exc)
+            return
+        self._writes.release()
+
     def _make_key(self):
         if self._secret is None:
             raise Exception('EncyrptionNotEnabledError')
         if self._token is None:
             raise Exception('EncryptionTokenNotAvailableError')
-        cipher = AES.new(self._secret, AES.MODE_CBC, IV=AQARA_ENCRYPT_IV)
-        return binascii.hexlify(cipher.encrypt(self._token)).decode("utf-8")
+        if self._key is None:
+            # the key only changes with the token, see _set_token
+            self._key = make_key(self._secret, self._token, self._crypto_backend)
+        return self._key
 
     def _set_mid(self, mid):
         data = {
@@ -0,0 +1,162 @@
+"""
+Aqara History
+
+Optional time series of device fields, feature including
+- Fixed-size ring buffer per device and field, preallocated numpy arrays
+- Filled from device updates and heartbeats, with timestamps
+- Vectorized queries across many devices at once: min / max / mean over a
+  window, rate of change, linear trend (e.g. battery voltage)
+
+Requires numpy.
+"""
+
+import time
+import warnings
+
+from aqara.const import (AQARA_HISTORY_SIZE, AQARA_HISTORY_FIELDS)
+
+SECONDS_PER_DAY = 86400
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Device history requires numpy, install it with: pip3 install numpy')
+    return numpy
+
+class DeviceHistory(object):
+    """Ring buffers of (timestamp, value) per device slot and field."""
+    def __init__(self, store, size=AQARA_HISTORY_SIZE, fields=AQARA_HISTORY_FIELDS):
+        self._np = _import_numpy()
+        self._store = store
+        self._size = size
+        self._fields = tuple(fields)
+        self._capacity = 0
+        self._times = {}
+        self._values = {}
+        self._count = {}
+        self._grow(max(len(store), 16))
+
+    @property
+    def size(self):
+        """property: samples kept per device and field"""
+        return self._size
+
+    @property
+    def fields(self):
+        """property: fields recorded"""
+        return self._fields
+
+    def record(self, index, data, timestamp):
+        """Record the fields of 'data' for slot 'index', read back from the store"""
+        if index >= self._capacity:
+            self._grow(max(index + 1, self._capacity * 2))
+        store = self._store
+        for field in self._fields:
+            if field not in data:
+                continue
+            count = self._count[field]
+            pos = count[index] % self._size
+            self._times[field][index, pos] = timestamp
+            self._values[field][index, pos] = store.column(field)[index]
+            count[index] += 1
+
+    def series(self, sid, field):
+        """Return (timestamps, values) of 'sid', oldest first"""
+        np = self._np
+        index = self._store.index(sid)
+        if index is None or index >= self._capacity:
+            return np.empty(0), np.empty(0)
+        count = int(self._count[field][index])
+        if count <= self._size:
+            order = np.arange(count)
+        else:
+            order = (np.arange(self._size) + count) % self._size
+        return self._times[field][index, order], self._values[field][index, order]
+
+    def window(self, field, sids=None, window=None, now=None):
+        """Return (timestamps, values) of 'sids' as 2D arrays, NaN outside the window
+
+        Rows follow 'sids', or the store slot order when 'sids' is None.
+        """
+        np = self._np
+        rows = self._rows(sids)
+        times = self._times[field][rows]
+        values = self._values[field][rows]
+        if window is not None:
+            now = time.time() if now is None else now
+            outside = ~(times >= now - window)
+            times = np.where(outside, np.nan, times)
+            values = np.where(outside, np.nan, values)
+        return times, values
+
+    def stats(self, field, sids=None, window=None, now=None):
+        """Return min / max / mean / count of 'field' per device over the window"""
+        np = self._np
+        _times, values = self.window(field, sids, window, now)
+        with warnings.catch_warnings():
+            # devices without samples give NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return {
+                "min": np.nanmin(values, axis=1),
+                "max": np.nanmax(values, axis=1),
+                "mean": np.nanmean(values, axis=1),
+                "count": np.count_nonzero(~np.isnan(values), axis=1)
+            }
+
+    def rate(self, field, sids=None, window=None, now=None):
+        """Return (last - first) / elapsed time of 'field' per device (unit: per s)"""
+        np = self._np
+        times, values = self.window(field, sids, window, now)
+        has_samples = ~np.all(np.isnan(times), axis=1)
+        first = np.argmin(np.where(np.isnan(times), np.inf, times), axis=1)
+        last = np.argmax(np.where(np.isnan(times), -np.inf, times), axis=1)
+        rows = np.arange(times.shape[0])
+        elapsed = times[rows, last] - times[rows, first]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = (values[rows, last] - values[rows, first]) / elapsed
+        return np.where(has_samples & (elapsed > 0), rate, np.nan)
+
+    def trend(self, field, sids=None, window=None, now=None):
+        """Return the least squares slope of 'field' per device (unit: per s)"""
+        np = self._np
+        times, values = self.window(field, sids, window, now)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            dt = times - np.nanmean(times, axis=1, keepdims=True)
+            dv = values - np.nanmean(values, axis=1, keepdims=True)
+            return np.nansum(dt * dv, axis=1) / np.nansum(dt * dt, axis=1)
+
+    def voltage_trend(self, sids=None, window=None, now=None):
+        """Return the battery voltage trend per device (unit: mV per day)"""
+        return self.trend("voltage", sids, window, now) * SECONDS_PER_DAY
+
+    def _rows(self, sids):
+        np = self._np
+        if sids is None:
+            if len(self._store) > self._capacity:
+                # devices added since, without samples yet
+                self._grow(len(self._store))
+            return np.arange(len(self._store))
+        indexes = [self._store.index(sid) for sid in sids]
+        if any(index is None for index in indexes):
+            raise KeyError('unknown sid in {}'.format(sids))
+        if indexes and max(indexes) >= self._capacity:
+            self._grow(max(indexes) + 1)
+        return np.array(indexes, dtype=np.intp)
+
+    def _grow(self, capacity):
+        """resize the ring buffers to hold 'capacity' devices"""
+        np = self._np
+        for field in self._fields:
+            times = np.full((capacity, self._size), np.nan)
+            values = np.full((capacity, self._size), np.nan)
+            count = np.zeros(capacity, dtype=np.int64)
+            if self._capacity:
+                times[:self._capacity] = self._times[field]
+                values[:self._capacity] = self._values[field]
+                count[:self._capacity] = self._count[field]
+            self._times[field] = times
+            self._values[field] = values
+            self._count[field] = count
+        self._capacity = capacity
@@ -0,0 +1,199 @@
+"""
+Aqara Hub
+
+One listener shared by the clients of a process, feature including
+- One socket, one decode and one registry of gateways / devices per process
+- Lightweight handles (AqaraHub.attach) with their own gw_secrets,
+  subscriptions and event streams
+- Listening started with the first handle, stopped with the last one
+- Process-wide hub (shared_hub)
+"""
+
+import asyncio
+import functools
+import logging
+
+from aqara.client import AqaraClient
+from aqara.dispatch import MODE_INLINE
+from aqara.stream import OVERFLOW_DROP_OLDEST
+from aqara.const import AQARA_STREAM_QUEUE_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+_SHARED_HUB = None
+
+def shared_hub(**client_kwargs):
+    """Return the hub of the process, created with 'client_kwargs' on first call"""
+    global _SHARED_HUB # pylint: disable=global-statement
+    if _SHARED_HUB is None:
+        _SHARED_HUB = AqaraHub(**client_kwargs)
+    elif client_kwargs:
+        raise RuntimeError('shared hub already created')
+    return _SHARED_HUB
+
+class AqaraHub(object):
+    """Listener shared by handles, 'client_kwargs' are passed to its AqaraClient"""
+    def __init__(self, **client_kwargs):
+        self._client = AqaraClient(**client_kwargs)
+        self._handles = []
+        self._running = []
+        self._starting = None
+
+    @property
+    def client(self):
+        """property: client owning the socket, the gateways and the devices"""
+        return self._client
+
+    @property
+    def handles(self):
+        """property: attached handles"""
+        return list(self._handles)
+
+    @property
+    def running(self):
+        """property: the client is listening, or starting"""
+        return self._starting is not None
+
+    def attach(self, gw_secrets=None):
+        """Return a new handle, 'gw_secrets' are added to the secrets of the hub
+
+        A gateway has one secret, ValueError is raised if another handle set a
+        different one.
+        """
+        gw_secrets = {} if gw_secrets is None else gw_secrets
+        known = self._client.gateway_secrets
+        for gw_sid, secret in gw_secrets.items():
+            if known.get(gw_sid, secret) != secret:
+                raise ValueError('gateway {}: secret differs from the one set'.format(gw_sid))
+        for gw_sid, secret in gw_secrets.items():
+            self._client.set_gateway_secret(gw_sid, secret)
+        handle = AqaraHandle(self)
+        self._handles.append(handle)
+        return handle
+
+    def detach(self, handle):
+        """Stop and forget 'handle'"""
+        if handle not in self._handles:
+            return
+        self.release(handle)
+        self._handles.remove(handle)
+
+    @asyncio.coroutine
+    def acquire(self, handle, loop, **start_kwargs):
+        """Start the client for 'handle', unless already started by another handle"""
+        if handle not in self._running:
+            self._running.append(handle)
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._client.start(loop, **start_kwargs),
+                                                   loop=loop)
+        elif start_kwargs:
+            _LOGGER.warning("acquire(): hub already started, %s ignored", sorted(start_kwargs))
+        starting = self._starting
+        try:
+            yield from asyncio.shield(starting)
+        except Exception:
+            if self._starting is starting:
+                self._starting = None
+                self._running = []
+            raise
+
+    def release(self, handle):
+        """Stop the client once no handle is started"""
+        if handle not in self._running:
+            return
+        self._running.remove(handle)
+        if self._running or self._starting is None:
+            return
+        starting, self._starting = self._starting, None
+        if not starting.done():
+            starting.cancel()
+            return
+        self._client.stop()
+
+class AqaraHandle(object):
+    """Client of a hub, with its own subscriptions and event streams.
+
+    Gateways and devices are shared with the other handles, subscriptions
+    made directly on them are not undone by stop().
+    """
+    def __init__(self, hub):
+        self._hub = hub
+        # handler -> relay connected for this handle, the bus connects a
+        # receiver once per sender, the same handler of two handles would be one
+        self._subscribers = {}
+        self._streams = []
+
+    @property
+    def hub(self):
+        """property: hub"""
+        return self._hub
+
+    @property
+    def client(self):
+        """property: client shared by the handles of the hub"""
+        return self._hub.client
+
+    @property
+    def gateways(self):
+        """property: gateways"""
+        return self._hub.client.gateways
+
+    @property
+    def store(self):
+        """property: store holding the state of all devices"""
+        return self._hub.client.store
+
+    @property
+    def metrics(self):
+        """property: metrics of the shared client"""
+        return self._hub.client.metrics
+
+    @property
+    def liveness(self):
+        """property: liveness tracker of gateways and devices"""
+        return self._hub.client.liveness
+
+    @asyncio.coroutine
+    def start(self, loop, **start_kwargs):
+        """Start listening, see AqaraClient.start (only the first handle's options apply)"""
+        yield from self._hub.acquire(self, loop, **start_kwargs)
+
+    def stop(self):
+        """Close the streams, unsubscribe and detach from the hub"""
+        for stream in self._streams:
+            stream.close()
+        self._streams = []
+        for relay in self._subscribers.values():
+            self._hub.client.unsubscribe(relay)
+        self._subscribers = {}
+        self._hub.detach(self)
+
+    def discover_gateways(self):
+        """Ask all gateways to respond identity."""
+        self._hub.client.discover_gateways()
+
+    def events(self, filter=None, maxsize=AQARA_STREAM_QUEUE_SIZE, # pylint: disable=redefined-builtin
+               policy=OVERFLOW_DROP_OLDEST):
+        """Return a stream of events, closed by stop(), see AqaraClient.events"""
+        stream = self._hub.client.events(filter, maxsize, policy)
+        self._streams.append(stream)
+        return stream
+
+    def subscribe(self, handle_new_gateway, mode=MODE_INLINE):
+        """Subscribe to gateway events (the handler is kept until unsubscribe / stop)"""
+        if handle_new_gateway in self._subscribers:
+            return
+
+        # same signature as the handler, called with the arguments it accepts
+        @functools.wraps(handle_new_gateway)
+        def relay(**kwargs):
+            return handle_new_gateway(**kwargs)
+
+        self._subscribers[handle_new_gateway] = relay
+        self._hub.client.subscribe(relay, mode)
+
+    def unsubscribe(self, handle_new_gateway):
+        """Unsubscribe from gateway events."""
+        relay = self._subscribers.pop(handle_new_gateway, None)
+        if relay is not None:
+            self._hub.client.unsubscribe(relay)
@@ -0,0 +1,171 @@
+"""
+Aqara Liveness
+
+Detect devices and gateways which stopped reporting, feature including
+- One hashed timer wheel for all devices, advanced by a single periodic call
+- Reports and heartbeats only stamp last_seen in the store, deadlines are
+  checked when their wheel slot comes up, then rescheduled from last_seen
+- Model-specific intervals (AQARA_LIVENESS_INTERVALS)
+- Offline / online events per device (AQARA_EVENT_AVAILABILITY)
+"""
+
+import logging
+import time
+
+from aqara.dispatch import dispatcher
+from aqara.stream import EVENT_AVAILABILITY
+from aqara.const import (
+    AQARA_LIVENESS_TICK,
+    AQARA_LIVENESS_SLOTS,
+    AQARA_LIVENESS_INTERVALS,
+    AQARA_LIVENESS_DEFAULT_INTERVAL,
+    AQARA_EVENT_AVAILABILITY
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+class TimerWheel(object):
+    """Hashed timer wheel of 'slots' buckets, each covering 'tick' seconds.
+
+    Deadlines further than one turn stay in their bucket for the next turns.
+    """
+    def __init__(self, on_expire, tick=AQARA_LIVENESS_TICK, slots=AQARA_LIVENESS_SLOTS, now=None):
+        self._on_expire = on_expire
+        self._tick = tick
+        self._buckets = [[] for _ in range(slots)]
+        self._current = int((time.time() if now is None else now) / tick)
+        self._count = 0
+
+    @property
+    def tick(self):
+        """property: duration of a slot (unit: s)"""
+        return self._tick
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, key, deadline):
+        """Call on_expire(key, now) once 'deadline' (unit: s since epoch) is passed"""
+        tick = int(deadline / self._tick)
+        if tick <= self._current:
+            tick = self._current + 1
+        self._buckets[tick % len(self._buckets)].append((tick, key))
+        self._count += 1
+
+    def advance(self, now=None):
+        """Expire the entries due up to 'now'"""
+        now = time.time() if now is None else now
+        target = int(now / self._tick)
+        if target <= self._current:
+            return
+        slots = len(self._buckets)
+        expired = []
+        # after a long pause, every bucket is visited once
+        for tick in range(max(self._current + 1, target - slots + 1), target + 1):
+            bucket = self._buckets[tick % slots]
+            if not bucket:
+                continue
+            pending = [entry for entry in bucket if entry[0] > target]
+            if len(pending) != len(bucket):
+                expired.extend(key for deadline, key in bucket if deadline <= target)
+                self._buckets[tick % slots] = pending
+        self._current = target
+        self._count -= len(expired)
+        for key in expired:
+            self._on_expire(key, now)
+
+class LivenessTracker(object):
+    """Availability of the devices of a store."""
+    def __init__(self, store, intervals=None, tick=AQARA_LIVENESS_TICK,
+                 slots=AQARA_LIVENESS_SLOTS):
+        self._store = store
+        self._intervals = dict(AQARA_LIVENESS_INTERVALS)
+        if intervals is not None:
+            self._intervals.update(intervals)
+        self._devices = {}
+        # indexes with an entry in the wheel
+        self._scheduled = set()
+        self._wheel = TimerWheel(self._on_expire, tick, slots)
+        self._loop = None
+        self._handle = None
+
+    @property
+    def wheel(self):
+        """property: timer wheel"""
+        return self._wheel
+
+    def interval(self, model):
+        """Return the time after which a silent device of 'model' is offline (unit: s)"""
+        return self._intervals.get(model, AQARA_LIVENESS_DEFAULT_INTERVAL)
+
+    def set_interval(self, model, interval):
+        """Set the interval of 'model', applies from the next deadline of each device"""
+        self._intervals[model] = interval
+
+    def track(self, device, now=None):
+        """Start watching 'device', it is online until its interval passes"""
+        index = device._index # pylint: disable=protected-access
+        self._devices[index] = device
+        if index not in self._scheduled:
+            now = time.time() if now is None else now
+            last_seen = self._store.last_seen[index] or now
+            self._schedule(index, last_seen + self.interval(device.model))
+
+    def untrack(self, device):
+        """Stop watching 'device'"""
+        self._devices.pop(device._index, None) # pylint: disable=protected-access
+
+    def seen(self, device):
+        """Called for a message of an offline device"""
+        index = device._index # pylint: disable=protected-access
+        store = self._store
+        store.offline[index] = 0
+        if index not in self._devices:
+            return
+        if index not in self._scheduled:
+            self._schedule(index, store.last_seen[index] + self.interval(device.model))
+        device.log_info("online")
+        self._send(device, True)
+
+    def start(self, loop):
+        """Advance the wheel every tick on 'loop'"""
+        self._loop = loop
+        self._handle = loop.call_later(self._wheel.tick, self._run)
+
+    def stop(self):
+        """Stop advancing the wheel"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _run(self):
+        self._wheel.advance()
+        self._handle = self._loop.call_later(self._wheel.tick, self._run)
+
+    def _schedule(self, index, deadline):
+        self._scheduled.add(index)
+        self._wheel.schedule(index, deadline)
+
+    def _on_expire(self, index, now):
+        self._scheduled.discard(index)
+        device = self._devices.get(index)
+        if device is None:
+            return
+        store = self._store
+        deadline = store.last_seen[index] + self.interval(device.model)
+        if deadline > now:
+            # heard from since scheduled
+            self._schedule(index, deadline)
+            return
+        store.offline[index] = 1
+        if store.last_seen[index]:
+            device.log_warning("offline, last seen %.0fs ago", now - store.last_seen[index])
+        else:
+            device.log_warning("offline, never seen")
+        self._send(device, False)
+
+    def _send(self, device, available):
+        dispatcher.send(signal=AQARA_EVENT_AVAILABILITY, sender=device, available=available)
+        events = self._store.events
+        if events is not None and events.streams:
+            events.publish(EVENT_AVAILABILITY, device.sid, device.model, {"available": available})
@@ -0,0 +1,78 @@
+"""
+Aqara Logging
+
+Logging of the per-message path, feature including
+- Per-message records on their own logger (MESSAGE_LOGGER, "aqara.messages"),
+  its level is independent of the rest of the library
+- Nothing is formatted unless a record is emitted, payloads are serialized
+  by the handler (LazyJSON)
+- Structured fields on each record: aqara_event, aqara_sid, aqara_model,
+  aqara_data
+- Optional sampling under load (SamplingFilter)
+"""
+
+import json
+import logging
+import time
+
+MESSAGE_LOGGER = logging.getLogger("aqara.messages")
+
+class LazyJSON(object):
+    """Log argument serialized to JSON only when the record is formatted"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        try:
+            return json.dumps(self.value)
+        except (TypeError, ValueError):
+            return repr(self.value)
+
+def message_enabled(level):
+    """Check if per-message records of 'level' would be emitted"""
+    return MESSAGE_LOGGER.isEnabledFor(level)
+
+def log_message(level, event, sid, model, data):
+    """Log a per-message record, guard calls with message_enabled(level)"""
+    MESSAGE_LOGGER.log(level, "%s %s [%s]: %s", event, sid, model, LazyJSON(data), extra={
+        "aqara_event": event,
+        "aqara_sid": sid,
+        "aqara_model": model,
+        "aqara_data": data,
+    })
+
+class SamplingFilter(logging.Filter):
+    """Pass at most 'max_per_second' records per second.
+
+    The first record passed after records were dropped carries their count
+    as aqara_suppressed.
+    """
+    def __init__(self, max_per_second, clock=time.monotonic):
+        super().__init__()
+        self._max = max_per_second
+        self._clock = clock
+        self._second = None
+        self._count = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        second = int(self._clock())
+        if second != self._second:
+            self._second = second
+            self._count = 0
+        self._count += 1
+        if self._count > self._max:
+            self.suppressed += 1
+            return False
+        if self.suppressed:
+            record.aqara_suppressed = self.suppressed
+            self.suppressed = 0
+        return True
+
+def sample_messages(max_per_second):
+    """Sample the per-message records, return the filter (removeFilter to stop)"""
+    sampling_filter = SamplingFilter(max_per_second)
+    MESSAGE_LOGGER.addFilter(sampling_filter)
+    return sampling_filter
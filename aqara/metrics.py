@@ -0,0 +1,163 @@
+"""
+Aqara Metrics
+
+Low overhead metrics of a client and its gateways, feature including
+- Counters and histograms with labels, a dict update / bisect per observation
+- Snapshot as a plain dict
+- Export in the Prometheus text format
+"""
+
+import bisect
+
+from aqara.const import (AQARA_LATENCY_BUCKETS, AQARA_HEARTBEAT_GAP_BUCKETS)
+
+def _format_labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    """Monotonic counter, one value per tuple of label values."""
+    __slots__ = ('name', 'help', 'labels', '_values')
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values):
+        """Add 1 to the series of 'label_values'"""
+        self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def value(self, *label_values):
+        """Return the value of the series of 'label_values'"""
+        return self._values.get(label_values, 0)
+
+    def snapshot(self):
+        """Return {label values: value}"""
+        return dict(self._values)
+
+    def prometheus(self):
+        """Return the samples in the Prometheus text format"""
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} counter".format(self.name)]
+        for label_values, value in sorted(self._values.items()):
+            lines.append("{}{} {}".format(
+                self.name, _format_labels(self.labels, label_values), value))
+        return lines
+
+class Histogram(object):
+    """Histogram over fixed buckets, one series per tuple of label values."""
+    __slots__ = ('name', 'help', 'labels', 'buckets', '_series')
+
+    def __init__(self, name, help_text, labels=(), buckets=AQARA_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        """Add 'value' to the series of 'label_values'"""
+        series = self._series.get(label_values)
+        if series is None:
+            # bucket counts (+Inf last), sum
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *label_values):
+        """Return the number of observations of the series of 'label_values'"""
+        series = self._series.get(label_values)
+        return 0 if series is None else sum(series[0])
+
+    def snapshot(self):
+        """Return {label values: {"buckets": {le: cumulative count}, "sum", "count"}}"""
+        result = {}
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            buckets = {}
+            for upper, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                buckets[upper] = cumulative
+            result[label_values] = {"buckets": buckets, "sum": total, "count": cumulative}
+        return result
+
+    def prometheus(self):
+        """Return the samples in the Prometheus text format"""
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} histogram".format(self.name)]
+        for label_values, series in sorted(self.snapshot().items()):
+            for upper, count in series["buckets"].items():
+                le = 'le="{}"'.format(_format_value(upper))
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _format_labels(self.labels, label_values, le), count))
+            labels = _format_labels(self.labels, label_values)
+            lines.append("{}_sum{} {}".format(self.name, labels, _format_value(series["sum"])))
+            lines.append("{}_count{} {}".format(self.name, labels, series["count"]))
+        return lines
+
+class MetricsRegistry(object):
+    """Named counters and histograms."""
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, help_text, labels=()):
+        """Return counter 'name', creating it if needed"""
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, help_text, labels)
+        return self._metrics[name]
+
+    def histogram(self, name, help_text, labels=(), buckets=AQARA_LATENCY_BUCKETS):
+        """Return histogram 'name', creating it if needed"""
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, help_text, labels, buckets)
+        return self._metrics[name]
+
+    def snapshot(self):
+        """Return {metric name: {label values: value}}"""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text format"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].prometheus())
+        return "\n".join(lines) + "\n"
+
+class AqaraMetrics(MetricsRegistry):
+    """Metrics of a client and its gateways."""
+    def __init__(self):
+        super().__init__()
+        self.datagrams = self.counter(
+            "aqara_datagrams_received_total", "Datagrams received, by command", ("cmd",))
+        self.decode_errors = self.counter(
+            "aqara_decode_errors_total", "Datagrams which could not be decoded")
+        self.unknown_sids = self.counter(
+            "aqara_unknown_sid_total", "Messages of devices not attached to a known gateway",
+            ("cmd",))
+        self.duplicates = self.counter(
+            "aqara_duplicates_dropped_total", "Repeated reports and heartbeats dropped, by command",
+            ("cmd",))
+        self.handler_latency = self.histogram(
+            "aqara_handler_seconds", "Time spent handling a message, by command", ("cmd",))
+        self.gateway_messages = self.counter(
+            "aqara_gateway_messages_total", "Messages handled per gateway, by command",
+            ("gateway", "cmd"))
+        self.ack_latency = self.histogram(
+            "aqara_ack_seconds", "Round-trip time of acknowledged reads and writes",
+            ("gateway", "cmd"))
+        self.outbound_wait = self.histogram(
+            "aqara_outbound_wait_seconds", "Time outbound datagrams wait to be sent, by class",
+            ("priority",))
+        self.heartbeat_gap = self.histogram(
+            "aqara_gateway_heartbeat_gap_seconds", "Time between two gateway heartbeats",
+            ("gateway",), AQARA_HEARTBEAT_GAP_BUCKETS)
@@ -5,6 +5,10 @@ Provide protocol level support for Aqara, feature including
 - Join multicast group
 - Receive / Send messages
 - Encoding / Decoding messages
+- Drop datagrams before decoding (see accept_message)
+- Drop datagrams which can not be decoded (see decode_error)
+- Batches of datagrams (see aqara.receiver)
+- Optional capture of the raw datagrams (see aqara.capture)
 - Utility to unicast / broadcast messages
 """
 
@@ -13,15 +17,25 @@ import logging
 import socket
 import struct
 
-from aqara.const import (MCAST_ADDR, MCAST_PORT, GATEWAY_PORT)
+from aqara.const import (LISTEN_IP, LISTEN_PORT, MCAST_ADDR, MCAST_PORT, GATEWAY_PORT)
+from aqara.decoder import (AqaraDecoder, JSON_BACKEND_AUTO)
+from aqara.log import LazyJSON
 
 _LOGGER = logging.getLogger(__name__)
 
 class AqaraProtocol(object):
     """Base aqara client protocol."""
 
-    def __init__(self):
+    def __init__(self, json_backend=JSON_BACKEND_AUTO):
         self.transport = None
+        self._decoder = AqaraDecoder(json_backend)
+        # where to listen and to send discovery, e.g. a local simulator
+        self.listen_addr = (LISTEN_IP, LISTEN_PORT)
+        self.discovery_addr = (MCAST_ADDR, MCAST_PORT)
+        # gateways which do not listen on GATEWAY_PORT, ip -> port
+        self._gateway_ports = {}
+        # aqara.capture.CaptureWriter recording every datagram received
+        self.capture = None
 
     def connection_made(self, transport):
         """Implementation when connection is made."""
@@ -35,31 +49,79 @@ class AqaraProtocol(object):
 
     def datagram_received(self, data, addr):
         """Implementation when datagram is received."""
-        data_str = data.decode('utf-8')
-        msg = json.loads(data_str)
-        _LOGGER.debug('recv: %s', data_str)
+        _LOGGER.debug('recv: %s', data)
+        if self.capture is not None:
+            self.capture.write(data, addr)
+        cmd, sid = self._decoder.peek(data)
+        if not self.accept_message(cmd, sid):
+            return
+        try:
+            msg = self._decoder.decode(data)
+        except ValueError as exc:
+            self.decode_error(data, addr, exc)
+            return
         self.handle_message(msg, addr)
 
+    def datagrams_received(self, batch):
+        """Implementation when a batch of (data, addr) datagrams is received."""
+        decoder = self._decoder
+        messages = []
+        if self.capture is not None:
+            for data, addr in batch:
+                self.capture.write(data, addr)
+        for data, addr in batch:
+            cmd, sid = decoder.peek(data)
+            if not self.accept_message(cmd, sid):
+                continue
+            try:
+                messages.append((decoder.decode(data), addr))
+            except ValueError as exc:
+                self.decode_error(data, addr, exc)
+        if messages:
+            self.handle_messages(messages)
+
     def error_received(self, exc):
         """Implentation when error is received."""
         _LOGGER.error('error_received: %s', exc)
 
+    def accept_message(self, cmd, sid): # pylint: disable=unused-argument
+        """Called before a datagram is decoded, return False to drop it."""
+        return True
+
+    def decode_error(self, data, src_addr, exc):
+        """Called when a datagram from 'src_addr' can not be decoded."""
+        _LOGGER.warning('decode_error from %s: %s: %r', src_addr, exc, data)
+
     def handle_message(self, msg, src_addr):
         """Callback to handle new messages, override to add implementation."""
-        _LOGGER.debug('handle_message from %s: %s', src_addr, json.dumps(msg))
+        _LOGGER.debug('handle_message from %s: %s', src_addr, LazyJSON(msg))
+
+    def handle_messages(self, messages):
+        """Callback to handle a batch of (msg, src_addr), defaults to handle_message."""
+        handle_message = self.handle_message
+        for msg, src_addr in messages:
+            handle_message(msg, src_addr)
 
     def broadcast(self, msg):
         """Send a message to the Aqara multicast channel."""
-        self._send(msg, (MCAST_ADDR, MCAST_PORT))
+        self._send(msg, self.discovery_addr)
 
     def unicast(self, addr, msg):
         """Send a message to a specific gateway at <ip>"""
-        self._send(msg, (addr, GATEWAY_PORT))
+        self._send(msg, (addr, self._gateway_ports.get(addr, GATEWAY_PORT)))
+
+    def set_gateway_port(self, addr, port):
+        """Send unicasts for the gateway at <ip> to 'port'"""
+        if port == GATEWAY_PORT:
+            self._gateway_ports.pop(addr, None)
+        else:
+            self._gateway_ports[addr] = port
 
     def _send(self, msg, dest):
         """private: send a message as UDP packet."""
-        _LOGGER.debug('send: %s', json.dumps(msg))
-        data = json.dumps(msg).encode('utf-8')
+        data = json.dumps(msg)
+        _LOGGER.debug('send: %s', data)
+        data = data.encode('utf-8')
         self.transport.sendto(data, dest)
 
     def _add_membership(self):
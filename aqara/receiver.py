@@ -0,0 +1,149 @@
+"""
+Aqara Receiver
+
+Batched receive engine, an alternative to the asyncio datagram transport
+- Drain every pending datagram of the socket in one non-blocking pass per wakeup
+- Receive into a preallocated buffer, copy out only the bytes received
+- Hand the whole batch to the protocol (datagrams_received)
+- Only relies on loop.add_reader / add_writer, so it also runs under uvloop
+"""
+
+import asyncio
+import collections
+import logging
+import socket
+
+from aqara.const import (RECEIVE_BATCH_SIZE, RECEIVE_BUFFER_SIZE)
+
+_LOGGER = logging.getLogger(__name__)
+
+class BatchDatagramTransport(asyncio.DatagramTransport): # pylint: disable=too-many-instance-attributes
+    """Datagram transport delivering received datagrams in batches."""
+    def __init__(self, loop, sock, protocol, max_batch=RECEIVE_BATCH_SIZE):
+        super().__init__(extra={'socket': sock, 'sockname': sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._protocol = protocol
+        self._max_batch = max_batch
+        self._buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._send_queue = collections.deque()
+        self._reading = False
+        self._closing = False
+
+    def start(self):
+        """Notify the protocol and start reading"""
+        self._protocol.connection_made(self)
+        self.resume_reading()
+
+    def get_protocol(self):
+        """Return the protocol receiving the datagrams"""
+        return self._protocol
+
+    def set_protocol(self, protocol):
+        """Hand the next datagrams to 'protocol'"""
+        self._protocol = protocol
+
+    def is_closing(self):
+        """Check if the transport is closing or closed"""
+        return self._closing
+
+    def is_reading(self):
+        """Check if the transport is reading from its socket"""
+        return self._reading
+
+    def pause_reading(self):
+        """Stop reading, datagrams queue up in the socket buffer"""
+        if self._reading:
+            self._loop.remove_reader(self._sock.fileno())
+            self._reading = False
+
+    def resume_reading(self):
+        """Resume reading"""
+        if not self._reading and not self._closing:
+            self._loop.add_reader(self._sock.fileno(), self._on_readable)
+            self._reading = True
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        if not self._send_queue:
+            try:
+                self._sock.sendto(data, addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                self._loop.add_writer(self._sock.fileno(), self._on_writable)
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                return
+        self._send_queue.append((bytes(data), addr))
+
+    def get_write_buffer_size(self):
+        """Return the number of bytes waiting to be sent"""
+        return sum(len(data) for data, _addr in self._send_queue)
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self.pause_reading()
+        if self._send_queue:
+            self._loop.remove_writer(self._sock.fileno())
+            self._send_queue.clear()
+        self._loop.call_soon(self._finish_close)
+
+    def abort(self):
+        self.close()
+
+    def _finish_close(self):
+        try:
+            self._protocol.connection_lost(None)
+        finally:
+            self._sock.close()
+
+    def _on_readable(self):
+        """drain the socket, then hand the batch over"""
+        batch = []
+        recvfrom_into = self._sock.recvfrom_into
+        view = self._view
+        while len(batch) < self._max_batch:
+            try:
+                nbytes, addr = recvfrom_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self._protocol.error_received(exc)
+                break
+            batch.append((bytes(view[:nbytes]), addr))
+        if batch:
+            self._protocol.datagrams_received(batch)
+
+    def _on_writable(self):
+        while self._send_queue:
+            data, addr = self._send_queue[0]
+            try:
+                self._sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                self._protocol.error_received(exc)
+            self._send_queue.popleft()
+        self._loop.remove_writer(self._sock.fileno())
+
+@asyncio.coroutine
+def create_batch_endpoint(loop, protocol_factory, local_addr, max_batch=RECEIVE_BATCH_SIZE):
+    """Same as loop.create_datagram_endpoint, with a BatchDatagramTransport"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setblocking(False)
+        sock.bind(local_addr)
+    except OSError:
+        sock.close()
+        raise
+    protocol = protocol_factory()
+    transport = BatchDatagramTransport(loop, sock, protocol, max_batch)
+    transport.start()
+    # keep the signature of create_datagram_endpoint
+    yield from asyncio.sleep(0)
+    return transport, protocol
@@ -0,0 +1,123 @@
+"""
+Aqara Requests
+
+Correlate requests sent to a gateway with their acks, feature including
+- One future per in-flight request, resolved by the matching ack
+- Requests for the same key are answered in order (FIFO)
+- Timeouts
+- Round-trip latency samples
+"""
+
+import asyncio
+import collections
+
+from aqara.const import AQARA_LATENCY_SAMPLES
+
+class _Request(object):
+    """An in-flight request."""
+    __slots__ = ('loop', 'future', 'sent_at', 'timer')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = asyncio.Future(loop=loop)
+        self.sent_at = loop.time()
+        self.timer = None
+
+    def fail(self, exc):
+        """fail the request, waiters may have given up already"""
+        self.future.set_exception(exc)
+        # mark the exception as retrieved, nobody may be waiting anymore
+        self.future.exception()
+
+class RequestTracker(object):
+    """Requests in flight to a gateway, keyed by sid."""
+    def __init__(self, name):
+        self._name = name
+        self._pending = {}
+        self._latencies = collections.deque(maxlen=AQARA_LATENCY_SAMPLES)
+
+    @property
+    def name(self):
+        """property: name"""
+        return self._name
+
+    @property
+    def latencies(self):
+        """property: latencies of the last answered requests (unit: s)"""
+        return list(self._latencies)
+
+    @property
+    def last_latency(self):
+        """property: latency of the last answered request (unit: s)"""
+        return self._latencies[-1] if self._latencies else None
+
+    def __len__(self):
+        return sum(len(requests) for requests in self._pending.values())
+
+    def pending(self, key):
+        """Return the future of the newest request in flight for 'key', or None"""
+        requests = self._pending.get(key)
+        if not requests:
+            return None
+        return requests[-1].future
+
+    def start(self, key, timeout):
+        """Track a new request for 'key', return its future.
+
+        Must be called from a coroutine running in the event loop.
+        """
+        request = _Request(asyncio.get_event_loop())
+        self._pending.setdefault(key, collections.deque()).append(request)
+        self._arm(key, request, timeout)
+        return request.future
+
+    def extend(self, key, timeout):
+        """Make sure the newest request for 'key' waits at least 'timeout' more seconds"""
+        requests = self._pending.get(key)
+        if not requests:
+            return
+        request = requests[-1]
+        if request.timer.when() < request.loop.time() + timeout:
+            request.timer.cancel()
+            self._arm(key, request, timeout)
+
+    def resolve(self, key, result):
+        """Resolve the oldest request for 'key' with 'result'"""
+        request = self._pop(key)
+        if request is None:
+            return False
+        self._latencies.append(request.loop.time() - request.sent_at)
+        request.future.set_result(result)
+        return True
+
+    def reject(self, key, exc):
+        """Fail the oldest request for 'key' with 'exc'"""
+        request = self._pop(key)
+        if request is None:
+            return False
+        request.fail(exc)
+        return True
+
+    def _arm(self, key, request, timeout):
+        def expire():
+            requests = self._pending.get(key)
+            if requests is None or request not in requests:
+                return
+            requests.remove(request)
+            if not requests:
+                del self._pending[key]
+            if not request.future.done():
+                request.fail(asyncio.TimeoutError('{} {} timed out'.format(self._name, key)))
+        request.timer = request.loop.call_later(timeout, expire)
+
+    def _pop(self, key):
+        """pop the oldest request of 'key' which has not been cancelled"""
+        requests = self._pending.get(key)
+        while requests:
+            request = requests.popleft()
+            request.timer.cancel()
+            if not requests:
+                del self._pending[key]
+            if not request.future.done():
+                return request
+        return None
@@ -0,0 +1,541 @@
+"""
+Aqara Scheduler
+
+Outbound pacing of requests to a gateway, feature including
+- Windowed reads: at most 'window' reads in flight per gateway
+- Rate limiting: at most 'rate' reads / writes sent per second
+- Retransmission of unanswered reads with exponential backoff
+- Progress / completion reporting
+- Last-write-wins coalescing of pending writes, one write in flight at a time
+- Writes held with an expiry until they can be sent (e.g. no gateway token yet)
+- Priority lanes of all outbound datagrams: control writes, then user reads,
+  then background refresh / discovery, round-robin between gateways
+"""
+
+import asyncio
+import collections
+import functools
+import logging
+import time
+
+from aqara.const import (
+    AQARA_REFRESH_WINDOW,
+    AQARA_REFRESH_RATE,
+    AQARA_REFRESH_RETRY_TIMEOUT,
+    AQARA_REFRESH_MAX_RETRIES,
+    AQARA_WRITE_RATE,
+    AQARA_WRITE_ACK_TIMEOUT,
+    AQARA_TOKEN_WAIT,
+    AQARA_LATENCY_SAMPLES,
+    AQARA_OUTBOUND_RATE,
+    AQARA_OUTBOUND_GATEWAY_RATE,
+    AQARA_OUTBOUND_BURST
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# classes of outbound datagrams, highest priority first
+PRIORITY_CONTROL = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("control", "interactive", "background")
+
+class RefreshScheduler(object):
+    """Paced, windowed bulk read of the devices of a gateway.
+
+    send_read(sid, on_sent) sends a read, on_sent() is called once it is on the
+    wire (see OutboundScheduler) and starts its retry timer.
+    """
+    def __init__(self, send_read, on_progress=None,
+                 window=AQARA_REFRESH_WINDOW, rate=AQARA_REFRESH_RATE,
+                 retry_timeout=AQARA_REFRESH_RETRY_TIMEOUT, max_retries=AQARA_REFRESH_MAX_RETRIES):
+        self.window = window
+        self.rate = rate
+        self.retry_timeout = retry_timeout
+        self.max_retries = max_retries
+        self._send_read = send_read
+        self._on_progress = on_progress
+        self._loop = None
+        self._queue = collections.deque()
+        self._queued = set()
+        self._in_flight = {}
+        self._next_send_at = 0
+        self._pump_handle = None
+        self._waiters = []
+        self._total = 0
+        self._done = 0
+        self._failed = 0
+
+    @property
+    def total(self):
+        """property: number of reads requested in the current (or last) batch"""
+        return self._total
+
+    @property
+    def done(self):
+        """property: number of reads answered"""
+        return self._done
+
+    @property
+    def failed(self):
+        """property: number of reads given up after 'max_retries'"""
+        return self._failed
+
+    @property
+    def in_flight(self):
+        """property: number of reads waiting for an ack"""
+        return len(self._in_flight)
+
+    @property
+    def complete(self):
+        """property: True when there is nothing queued or in flight"""
+        return not self._queue and not self._in_flight
+
+    def refresh(self, sids):
+        """Queue a read for each sid, sids already queued or in flight are skipped.
+
+        Must be called from the event loop.
+        """
+        self._loop = asyncio.get_event_loop()
+        if self.complete:
+            # start a new batch
+            self._total = self._done = self._failed = 0
+        for sid in sids:
+            if sid in self._queued or sid in self._in_flight:
+                continue
+            self._queue.append((sid, 0))
+            self._queued.add(sid)
+            self._total += 1
+        self._pump()
+
+    def ack(self, sid):
+        """Mark the read of 'sid' as answered"""
+        if sid in self._queued:
+            # answered before it was (re)sent, e.g. by a read issued elsewhere
+            self._queue = collections.deque(item for item in self._queue if item[0] != sid)
+            self._queued.discard(sid)
+        elif sid in self._in_flight:
+            timer = self._in_flight.pop(sid)[1]
+            if timer is not None:
+                timer.cancel()
+        else:
+            return
+        self._done += 1
+        self._progress()
+        self._pump()
+
+    @asyncio.coroutine
+    def wait(self):
+        """Wait until all queued reads are answered or given up, return (done, failed)"""
+        if self.complete:
+            return (self._done, self._failed)
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter)
+        return (yield from waiter)
+
+    def cancel(self):
+        """Drop all queued reads and stop retransmitting"""
+        for _attempt, timer in self._in_flight.values():
+            if timer is not None:
+                timer.cancel()
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        self._failed += len(self._queue) + len(self._in_flight)
+        self._queue.clear()
+        self._queued.clear()
+        self._in_flight.clear()
+        self._progress()
+
+    def _pump(self):
+        """send queued reads while the window and the rate allow"""
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        while self._queue and len(self._in_flight) < self.window:
+            now = self._loop.time()
+            if now < self._next_send_at:
+                self._pump_handle = self._loop.call_at(self._next_send_at, self._pump)
+                return
+            sid, attempt = self._queue.popleft()
+            self._queued.discard(sid)
+            self._next_send_at = max(now, self._next_send_at) + 1.0 / self.rate
+            self._transmit(sid, attempt)
+
+    def _transmit(self, sid, attempt):
+        # the retry timer starts once the read is sent, not while it is paced
+        self._in_flight[sid] = (attempt, None)
+        self._send_read(sid, functools.partial(self._on_sent, sid, attempt))
+
+    def _on_sent(self, sid, attempt):
+        if self._in_flight.get(sid) != (attempt, None):
+            # answered or given up meanwhile
+            return
+        timeout = self.retry_timeout * (2 ** attempt)
+        timer = self._loop.call_later(timeout, self._on_timeout, sid)
+        self._in_flight[sid] = (attempt, timer)
+
+    def _on_timeout(self, sid):
+        attempt, _timer = self._in_flight.pop(sid)
+        if attempt >= self.max_retries:
+            _LOGGER.warning("read %s: no answer after %s retries", sid, attempt)
+            self._failed += 1
+            self._progress()
+        else:
+            _LOGGER.debug("read %s: retransmitting (%s)", sid, attempt + 1)
+            # retransmissions go first
+            self._queue.appendleft((sid, attempt + 1))
+            self._queued.add(sid)
+        self._pump()
+
+    def _progress(self):
+        complete = self.complete
+        if self._on_progress is not None:
+            self._on_progress(self._done, self._failed, self._total, complete)
+        if not complete:
+            return
+        result = (self._done, self._failed)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(result)
+
+class _Write(object):
+    """A write waiting to be sent, or waiting for its ack."""
+    __slots__ = ('device', 'data', 'meta', 'futures', 'sent_at', 'timer', 'expires_at')
+
+    def __init__(self, device, data, meta):
+        self.device = device
+        self.data = dict(data)
+        self.meta = None if meta is None else dict(meta)
+        self.futures = []
+        self.sent_at = None
+        self.timer = None
+        self.expires_at = None
+
+    def merge(self, data, meta):
+        """newer values of the same fields replace the pending ones"""
+        self.data.update(data)
+        if meta is not None:
+            self.meta = dict(meta)
+
+    def resolve(self, result):
+        """resolve all futures waiting for this write"""
+        for future in self.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def fail(self, exc):
+        """fail all futures waiting for this write"""
+        for future in self.futures:
+            if not future.done():
+                future.set_exception(exc)
+                # mark as retrieved, the writer may not wait for it
+                future.exception()
+
+class WriteQueue(object):
+    """Last-write-wins queue of the writes to a gateway.
+
+    Pending writes to the same sid are merged field by field, the newest value
+    of a field wins. Only one write is in flight at a time, the next one is sent
+    once the gateway acknowledges it (or after 'ack_timeout'), and no more than
+    'rate' writes are sent per second.
+
+    send_write(device, data, meta, on_sent) sends a write, on_sent() is called
+    once it is on the wire and starts its ack timer.
+
+    While held (e.g. until the gateway token arrives) writes are kept for up
+    to 'hold_timeout', and sent as soon as the queue is released.
+    """
+    def __init__(self, send_write, rate=AQARA_WRITE_RATE, ack_timeout=AQARA_WRITE_ACK_TIMEOUT,
+                 hold_timeout=AQARA_TOKEN_WAIT):
+        self.rate = rate
+        self.ack_timeout = ack_timeout
+        self.hold_timeout = hold_timeout
+        self._held = False
+        self._expire_handle = None
+        self._send_write = send_write
+        self._loop = None
+        self._pending = collections.OrderedDict()
+        self._in_flight = None
+        self._next_send_at = 0
+        self._pump_handle = None
+        self._coalesced = 0
+        self._latencies = collections.deque(maxlen=AQARA_LATENCY_SAMPLES)
+
+    @property
+    def coalesced(self):
+        """property: number of writes merged into a pending write"""
+        return self._coalesced
+
+    @property
+    def in_flight(self):
+        """property: sid of the write waiting for an ack, or None"""
+        return None if self._in_flight is None else self._in_flight.device.sid
+
+    @property
+    def latencies(self):
+        """property: latencies of the last acknowledged writes (unit: s)"""
+        return list(self._latencies)
+
+    @property
+    def last_latency(self):
+        """property: latency of the last acknowledged write (unit: s)"""
+        return self._latencies[-1] if self._latencies else None
+
+    @property
+    def held(self):
+        """property: writes are kept until release()"""
+        return self._held
+
+    def __len__(self):
+        return len(self._pending) + (0 if self._in_flight is None else 1)
+
+    def hold(self):
+        """Keep the writes queued until release(), each for up to hold_timeout"""
+        self._held = True
+
+    def release(self):
+        """Send the writes held so far"""
+        if not self._held:
+            return
+        self._held = False
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+        for write in self._pending.values():
+            write.expires_at = None
+        if self._pending:
+            self._pump()
+
+    def put(self, device, data, meta=None, track=False):
+        """Queue a write of 'data' to 'device'.
+
+        Return a future resolved with the write_ack data if 'track' is set.
+        """
+        self._loop = asyncio.get_event_loop()
+        sid = device.sid
+        write = self._pending.get(sid)
+        if write is None:
+            write = _Write(device, data, meta)
+            self._pending[sid] = write
+        else:
+            write.merge(data, meta)
+            self._coalesced += 1
+        future = None
+        if track:
+            future = asyncio.Future(loop=self._loop)
+            write.futures.append(future)
+        if self._held:
+            write.expires_at = self._loop.time() + self.hold_timeout
+            if self._expire_handle is None:
+                self._expire_handle = self._loop.call_at(write.expires_at, self._expire)
+            return future
+        self._pump()
+        return future
+
+    def ack(self, sid, data):
+        """Release the write in flight to 'sid', acknowledged with 'data'"""
+        write = self._release(sid)
+        if write is None:
+            return False
+        self._latencies.append(self._loop.time() - write.sent_at)
+        write.resolve(data)
+        self._pump()
+        return True
+
+    def reject(self, sid, exc):
+        """Release the write in flight to 'sid', rejected by the gateway"""
+        write = self._release(sid)
+        if write is None:
+            return False
+        write.fail(exc)
+        self._pump()
+        return True
+
+    def cancel(self, exc=None):
+        """Drop all pending writes, failing their futures with 'exc'"""
+        exc = asyncio.CancelledError() if exc is None else exc
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+        writes = list(self._pending.values())
+        self._pending.clear()
+        if self._in_flight is not None:
+            if self._in_flight.timer is not None:
+                self._in_flight.timer.cancel()
+            writes.append(self._in_flight)
+            self._in_flight = None
+        for write in writes:
+            write.fail(exc)
+
+    def _release(self, sid):
+        write = self._in_flight
+        if write is None or write.device.sid != sid:
+            return None
+        if write.timer is not None:
+            write.timer.cancel()
+        self._in_flight = None
+        return write
+
+    def _expire(self):
+        """drop the held writes kept for longer than hold_timeout"""
+        self._expire_handle = None
+        now = self._loop.time()
+        expired = [sid for sid, write in self._pending.items()
+                   if write.expires_at is not None and write.expires_at <= now]
+        for sid in expired:
+            write = self._pending.pop(sid)
+            _LOGGER.warning("write %s: dropped, held for %ss", sid, self.hold_timeout)
+            write.fail(asyncio.TimeoutError('write {} held for {}s'.format(sid, self.hold_timeout)))
+        remaining = [write.expires_at for write in self._pending.values()
+                     if write.expires_at is not None]
+        if remaining:
+            self._expire_handle = self._loop.call_at(min(remaining), self._expire)
+
+    def _pump(self):
+        """send the oldest pending write if none is in flight and the rate allows"""
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        if self._held:
+            return
+        while self._in_flight is None and self._pending:
+            now = self._loop.time()
+            if now < self._next_send_at:
+                self._pump_handle = self._loop.call_at(self._next_send_at, self._pump)
+                return
+            _sid, write = self._pending.popitem(last=False)
+            self._next_send_at = max(now, self._next_send_at) + 1.0 / self.rate
+            # in flight from now on, the ack timer starts once it is sent
+            write.sent_at = now
+            self._in_flight = write
+            try:
+                self._send_write(write.device, write.data, write.meta,
+                                 functools.partial(self._on_sent, write))
+            except Exception as exc: # pylint: disable=broad-except
+                _LOGGER.error("write %s failed: %s", write.device.sid, exc)
+                self._in_flight = None
+                write.fail(exc)
+                continue
+
+    def _on_sent(self, write):
+        if self._in_flight is not write or write.timer is not None:
+            return
+        write.sent_at = self._loop.time()
+        write.timer = self._loop.call_later(self.ack_timeout, self._on_timeout, write)
+
+    def _on_timeout(self, write):
+        if self._in_flight is not write:
+            return
+        _LOGGER.warning("write %s: no ack after %ss", write.device.sid, self.ack_timeout)
+        self._in_flight = None
+        write.fail(asyncio.TimeoutError('write {} timed out'.format(write.device.sid)))
+        self._pump()
+
+class OutboundScheduler(object):
+    """Priority lanes of the datagrams sent to gateways.
+
+    The highest class with a datagram to a gateway which may send goes first,
+    gateways take turns within a class. At most 'gateway_rate' datagrams per
+    gateway and 'rate' in total are sent per second, after a burst of 'burst'.
+    on_wait(seconds, class name) is called with the queue wait of each datagram,
+    and the on_sent() of a datagram once it is sent.
+    """
+    def __init__(self, send, rate=AQARA_OUTBOUND_RATE, gateway_rate=AQARA_OUTBOUND_GATEWAY_RATE,
+                 burst=AQARA_OUTBOUND_BURST, on_wait=None, clock=time.monotonic):
+        self.rate = rate
+        self.gateway_rate = gateway_rate
+        self.burst = burst
+        self._send = send
+        self._on_wait = on_wait
+        self._clock = clock
+        # addr -> one deque of (queued at, msg, on_sent) per class
+        self._lanes = {}
+        # gateways in turn order
+        self._order = collections.deque()
+        # theoretical arrival times, send allowed up to 'burst' - 1 intervals ahead
+        self._gateway_tat = {}
+        self._tat = 0.0
+        self._pending = 0
+        self._pump_handle = None
+
+    def __len__(self):
+        return self._pending
+
+    def queued(self, priority):
+        """Return the number of datagrams of class 'priority' waiting"""
+        return sum(len(lanes[priority]) for lanes in self._lanes.values())
+
+    def put(self, addr, msg, priority=PRIORITY_INTERACTIVE, on_sent=None):
+        """Send 'msg' to gateway 'addr' as soon as its class and the rates allow"""
+        lanes = self._lanes.get(addr)
+        if lanes is None:
+            lanes = self._lanes[addr] = tuple(collections.deque() for _ in PRIORITY_NAMES)
+            self._order.append(addr)
+        lanes[priority].append((self._clock(), msg, on_sent))
+        self._pending += 1
+        self._pump()
+
+    def cancel(self):
+        """Drop every datagram waiting"""
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        self._lanes.clear()
+        self._order.clear()
+        self._pending = 0
+
+    def _pump(self):
+        """send while the rates allow, then wait for the next slot"""
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        interval = 1.0 / self.rate
+        gateway_interval = 1.0 / self.gateway_rate
+        ahead = self.burst - 1
+        while self._pending:
+            now = self._clock()
+            next_at = self._tat - ahead * interval
+            if next_at > now:
+                self._schedule(next_at - now)
+                return
+            addr, priority = self._pick(now, ahead * gateway_interval)
+            if addr is None:
+                # every gateway with something queued is at its rate
+                waiting = [self._gateway_tat[addr] for addr, lanes in self._lanes.items()
+                           if any(lanes)]
+                self._schedule(min(waiting) - ahead * gateway_interval - now)
+                return
+            queued_at, msg, on_sent = self._lanes[addr][priority].popleft()
+            self._pending -= 1
+            self._tat = max(self._tat, now) + interval
+            self._gateway_tat[addr] = max(self._gateway_tat.get(addr, 0.0), now) + gateway_interval
+            self._order.remove(addr)
+            self._order.append(addr)
+            if self._on_wait is not None:
+                self._on_wait(now - queued_at, PRIORITY_NAMES[priority])
+            try:
+                self._send(addr, msg)
+            except Exception as exc: # pylint: disable=broad-except
+                _LOGGER.error("send to %s failed: %s", addr, exc)
+            if on_sent is not None:
+                # also when the send failed, the ack / retry timers take over
+                on_sent()
+
+    def _pick(self, now, ahead):
+        """(addr, class) of the next datagram, (None, None) if no gateway may send"""
+        limit = now + ahead
+        ready = [addr for addr in self._order if self._gateway_tat.get(addr, 0.0) <= limit]
+        for priority in range(len(PRIORITY_NAMES)):
+            for addr in ready:
+                if self._lanes[addr][priority]:
+                    return addr, priority
+        return None, None
+
+    def _schedule(self, delay):
+        loop = asyncio.get_event_loop()
+        self._pump_handle = loop.call_later(max(delay, 0), self._pump)
@@ -0,0 +1,205 @@
+"""
+Aqara Sharding
+
+Spread datagram decoding over several processes, feature including
+- N worker processes binding the listen port with SO_REUSEPORT
+- Multicast traffic split between workers by gateway address
+- Unicast traffic decoded by whichever worker the kernel picked
+- Reports and heartbeats of unknown sids dropped before decoding
+- Decoded messages forwarded to the coordinating client in batches
+
+Workers only receive and decode, the coordinator routes the decoded
+messages and applies all updates (gateways and devices live there).
+
+Requires Linux (SO_REUSEPORT load balancing and IP_PKTINFO).
+"""
+
+import logging
+import multiprocessing
+import socket
+import struct
+import sys
+import zlib
+
+from aqara.const import (LISTEN_IP, LISTEN_PORT, MCAST_ADDR)
+from aqara.decoder import AqaraDecoder
+
+_LOGGER = logging.getLogger(__name__)
+
+# not exposed by the socket module before python 3.12
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8 if sys.platform.startswith('linux') else None)
+
+MAX_DATAGRAM_SIZE = 65535
+SHARD_BATCH_SIZE = 256
+
+# kinds of the records forwarded to the coordinator
+RECORD_MESSAGE = "message"  # (kind, src_addr, outer fields, payload)
+RECORD_DROPPED = "dropped"  # (kind, cmd, sid) of an unknown sid
+RECORD_ERROR = "error"      # (kind, src_addr, data, cmd, reason)
+
+# commands dropped undecoded when their sid is unknown (workers and AqaraClient)
+SID_FILTERED_CMDS = frozenset(["report", "heartbeat"])
+
+_PKTINFO = struct.Struct("I4s4s")
+
+def shard_of(ip_addr, count):
+    """Return the worker index in charge of the multicast traffic of 'ip_addr'"""
+    return zlib.crc32(ip_addr.encode('utf-8')) % count
+
+def is_multicast(ancdata):
+    """Check the IP_PKTINFO ancillary data of a datagram for a multicast destination"""
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO and len(data) >= _PKTINFO.size:
+            _ifindex, _spec_dst, dst = _PKTINFO.unpack_from(data)
+            return 224 <= bytearray(dst)[0] <= 239
+    return False
+
+def make_record(decoder, data, addr, known_sids=None):
+    """Decode a datagram into the record forwarded to the coordinator.
+
+    A message record holds the outer fields without "data" and the decoded
+    "data" (or None). Reports and heartbeats of sids not in 'known_sids' are
+    not decoded, datagrams which can not be decoded give an error record.
+    """
+    cmd, sid = decoder.peek(data)
+    if known_sids is not None and cmd in SID_FILTERED_CMDS \
+            and sid is not None and sid not in known_sids:
+        return (RECORD_DROPPED, cmd, sid)
+    try:
+        msg = decoder.decode(data)
+    except ValueError as exc:
+        return (RECORD_ERROR, addr, data, cmd, str(exc))
+    payload = msg.payload if "data" in msg else None
+    fields = dict(msg)
+    fields.pop("data", None)
+    return (RECORD_MESSAGE, addr, fields, payload)
+
+def bind_reuseport(listen_addr, mcast_addr=MCAST_ADDR):
+    """Create a datagram socket sharing 'listen_addr' with the other workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+    sock.bind(listen_addr)
+    mreq = struct.pack("4sL", socket.inet_aton(mcast_addr), socket.INADDR_ANY)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    except OSError as exc:
+        _LOGGER.warning("multicast membership not added: %s", exc)
+    return sock
+
+def _worker_main(index, count, listen_addr, json_backend, conn, sids_conn, ready):
+    """worker process: receive, decode and forward datagrams until the coordinator leaves"""
+    # pylint: disable=too-many-arguments,too-many-locals
+    sock = bind_reuseport(listen_addr)
+    decoder = AqaraDecoder(json_backend)
+    ancsize = socket.CMSG_SPACE(_PKTINFO.size)
+    ready.set()
+    flags = 0
+    batch = []
+    known_sids = frozenset()
+    while True:
+        try:
+            data, ancdata, _flags, addr = sock.recvmsg(MAX_DATAGRAM_SIZE, ancsize, flags)
+        except BlockingIOError:
+            # drained: forward what we have, then block for the next datagram
+            flags = 0
+            if not batch:
+                continue
+            try:
+                conn.send(batch)
+            except (BrokenPipeError, EOFError):
+                return
+            batch = []
+            continue
+        if not flags:
+            # woken up: take the sids pushed by the coordinator meanwhile
+            while sids_conn.poll():
+                known_sids = sids_conn.recv()
+        flags = socket.MSG_DONTWAIT
+        if is_multicast(ancdata) and shard_of(addr[0], count) != index:
+            continue
+        batch.append(make_record(decoder, data, addr, known_sids))
+        if len(batch) >= SHARD_BATCH_SIZE:
+            try:
+                conn.send(batch)
+            except (BrokenPipeError, EOFError):
+                return
+            batch = []
+
+class ShardPool(object):
+    """Worker processes decoding datagrams for a coordinating client."""
+    def __init__(self, count, handle_batch, json_backend,
+                 listen_addr=(LISTEN_IP, LISTEN_PORT)):
+        if IP_PKTINFO is None or not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('Sharded mode is not supported on this platform')
+        self._count = count
+        self._handle_batch = handle_batch
+        self._json_backend = json_backend
+        self._listen_addr = listen_addr
+        self._workers = []
+        self._loop = None
+        self._known_sids = frozenset()
+
+    @property
+    def count(self):
+        """property: number of workers"""
+        return self._count
+
+    def start(self, loop, timeout=10):
+        """Start the workers, and forward their batches to 'handle_batch' in 'loop'"""
+        self._loop = loop
+        context = multiprocessing.get_context("spawn")
+        for index in range(self._count):
+            reader, writer = context.Pipe(duplex=False)
+            sids_reader, sids_writer = context.Pipe(duplex=False)
+            sids_writer.send(self._known_sids)
+            ready = context.Event()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, self._count, self._listen_addr, self._json_backend,
+                      writer, sids_reader, ready),
+                name="aqara-shard-{}".format(index),
+                daemon=True
+            )
+            process.start()
+            writer.close()
+            sids_reader.close()
+            if not ready.wait(timeout):
+                process.terminate()
+                self.stop()
+                raise RuntimeError('shard worker {} did not start'.format(index))
+            loop.add_reader(reader.fileno(), self._on_readable, reader)
+            self._workers.append((process, reader, sids_writer))
+        _LOGGER.info("started %s shard workers", self._count)
+
+    def stop(self):
+        """Stop all workers"""
+        for process, reader, sids_writer in self._workers:
+            self._loop.remove_reader(reader.fileno())
+            reader.close()
+            sids_writer.close()
+            process.terminate()
+        for process, _reader, _sids_writer in self._workers:
+            process.join()
+        self._workers = []
+
+    def set_known_sids(self, sids):
+        """Push the sids of known gateways and devices to the workers, if changed"""
+        sids = frozenset(sids)
+        if sids == self._known_sids:
+            return
+        self._known_sids = sids
+        for _process, _reader, sids_writer in self._workers:
+            try:
+                sids_writer.send(sids)
+            except (BrokenPipeError, EOFError):
+                pass
+
+    def _on_readable(self, reader):
+        try:
+            while reader.poll():
+                self._handle_batch(reader.recv())
+        except EOFError:
+            _LOGGER.error("shard worker exited")
+            self._loop.remove_reader(reader.fileno())
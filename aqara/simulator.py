@@ -0,0 +1,368 @@
+"""
+Aqara Simulator
+
+Emulate gateways over local UDP, for benchmarks and load tests, feature including
+- Answer whois / get_id_list / read / write like a gateway (write keys are
+  checked against the token, as derived by the client)
+- Gateway heartbeats with a new token each time
+- Report and heartbeat traffic of sensor_ht / motion / magnet / switch devices,
+  at a configurable mix and rate
+- Each gateway has its own loopback address (127.1.x.y) and port, announced in
+  its iam
+
+Usage with a client:
+
+    simulator = GatewaySimulator(gateways=4, devices=50, report_rate=200)
+    yield from simulator.start(loop)
+    client = AqaraClient(simulator.secrets)
+    client.listen_addr = ("127.0.0.1", 0)
+    client.discovery_addr = simulator.discovery_addr
+    yield from client.start(loop)
+
+or standalone: python -m aqara.simulator --gateways 4 --devices 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import string
+
+from aqara.crypto import make_key
+from aqara.const import (
+    AQARA_DEVICE_HT,
+    AQARA_DEVICE_MOTION,
+    AQARA_DEVICE_MAGNET,
+    AQARA_DEVICE_SWITCH,
+    AQARA_DEVICE_GATEWAY,
+    SIMULATOR_TICK
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# relative share of each device model in a simulated site
+SIMULATOR_MIX = {
+    AQARA_DEVICE_HT: 4,
+    AQARA_DEVICE_MAGNET: 3,
+    AQARA_DEVICE_MOTION: 2,
+    AQARA_DEVICE_SWITCH: 1,
+}
+
+_SWITCH_STATUS = ("click", "double_click", "long_click_press", "long_click_release")
+
+def _encode(msg):
+    return json.dumps(msg, separators=(',', ':')).encode('utf-8')
+
+def _gateway_ip(index):
+    """loopback address of gateway 'index'"""
+    return "127.1.{}.{}".format(index // 254, index % 254 + 1)
+
+class SimulatedDevice(object):
+    """A device attached to a simulated gateway."""
+    __slots__ = ('sid', 'model', 'short_id', 'voltage', 'status', 'temperature', 'humidity')
+
+    def __init__(self, sid, model, short_id, rand):
+        self.sid = sid
+        self.model = model
+        self.short_id = short_id
+        self.voltage = rand.randint(2800, 3100)
+        self.status = "close" if model == AQARA_DEVICE_MAGNET else None
+        self.temperature = rand.randint(1800, 2600)
+        self.humidity = rand.randint(3000, 7000)
+
+    def state(self):
+        """data of a read_ack / heartbeat"""
+        data = {"voltage": self.voltage}
+        if self.model == AQARA_DEVICE_HT:
+            data["temperature"] = str(self.temperature)
+            data["humidity"] = str(self.humidity)
+        elif self.model == AQARA_DEVICE_MAGNET:
+            data["status"] = self.status
+        return data
+
+    def report(self, rand):
+        """change the state, return the data of the report"""
+        if self.model == AQARA_DEVICE_HT:
+            self.temperature += rand.randint(-20, 20)
+            self.humidity += rand.randint(-50, 50)
+            return {"temperature": str(self.temperature), "humidity": str(self.humidity)}
+        elif self.model == AQARA_DEVICE_MAGNET:
+            self.status = "open" if self.status == "close" else "close"
+            return {"status": self.status}
+        elif self.model == AQARA_DEVICE_MOTION:
+            return {"status": "motion"}
+        return {"status": rand.choice(_SWITCH_STATUS)}
+
+class SimulatedGateway(asyncio.DatagramProtocol):
+    """A simulated gateway, answering the requests sent to its socket."""
+    def __init__(self, simulator, sid, ip, password, devices):
+        self.transport = None
+        self.sid = sid
+        self.ip = ip
+        self.password = password
+        self.devices = devices
+        self.token = simulator.new_token()
+        self.rgb = 0
+        self.illumination = 1000
+        self._simulator = simulator
+
+    @property
+    def port(self):
+        """property: port the gateway listens on"""
+        return self.transport.get_extra_info('sockname')[1]
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = json.loads(data.decode('utf-8'))
+            cmd = msg["cmd"]
+        except (ValueError, KeyError):
+            _LOGGER.warning("gateway %s: invalid request %s", self.sid, data)
+            return
+        self._simulator.received += 1
+        if cmd == "get_id_list":
+            self.send({
+                "cmd": "get_id_list_ack", "sid": self.sid, "token": self.token,
+                "data": json.dumps(list(self.devices))
+            }, addr)
+        elif cmd == "read":
+            self._on_read(msg.get("sid"), addr)
+        elif cmd == "write":
+            self._on_write(msg, addr)
+
+    def iam(self, addr):
+        """answer a whois"""
+        self.send({
+            "cmd": "iam", "port": str(self.port), "sid": self.sid,
+            "model": AQARA_DEVICE_GATEWAY, "ip": self.ip
+        }, addr)
+
+    def heartbeat(self, addr):
+        """send a gateway heartbeat, with a new token"""
+        self.token = self._simulator.new_token()
+        self.send({
+            "cmd": "heartbeat", "model": AQARA_DEVICE_GATEWAY, "sid": self.sid,
+            "short_id": "0", "token": self.token,
+            "data": json.dumps({"ip": self.ip})
+        }, addr)
+
+    def device_message(self, cmd, device, data, addr):
+        """send a report / heartbeat of 'device'"""
+        self.send({
+            "cmd": cmd, "model": device.model, "sid": device.sid,
+            "short_id": device.short_id, "data": json.dumps(data)
+        }, addr)
+
+    def send(self, msg, addr):
+        """send 'msg' to 'addr'"""
+        self.transport.sendto(_encode(msg), addr)
+        self._simulator.sent += 1
+
+    def _gateway_state(self):
+        return {"rgb": self.rgb, "illumination": self.illumination, "proto_version": "1.0.9"}
+
+    def _on_read(self, sid, addr):
+        if sid == self.sid:
+            model, data = AQARA_DEVICE_GATEWAY, self._gateway_state()
+        elif sid in self.devices:
+            device = self.devices[sid]
+            model, data = device.model, device.state()
+        else:
+            self.send({"cmd": "read_ack", "sid": sid,
+                       "data": json.dumps({"error": "No device"})}, addr)
+            return
+        self.send({"cmd": "read_ack", "model": model, "sid": sid,
+                   "data": json.dumps(data)}, addr)
+
+    def _on_write(self, msg, addr):
+        sid = msg.get("sid")
+        data = json.loads(msg.get("data", "{}"))
+        expected = None
+        if self.token is not None:
+            expected = make_key(self.password, self.token)
+        if expected is None or data.pop("key", None) != expected:
+            self.send({"cmd": "write_ack", "sid": sid,
+                       "data": json.dumps({"error": "Invalid key"})}, addr)
+            return
+        if sid != self.sid:
+            self.send({"cmd": "write_ack", "sid": sid,
+                       "data": json.dumps({"error": "No device"})}, addr)
+            return
+        if "rgb" in data:
+            self.rgb = data["rgb"]
+        self.send({"cmd": "write_ack", "model": AQARA_DEVICE_GATEWAY, "sid": sid,
+                   "data": json.dumps(self._gateway_state())}, addr)
+
+class _Discovery(asyncio.DatagramProtocol):
+    """answer whois for all the gateways of the simulator"""
+    def __init__(self, simulator):
+        self._simulator = simulator
+
+    def datagram_received(self, data, addr):
+        if b'"whois"' in data:
+            self._simulator.on_whois(addr)
+
+class GatewaySimulator(object):
+    """Simulated site of 'gateways' gateways with 'devices' devices each.
+
+    'report_rate' and 'heartbeat_rate' are the reports / device heartbeats sent
+    per second by the whole site, to 'target' (default: the sender of the last
+    whois), gateways heartbeat every 'gateway_heartbeat_interval' seconds.
+    """
+    def __init__(self, gateways=1, devices=10, mix=None, report_rate=0.0,
+                 heartbeat_rate=0.0, gateway_heartbeat_interval=10.0, target=None,
+                 discovery_port=0, seed=0):
+        self._rand = random.Random(seed)
+        self._mix = SIMULATOR_MIX if mix is None else mix
+        self._gateway_count = gateways
+        self._device_count = devices
+        self.report_rate = report_rate
+        self.heartbeat_rate = heartbeat_rate
+        self.gateway_heartbeat_interval = gateway_heartbeat_interval
+        self.target = target
+        self._follow_whois = target is None
+        self._discovery_port = discovery_port
+        self._discovery = None
+        self._gateways = []
+        self._devices = []
+        self._loop = None
+        self._handles = {}
+        self._due = {"report": 0.0, "heartbeat": 0.0}
+        self.sent = 0
+        self.received = 0
+
+    @property
+    def gateways(self):
+        """property: simulated gateways"""
+        return self._gateways
+
+    @property
+    def secrets(self):
+        """property: gateway passwords by sid, as taken by AqaraClient"""
+        return {gateway.sid: gateway.password for gateway in self._gateways}
+
+    @property
+    def discovery_addr(self):
+        """property: address answering whois"""
+        return self._discovery.get_extra_info('sockname')
+
+    @asyncio.coroutine
+    def start(self, loop):
+        """Bind the sockets of the gateways, start sending traffic"""
+        self._loop = loop
+        self._discovery, _protocol = yield from loop.create_datagram_endpoint(
+            lambda: _Discovery(self), local_addr=("127.0.0.1", self._discovery_port))
+        models = self._make_models()
+        for index in range(self._gateway_count):
+            gateway = yield from self._start_gateway(loop, index, models)
+            self._gateways.append(gateway)
+        self._handles["heartbeat"] = loop.call_soon(self._gateway_heartbeats)
+        self._handles["tick"] = loop.call_later(SIMULATOR_TICK, self._tick)
+        _LOGGER.info("simulating %d gateways, %d devices at %s",
+                     len(self._gateways), len(self._devices), self.discovery_addr)
+
+    def stop(self):
+        """Stop sending traffic, close the sockets"""
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles = {}
+        for gateway in self._gateways:
+            gateway.transport.close()
+        if self._discovery is not None:
+            self._discovery.close()
+            self._discovery = None
+
+    def on_whois(self, addr):
+        """every gateway answers, heartbeats are sent to the last client seen"""
+        if self._follow_whois:
+            self.target = addr
+        for gateway in self._gateways:
+            gateway.iam(addr)
+
+    def new_token(self):
+        """Return a random 16 characters token"""
+        return ''.join(self._rand.choice(string.ascii_letters + string.digits)
+                       for _ in range(16))
+
+    def emit(self, cmd, count):
+        """Send 'count' reports / heartbeats of random devices now"""
+        if self.target is None or not self._devices:
+            return
+        rand = self._rand
+        for _ in range(count):
+            gateway, device = rand.choice(self._devices)
+            if cmd == "report":
+                data = device.report(rand)
+            else:
+                data = device.state()
+            gateway.device_message(cmd, device, data, self.target)
+
+    def _make_models(self):
+        models = []
+        for model, share in sorted(self._mix.items()):
+            models.extend([model] * share)
+        return models
+
+    @asyncio.coroutine
+    def _start_gateway(self, loop, index, models):
+        rand = self._rand
+        sid = "7811dc{:06x}".format(index)
+        devices = {}
+        for device_index in range(self._device_count):
+            device_sid = "158d{:06x}{:04x}".format(index, device_index)
+            devices[device_sid] = SimulatedDevice(
+                device_sid, rand.choice(models), rand.randint(1, 65535), rand)
+        password = ''.join(rand.choice(string.ascii_lowercase + string.digits)
+                           for _ in range(16))
+        ip = _gateway_ip(index)
+        _transport, gateway = yield from loop.create_datagram_endpoint(
+            lambda: SimulatedGateway(self, sid, ip, password, devices), local_addr=(ip, 0))
+        self._devices.extend((gateway, device) for device in devices.values())
+        return gateway
+
+    def _gateway_heartbeats(self):
+        if self.target is not None:
+            for gateway in self._gateways:
+                gateway.heartbeat(self.target)
+        self._handles["heartbeat"] = self._loop.call_later(
+            self.gateway_heartbeat_interval, self._gateway_heartbeats)
+
+    def _tick(self):
+        """send the traffic due since the last tick"""
+        for cmd, rate in (("report", self.report_rate), ("heartbeat", self.heartbeat_rate)):
+            self._due[cmd] += rate * SIMULATOR_TICK
+            count = int(self._due[cmd])
+            self._due[cmd] -= count
+            self.emit(cmd, count)
+        self._handles["tick"] = self._loop.call_later(SIMULATOR_TICK, self._tick)
+
+def main():
+    """Run a simulator until interrupted"""
+    parser = argparse.ArgumentParser(description="Simulate Aqara gateways on localhost")
+    parser.add_argument("--gateways", type=int, default=1)
+    parser.add_argument("--devices", type=int, default=10, help="devices per gateway")
+    parser.add_argument("--report-rate", type=float, default=10.0, help="reports per s")
+    parser.add_argument("--heartbeat-rate", type=float, default=1.0, help="heartbeats per s")
+    parser.add_argument("--port", type=int, default=4321, help="port answering whois")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    loop = asyncio.get_event_loop()
+    simulator = GatewaySimulator(args.gateways, args.devices, report_rate=args.report_rate,
+                                 heartbeat_rate=args.heartbeat_rate,
+                                 discovery_port=args.port)
+    loop.run_until_complete(simulator.start(loop))
+    for sid, password in sorted(simulator.secrets.items()):
+        print("{} {}".format(sid, password))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+    loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Aqara Snapshot
+
+Registry snapshot for a warm start, feature including
+- Gateways (sid, addr), devices (sid, model, gateway) and their last-known state
+- Compact JSON, only the store columns which differ from their default
+- Atomic save (write to a temporary file, then rename)
+
+The snapshot holds no secret and no token, those are learnt again from the
+network.
+"""
+
+import json
+import logging
+import os
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+def _device_state(store, sid):
+    index = store.index(sid)
+    state = {}
+    for name in store.columns:
+        value = store.column(name)[index]
+        if value != store.default(name):
+            state[name] = value
+    return state
+
+def take_snapshot(client):
+    """Return the snapshot of the gateways and devices of 'client'"""
+    store = client.store
+    gateways = []
+    for gateway in client.gateways.values():
+        devices = [
+            [device.sid, device.model, _device_state(store, device.sid)]
+            for device in gateway.devices.values() if device is not gateway
+        ]
+        gateways.append({
+            "sid": gateway.sid,
+            "addr": gateway.addr,
+            "state": _device_state(store, gateway.sid),
+            "devices": devices
+        })
+    return {"version": SNAPSHOT_VERSION, "time": time.time(), "gateways": gateways}
+
+def restore_state(store, sid, state):
+    """Write the saved 'state' of 'sid' back to the store"""
+    index = store.add(sid)
+    for name, value in state.items():
+        if name not in store.columns:
+            _LOGGER.debug("restore_state(): unknown column %s", name)
+            continue
+        store.column(name)[index] = value
+
+def save_snapshot(snapshot, path):
+    """Write 'snapshot' to 'path', atomically"""
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+        json.dump(snapshot, tmp_file, separators=(',', ':'))
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+def load_snapshot(path):
+    """Return the snapshot saved at 'path', None if missing or unusable"""
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        _LOGGER.warning("can not load snapshot %s: %s", path, exc)
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        _LOGGER.warning("ignored snapshot %s: unsupported version", path)
+        return None
+    return snapshot
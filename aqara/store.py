@@ -0,0 +1,106 @@
+"""
+Aqara Device Store
+
+Compact state of all devices of a client, feature including
+- One slot per device, indexed by sid (the store keeps the one sid string)
+- Hot fields kept in typed columnar arrays (array module)
+- Device objects are thin __slots__ views over their slot
+- Optional time series of the columns (see aqara.history)
+"""
+
+import array
+
+from aqara.const import (AQARA_HISTORY_SIZE, AQARA_HISTORY_FIELDS)
+
+# column name -> (typecode, value of an unknown / unset field)
+STORE_COLUMNS = {
+    "voltage": ('H', 0),
+    "temperature": ('d', 0.0),
+    "humidity": ('d', 0.0),
+    "triggered": ('b', 0),
+    "action": ('b', -1),
+    "last_seen": ('d', 0.0),
+    "offline": ('b', 0),
+}
+
+class DeviceStore(object):
+    """Columnar store of device state."""
+    def __init__(self):
+        self._index = {}
+        self._sids = []
+        self._defaults = {}
+        self._columns = {}
+        # same as column(name), for hot loops
+        self.columns_by_name = self._columns
+        self.history = None
+        # aqara.liveness.LivenessTracker, set by the client
+        self.liveness = None
+        # aqara.stream.EventHub, set by the client
+        self.events = None
+        for name, (typecode, default) in STORE_COLUMNS.items():
+            self.add_column(name, typecode, default)
+
+    def __len__(self):
+        return len(self._sids)
+
+    def __contains__(self, sid):
+        return sid in self._index
+
+    @property
+    def sids(self):
+        """property: sids, in slot order"""
+        return list(self._sids)
+
+    @property
+    def columns(self):
+        """property: column names"""
+        return list(self._columns)
+
+    def add_column(self, name, typecode, default):
+        """Add a typed column, also exposed as attribute 'name'"""
+        if name in self._columns:
+            return self._columns[name]
+        column = array.array(typecode, [default]) * len(self._sids)
+        self._columns[name] = column
+        self._defaults[name] = default
+        setattr(self, name, column)
+        return column
+
+    def enable_history(self, size=AQARA_HISTORY_SIZE, fields=AQARA_HISTORY_FIELDS):
+        """Keep the last 'size' samples of 'fields' per device (requires numpy)"""
+        if self.history is None:
+            from aqara.history import DeviceHistory
+            self.history = DeviceHistory(self, size, fields)
+        return self.history
+
+    def column(self, name):
+        """Return column 'name'"""
+        return self._columns[name]
+
+    def default(self, name):
+        """Return the value of an unset field of column 'name'"""
+        return self._defaults[name]
+
+    def add(self, sid):
+        """Return the slot of 'sid', allocating one if needed"""
+        index = self._index.get(sid)
+        if index is not None:
+            return index
+        index = len(self._sids)
+        self._sids.append(sid)
+        self._index[sid] = index
+        for name, column in self._columns.items():
+            column.append(self._defaults[name])
+        return index
+
+    def index(self, sid):
+        """Return the slot of 'sid', None if unknown"""
+        return self._index.get(sid)
+
+    def sid(self, index):
+        """Return the sid of slot 'index'"""
+        return self._sids[index]
+
+    def nbytes(self):
+        """Return the memory used by the columns (unit: bytes)"""
+        return sum(column.itemsize * len(column) for column in self._columns.values())
@@ -0,0 +1,206 @@
+"""
+Aqara Event Streams
+
+Consume events at your own pace instead of in callbacks, feature including
+- async for event in client.events(): one bounded queue per stream
+- Overflow policies: drop oldest, drop newest, coalesce per sid, block
+- Block pauses reading from the socket until the stream drains (transports
+  with pause_reading, e.g. batch_receive=True)
+- Queue depth and drop counts per stream
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+from aqara.const import AQARA_STREAM_QUEUE_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_BLOCK = "block"
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_COALESCE,
+                     OVERFLOW_BLOCK)
+
+EVENT_UPDATE = "update"
+EVENT_HEARTBEAT = "heartbeat"
+EVENT_AVAILABILITY = "availability"
+EVENT_NEW_GATEWAY = "new_gateway"
+EVENT_NEW_DEVICE = "new_device"
+
+# data: {column: (old, new)} for update / heartbeat, {"available": bool} for
+# availability, None otherwise
+AqaraEvent = collections.namedtuple("AqaraEvent", ["kind", "sid", "model", "data", "time"])
+
+class StreamClosed(Exception):
+    """Raised by EventStream.get once the stream is closed and drained"""
+    pass
+
+def _merge(queued, event):
+    """coalesce 'event' into the 'queued' event of the same sid and kind"""
+    if isinstance(queued.data, dict) and isinstance(event.data, dict) \
+            and event.kind != EVENT_AVAILABILITY:
+        data = dict(queued.data)
+        for field, (old, new) in event.data.items():
+            data[field] = (data[field][0] if field in data else old, new)
+        return event._replace(data=data)
+    return event
+
+class EventStream(object):
+    """Bounded queue of the events of a client matching a filter."""
+    def __init__(self, hub, filter_func=None, maxsize=AQARA_STREAM_QUEUE_SIZE,
+                 policy=OVERFLOW_DROP_OLDEST):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unsupported overflow policy: {}'.format(policy))
+        self._hub = hub
+        self._filter = filter_func
+        self._maxsize = maxsize
+        self._policy = policy
+        # (kind, sid) -> event when coalescing, else a deque of events
+        if policy == OVERFLOW_COALESCE:
+            self._queue = collections.OrderedDict()
+        else:
+            self._queue = collections.deque()
+        self._waiter = None
+        self._closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def policy(self):
+        """property: overflow policy"""
+        return self._policy
+
+    @property
+    def depth(self):
+        """property: number of queued events"""
+        return len(self._queue)
+
+    @property
+    def full(self):
+        """property: queue reached maxsize"""
+        return len(self._queue) >= self._maxsize
+
+    def put(self, event):
+        """Queue 'event' if it matches the filter, applying the overflow policy"""
+        if self._closed or (self._filter is not None and not self._filter(event)):
+            return
+        queue = self._queue
+        policy = self._policy
+        if policy == OVERFLOW_COALESCE:
+            key = (event.kind, event.sid)
+            queued = queue.pop(key, None)
+            if queued is not None:
+                self.coalesced += 1
+                event = _merge(queued, event)
+            elif len(queue) >= self._maxsize:
+                queue.popitem(last=False)
+                self.dropped += 1
+            queue[key] = event
+        elif policy == OVERFLOW_BLOCK:
+            # keep every event, stop reading until the consumer catches up
+            queue.append(event)
+            if len(queue) >= self._maxsize:
+                self._hub.block(self)
+        elif len(queue) < self._maxsize:
+            queue.append(event)
+        elif policy == OVERFLOW_DROP_OLDEST:
+            queue.popleft()
+            queue.append(event)
+            self.dropped += 1
+        else:
+            self.dropped += 1
+            return
+        self._wake()
+
+    @asyncio.coroutine
+    def get(self):
+        """Return the next event, raise StreamClosed once closed and drained"""
+        while not self._queue:
+            if self._closed:
+                raise StreamClosed()
+            self._waiter = asyncio.Future(loop=asyncio.get_event_loop())
+            try:
+                yield from self._waiter
+            finally:
+                self._waiter = None
+        if self._policy == OVERFLOW_COALESCE:
+            event = self._queue.popitem(last=False)[1]
+        else:
+            event = self._queue.popleft()
+            if self._policy == OVERFLOW_BLOCK and len(self._queue) < self._maxsize:
+                self._hub.unblock(self)
+        return event
+
+    def close(self):
+        """Stop receiving events, get() returns the queued ones then raises StreamClosed"""
+        if self._closed:
+            return
+        self._closed = True
+        self._hub.remove(self)
+        self._wake()
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        try:
+            return (yield from self.get())
+        except StreamClosed:
+            raise StopAsyncIteration()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+class EventHub(object):
+    """Event streams of a client."""
+    def __init__(self):
+        self.streams = []
+        # transport paused while a blocking stream is full
+        self.transport = None
+        self._blocked = set()
+
+    def open(self, filter_func=None, maxsize=AQARA_STREAM_QUEUE_SIZE,
+             policy=OVERFLOW_DROP_OLDEST):
+        """Return a new EventStream of the events matching filter_func(event)"""
+        stream = EventStream(self, filter_func, maxsize, policy)
+        self.streams.append(stream)
+        return stream
+
+    def remove(self, stream):
+        """Forget 'stream'"""
+        if stream in self.streams:
+            self.streams.remove(stream)
+        self.unblock(stream)
+
+    def publish(self, kind, sid, model, data=None):
+        """Queue an event in every stream"""
+        event = AqaraEvent(kind, sid, model, data, time.time())
+        for stream in self.streams:
+            stream.put(event)
+
+    def block(self, stream):
+        """Pause reading while 'stream' is full"""
+        if not self._blocked:
+            pause_reading = getattr(self.transport, "pause_reading", None)
+            if pause_reading is None:
+                _LOGGER.debug("block(): transport can not pause, queueing past maxsize")
+            else:
+                pause_reading()
+        self._blocked.add(stream)
+
+    def unblock(self, stream):
+        """Resume reading once no stream is full"""
+        if stream not in self._blocked:
+            return
+        self._blocked.discard(stream)
+        if not self._blocked:
+            resume_reading = getattr(self.transport, "resume_reading", None)
+            if resume_reading is not None:
+                resume_reading()
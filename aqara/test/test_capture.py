@@ -0,0 +1,79 @@
+"""Aqara Capture Test"""
+# pylint: disable=protected-access
+import asyncio
+import json
+
+import pytest
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.capture import (CaptureWriter, read_capture, capture_snapshot, feed, replay)
+
+GW_ADDR = ("10.10.10.10", 4321)
+
+def _datagram(cmd, model, sid, data):
+    msg = {"cmd": cmd, "model": model, "sid": sid, "data": json.dumps(data)}
+    return json.dumps(msg).encode('utf-8')
+
+TRAFFIC = [
+    _datagram("heartbeat", "gateway", "123456", {"ip": GW_ADDR[0]}),
+    _datagram("report", "magnet", "abcdef", {"status": "open"}),
+    _datagram("report", "sensor_ht", "fedcba", {"temperature": "2351"}),
+]
+
+def test_capture_rotation(tmpdir):
+    """Test if captured datagrams are read back in order across rotated files"""
+    path = str(tmpdir.join("aqara.cap"))
+    client = AqaraClient()
+    client.start_capture(path, max_bytes=200, backups=2)
+    for timestamp, data in enumerate(TRAFFIC):
+        client.capture.write(data, GW_ADDR, timestamp)
+    client.stop_capture()
+
+    records = list(read_capture(path + ".1")) + list(read_capture(path))
+    assert [data for _, _, data in records] == TRAFFIC
+    assert [timestamp for timestamp, _, _ in records] == [0, 1, 2]
+    assert records[0][1] == GW_ADDR
+
+def test_no_capture_in_sharded_mode(tmpdir):
+    """Test if capture is refused when the workers receive the datagrams"""
+    path = str(tmpdir.join("aqara.cap"))
+    client = AqaraClient()
+    client._shards = MagicMock()
+    with pytest.raises(RuntimeError):
+        client.start_capture(path)
+    assert client.capture is None
+
+    client = AqaraClient()
+    client.start_capture(path)
+    loop = asyncio.new_event_loop()
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(client.start(loop, workers=2))
+    loop.close()
+    assert client._shards is None
+    client.stop_capture()
+
+def test_replay(tmpdir):
+    """Test if a capture replays into a client without gateways"""
+    path = str(tmpdir.join("aqara.cap"))
+    writer = CaptureWriter(path)
+    for timestamp, data in enumerate(TRAFFIC):
+        writer.write(data, GW_ADDR, timestamp * 0.01)
+    writer.close()
+    records = list(read_capture(path))
+
+    client = AqaraClient()
+    client.unicast = MagicMock()
+    client.restore_snapshot(capture_snapshot(records))
+    gateway = client.gateways["123456"]
+    gateway.refresh_scheduler.cancel()
+    assert feed(client, records) == 3
+    assert gateway.devices["abcdef"].triggered
+
+    gateway.devices["fedcba"].on_update({"temperature": "0"})
+    loop = asyncio.new_event_loop()
+    try:
+        count = loop.run_until_complete(replay(client, records, speed=2.0, loop=loop))
+    finally:
+        loop.close()
+    assert count == 3
+    assert gateway.devices["fedcba"].temperature == 23.5
@@ -136,3 +136,70 @@ def test_handle_message_heartbeat():
     mock_gateway.on_device_heartbeat.assert_called_once_with(
         "gateway", gw_sid, {"ip": gw_addr}, "ffffff"
     )
+
+def test_unknown_sid_report_not_decoded():
+    """Test if a report of an unregistered sid is dropped before decoding"""
+    client = AqaraClient()
+    client.handle_message = MagicMock()
+    msg_report = {
+        "cmd": "report",
+        "model": "magnet",
+        "sid": "abcdef",
+        "data": json.dumps({"status": "open"})
+    }
+    datagram = json.dumps(msg_report).encode('utf-8')
+
+    client.datagram_received(datagram, "10.10.10.10")
+    client.handle_message.assert_not_called()
+
+    client._device_to_gw["abcdef"] = MagicMock()
+    client.datagram_received(datagram, "10.10.10.10")
+    client.handle_message.assert_called_once_with(msg_report, "10.10.10.10")
+
+def test_add_route():
+    """Test if a command is routed to a registered handler with its decoded data"""
+    client = AqaraClient()
+    handler = MagicMock()
+    client.add_route("device_list_ack", handler)
+    msg = {"cmd": "device_list_ack", "sid": "123456", "data": json.dumps(["1"])}
+
+    client.handle_message(msg, "10.10.10.10")
+    client.handle_message({"cmd": "unknown", "sid": "123456"}, "10.10.10.10")
+
+    handler.assert_called_once_with("123456", msg, ["1"])
+
+def test_dedup_window():
+    """Test if repeated reports are dropped within the dedup window only"""
+    clock = MagicMock(return_value=100.0)
+    client = AqaraClient(dedup_window=1.0, dedup_clock=clock)
+    client.on_report = MagicMock()
+    msg_report = {
+        "cmd": "report",
+        "model": "magnet",
+        "sid": "abcdef",
+        "data": json.dumps({"status": "open"})
+    }
+    msg_close = dict(msg_report, data=json.dumps({"status": "close"}))
+
+    client.handle_message(msg_report, "10.10.10.10")
+    client.handle_message(dict(msg_report), "10.10.10.11")
+    client.handle_message(msg_close, "10.10.10.10")
+    assert client.on_report.call_count == 2
+    assert client.metrics.duplicates.value("report") == 1
+
+    clock.return_value = 101.5
+    client.handle_message(msg_report, "10.10.10.10")
+    assert client.on_report.call_count == 3
+
+def test_malformed_datagrams():
+    """Test if malformed datagrams are counted as decode errors and dropped"""
+    client = AqaraClient()
+    client.unicast = MagicMock()
+    client.datagram_received(b'{"cmd":"iam","sid":"123456","ip":"10.10.10.10"}', "10.10.10.10")
+    for data in (b'{}', b'[1,2]', b'"iam"', b'{"cmd":"report"}', b'{"cmd":"iam","sid":"1"}',
+                 b'{"cmd":"read_ack","sid":"123456","model":"gateway","data":"[1]"}'):
+        client.datagram_received(data, "10.10.10.10")
+    client.datagrams_received([(b'[1,2]', "10.10.10.10"), (b'{}', "10.10.10.10")])
+
+    assert client.metrics.decode_errors.value() == 8
+    assert list(client.gateways) == ["123456"]
@@ -0,0 +1,46 @@
+"""Aqara Crypto Test"""
+# pylint: disable=protected-access
+import pytest
+from unittest.mock import (ANY, MagicMock, patch)
+from aqara.client import AqaraClient
+from aqara.crypto import (available_crypto_backends, make_key, load_crypto_backend)
+from aqara.gateway import AqaraGateway
+
+SECRET = "0123456789abcdef"
+TOKEN = "1nw9IXlw6WY2QhTD"
+
+def test_backends_agree():
+    """Test if all installed backends derive the same key"""
+    backends = available_crypto_backends()
+    assert backends
+    keys = set(make_key(SECRET, TOKEN, backend) for backend in backends)
+    assert len(keys) == 1
+    assert len(keys.pop()) == 32
+
+def test_unknown_backend():
+    """Test if an unknown backend is rejected"""
+    with pytest.raises(ValueError):
+        load_crypto_backend("rot13")
+
+def test_key_cached_per_token():
+    """Test if the key is derived once per token, when the token arrives"""
+    client = AqaraClient()
+    client.write_device = MagicMock()
+    gateway = AqaraGateway(client, "123456", "10.10.10.10", SECRET)
+
+    with patch('aqara.gateway.make_key', return_value="key1") as mock_make_key:
+        gateway.on_device_heartbeat("gateway", "123456", {}, TOKEN)
+        mock_make_key.assert_called_once_with(SECRET, TOKEN, "auto")
+        for _ in range(3):
+            gateway._send_write(gateway, {"rgb": 0}, None)
+        gateway.on_device_heartbeat("gateway", "123456", {}, TOKEN)
+        assert mock_make_key.call_count == 1
+
+        mock_make_key.return_value = "key2"
+        gateway.on_device_heartbeat("gateway", "123456", {}, "new_token_123456")
+        gateway._send_write(gateway, {"rgb": 0}, None)
+        assert mock_make_key.call_count == 2
+
+    client.write_device.assert_called_with(
+        "10.10.10.10", "gateway", "123456", {"rgb": 0, "key": "key2"}, None, on_sent=ANY
+    )
@@ -0,0 +1,55 @@
+"""Aqara Decoder Test"""
+# pylint: disable=protected-access
+import json
+
+import pytest
+from unittest.mock import MagicMock
+from aqara.decoder import (
+    AqaraDecoder,
+    AqaraMessage,
+    available_json_backends,
+    load_json_backend,
+    JSON_BACKEND_STDLIB
+)
+
+REPORT = json.dumps({
+    "cmd": "report",
+    "model": "sensor_ht",
+    "sid": "158d0001a2b3c4",
+    "short_id": 4660,
+    "data": json.dumps({"temperature": "2351"})
+}).encode('utf-8')
+
+@pytest.mark.parametrize("backend", available_json_backends())
+def test_decode(backend):
+    """Test if every installed backend decodes bytes into an AqaraMessage"""
+    decoder = AqaraDecoder(backend)
+
+    msg = decoder.decode(REPORT)
+
+    assert isinstance(msg, AqaraMessage)
+    assert msg == json.loads(REPORT.decode('utf-8'))
+    assert msg.cmd == "report"
+    assert msg.sid == "158d0001a2b3c4"
+    assert msg.payload == {"temperature": "2351"}
+
+def test_payload_is_lazy():
+    """Test if the nested data is decoded once, and only when accessed"""
+    loads = MagicMock(return_value={"status": "open"})
+    msg = AqaraMessage({"cmd": "report", "data": '{"status": "open"}'}, loads)
+
+    loads.assert_not_called()
+    assert msg.payload == {"status": "open"}
+    assert msg.payload == {"status": "open"}
+    loads.assert_called_once_with('{"status": "open"}')
+
+def test_peek():
+    """Test if cmd and sid are found without decoding"""
+    assert AqaraDecoder.peek(REPORT) == ("report", "158d0001a2b3c4")
+    assert AqaraDecoder.peek(b'{"cmd": "whois"}') == ("whois", None)
+
+def test_unknown_backend():
+    """Test if an unknown backend is rejected"""
+    with pytest.raises(ValueError):
+        load_json_backend("yaml")
+    assert load_json_backend(JSON_BACKEND_STDLIB)(b'{"a": 1}') == {"a": 1}
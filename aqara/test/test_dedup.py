@@ -0,0 +1,21 @@
+"""Aqara Dedup Test"""
+from unittest.mock import MagicMock
+from aqara.dedup import DuplicateFilter
+
+def test_bounded():
+    """Test if keys expire after the window and the oldest are evicted past capacity"""
+    clock = MagicMock(return_value=0.0)
+    dedup = DuplicateFilter(window=1.0, capacity=2, clock=clock)
+
+    assert not dedup.is_duplicate("a")
+    assert dedup.is_duplicate("a")
+    assert not dedup.is_duplicate("b")
+    assert not dedup.is_duplicate("c")
+    assert len(dedup) == 2
+    # "a" was evicted
+    assert not dedup.is_duplicate("a")
+
+    clock.return_value = 1.5
+    assert not dedup.is_duplicate("b")
+    assert len(dedup) == 1
+    assert dedup.dropped == 1
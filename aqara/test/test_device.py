@@ -0,0 +1,165 @@
+"""Aqara Device Test"""
+# pylint: disable=protected-access
+import pytest
+from aqara.client import AqaraClient
+from unittest.mock import MagicMock
+from aqara.device import (create_device, register_device_model, DEVICE_REGISTRY,
+                          AqaraBaseDevice)
+from aqara.gateway import AqaraGateway
+
+def _make_gateway():
+    client = AqaraClient()
+    return AqaraGateway(client, "123456", "10.10.10.10", None)
+
+def test_ht_sensor_state_in_store():
+    """Test if sensor_ht values are parsed into the store columns"""
+    gateway = _make_gateway()
+    sensor = create_device(gateway, "sensor_ht", "abcdef")
+    assert sensor.voltage is None
+    assert sensor.last_seen is None
+
+    sensor.on_heartbeat({"voltage": 3005, "temperature": "2351", "humidity": "6015"})
+
+    assert sensor.temperature == 23.5
+    assert sensor.humidity == 60.1
+    assert sensor.voltage == 3005
+    assert sensor.last_seen is not None
+    store = gateway.store
+    assert store.temperature[store.index("abcdef")] == 23.5
+
+def test_binary_sensors_and_switch():
+    """Test if triggered and action round-trip through the store"""
+    gateway = _make_gateway()
+    magnet = create_device(gateway, "magnet", "1")
+    motion = create_device(gateway, "motion", "2")
+    switch = create_device(gateway, "switch", "3")
+    assert not magnet.triggered
+    assert switch.action is None
+
+    magnet.on_update({"status": "open"})
+    motion.on_update({"status": "motion"})
+    switch.on_update({"status": "double_click"})
+    assert magnet.triggered
+    assert motion.triggered
+    assert switch.action == "double_click"
+
+    motion.on_update({})
+    assert not motion.triggered
+
+def test_devices_have_no_dict():
+    """Test if sensors are __slots__ views sharing one store slot per sid"""
+    gateway = _make_gateway()
+    sensor = create_device(gateway, "motion", "abcdef")
+    with pytest.raises(AttributeError):
+        sensor.__dict__ # pylint: disable=pointless-statement
+    again = create_device(gateway, "motion", "abcdef")
+    assert again._index == sensor._index
+    assert len(gateway.store) == 2
+
+def test_hardware_mix():
+    """Test if plugs, cubes, leak sensors and wall switches decode their payloads"""
+    gateway = _make_gateway()
+    gateway.write_device = MagicMock()
+    plug = create_device(gateway, "plug", "1")
+    cube = create_device(gateway, "cube", "2")
+    leak = create_device(gateway, "sensor_wleak.aq1", "3")
+    wall = create_device(gateway, "86sw2", "4")
+    wired = create_device(gateway, "ctrl_neutral2", "5")
+
+    plug.on_heartbeat({"voltage": 3600, "status": "on", "inuse": "1", "load_power": "3.23",
+                       "power_consumed": "4190"})
+    cube.on_update({"status": "flip90"})
+    leak.on_update({"status": "leak"})
+    wall.on_update({"channel_1": "click"})
+    wired.on_update({"channel_0": "on"})
+
+    assert plug.is_on and plug.in_use
+    assert plug.load_power == 3.23
+    assert plug.power_consumed == 4190
+    assert cube.action == "flip90"
+    cube.on_update({"rotate": "-45,500"})
+    assert cube.action == "rotate" and cube.rotation == -45
+    assert leak.triggered
+    assert wall.action is None and wall.action_1 == "click"
+    assert wired.is_channel_on(0) and not wired.is_channel_on(1)
+
+    plug.turn_off()
+    wired.turn_on(1)
+    gateway.write_device.assert_any_call(plug, {"status": "off"})
+    gateway.write_device.assert_any_call(wired, {"channel_1": "on"})
+
+def test_invalid_values_ignored():
+    """Test if values which do not parse are logged and skipped, the others applied"""
+    gateway = _make_gateway()
+    sensor = create_device(gateway, "sensor_ht", "abcdef")
+    plug = create_device(gateway, "plug", "1")
+    cube = create_device(gateway, "cube", "2")
+
+    sensor.on_update({"temperature": "2351"})
+    sensor.on_update({"temperature": "abc", "humidity": "6015"})
+    plug.on_update({"load_power": "n/a", "status": "on"})
+    cube.on_update({"rotate": ",500"})
+
+    assert sensor.temperature == 23.5 and sensor.humidity == 60.1
+    assert plug.is_on and plug.load_power == 0.0
+    assert cube.action is None and cube.rotation == 0
+
+def test_register_device_model():
+    """Test if a model is added without editing the device module"""
+    class Curtain(AqaraBaseDevice):
+        """curtain"""
+        __slots__ = ()
+        FIELDS = {"curtain_level": ("curtain_level", int)}
+        COLUMNS = {"curtain_level": ('B', 0)}
+
+        def __init__(self, gateway, sid, model):
+            super().__init__(model, gateway, sid)
+
+    gateway = _make_gateway()
+    with pytest.raises(RuntimeError):
+        create_device(gateway, "curtain", "1")
+    register_device_model("curtain", Curtain)
+    try:
+        curtain = create_device(gateway, "curtain", "1")
+        curtain.on_update({"curtain_level": "42"})
+        assert gateway.store.curtain_level[curtain._index] == 42
+    finally:
+        del DEVICE_REGISTRY["curtain"]
+
+def test_change_only_notifications():
+    """Test if update signals are only sent on changes, with per-field old and new values"""
+    gateway = _make_gateway()
+    sensor = create_device(gateway, "sensor_ht", "abcdef")
+    switch = create_device(gateway, "switch", "3")
+    updates = []
+    temperatures = []
+    def handle_heartbeat(changes):
+        updates.append(changes)
+    def handle_temperature(field, old, new):
+        temperatures.append((field, old, new))
+    def handle_action(old, new):
+        updates.append((old, new))
+    sensor.subscribe_heartbeat(handle_heartbeat)
+    sensor.subscribe_field("temperature", handle_temperature)
+    switch.subscribe_field("action", handle_action)
+
+    sensor.on_heartbeat({"temperature": "2351", "humidity": "6015"})
+    sensor.on_heartbeat({"temperature": "2351", "humidity": "6015"})
+    sensor.on_heartbeat({"temperature": "2351", "humidity": "6100"})
+    assert len(updates) == 2
+    assert updates[1] == {"humidity": (60.1, 61.0)}
+    assert temperatures == [("temperature", 0.0, 23.5)]
+
+    # events notify even when repeated, with the values of the properties
+    switch.on_update({"status": "click"})
+    switch.on_update({"status": "click"})
+    switch.on_update({"status": "double_click"})
+    assert updates[2:] == [(None, "click"), ("click", "click"), ("click", "double_click")]
+
+    magnet = create_device(gateway, "magnet", "4")
+    triggered = []
+    def handle_triggered(field, old, new):
+        triggered.append((field, old, new))
+    magnet.subscribe_field("triggered", handle_triggered)
+    magnet.on_update({"status": "open", "voltage": 3005})
+    assert triggered == [("triggered", False, True)]
@@ -0,0 +1,144 @@
+"""Aqara Event Bus Test"""
+# pylint: disable=protected-access
+import asyncio
+import concurrent.futures
+import gc
+import time
+
+from unittest.mock import MagicMock
+from aqara.dispatch import (EventBus, MODE_THREAD, MODE_LOOP)
+
+class Sender(object):
+    """weak referenceable sender"""
+    pass
+
+def test_send_to_sender_receivers_only():
+    """Test if receivers only get signals of the sender they subscribed to"""
+    bus = EventBus()
+    sender, other = Sender(), Sender()
+    handler = MagicMock()
+    bus.connect(handler, signal="update", sender=sender)
+
+    bus.send("update", other)
+    bus.send("heartbeat", sender)
+    handler.assert_not_called()
+
+    bus.send("update", sender, device=1)
+    handler.assert_called_once_with(signal="update", sender=sender, device=1)
+
+def test_receiver_signature():
+    """Test if receivers are only passed the arguments they accept"""
+    bus = EventBus()
+    sender = Sender()
+    calls = []
+
+    def no_args():
+        calls.append(())
+
+    def sender_only(sender):
+        calls.append((sender,))
+
+    def with_kwargs(sender, **kwargs):
+        calls.append((sender, kwargs))
+
+    for receiver in (no_args, sender_only, with_kwargs):
+        bus.connect(receiver, signal="update", sender=sender)
+    bus.send("update", sender, device=1)
+
+    assert calls == [(), (sender,), (sender, {"signal": "update", "device": 1})]
+
+def test_disconnect():
+    """Test if a disconnected receiver is not called anymore"""
+    bus = EventBus()
+    sender = Sender()
+    handler = MagicMock()
+    bus.connect(handler, signal="update", sender=sender)
+    bus.connect(handler, signal="update", sender=sender)
+
+    bus.disconnect(handler, signal="update", sender=sender)
+    bus.send("update", sender)
+
+    handler.assert_not_called()
+    assert not bus.has_receivers("update", sender)
+
+def test_weak_references():
+    """Test if receivers and senders are dropped once garbage collected"""
+    bus = EventBus()
+    sender = Sender()
+
+    class Handler(object):
+        """receiver with a bound method"""
+        def handle(self):
+            """handle"""
+            pass
+
+    handler = Handler()
+    bus.connect(handler.handle, signal="update", sender=sender)
+    assert bus.receivers("update", sender) == [handler.handle]
+
+    del handler
+    gc.collect()
+    assert not bus.has_receivers("update", sender)
+
+    bus.connect(MagicMock(), signal="update", sender=sender, weak=False)
+    del sender
+    gc.collect()
+    assert not bus._receivers
+    assert not bus._senders
+
+def test_execution_modes():
+    """Test if offloaded receivers run in order per sender and are timed"""
+    bus = EventBus()
+    sender = Sender()
+    calls = []
+
+    def in_thread(value):
+        calls.append(("thread", value))
+
+    def on_loop(value):
+        calls.append(("loop", value))
+
+    bus.connect(in_thread, signal="update", sender=sender, mode=MODE_THREAD)
+    bus.connect(on_loop, signal="update", sender=sender, mode=MODE_LOOP)
+    loop = asyncio.new_event_loop()
+    try:
+        @asyncio.coroutine
+        def send_all():
+            futures = [bus.send("update", sender, value=value)[0][1] for value in range(5)]
+            yield from asyncio.wait(futures)
+        loop.run_until_complete(send_all())
+    finally:
+        loop.close()
+        bus.shutdown()
+
+    assert [value for mode, value in calls if mode == "thread"] == list(range(5))
+    assert [value for mode, value in calls if mode == "loop"] == list(range(5))
+    timings = {name.split(".")[-1]: (mode, count) for name, mode, count, _, _ in bus.timings()}
+    assert timings == {"in_thread": ("thread", 5), "on_loop": ("loop", 5)}
+
+def test_offloaded_timing_excludes_queue():
+    """Test if offloaded receivers are timed in the worker, not while queued"""
+    bus = EventBus()
+    bus.set_executor(MODE_THREAD, concurrent.futures.ThreadPoolExecutor(1))
+    senders = [Sender() for _ in range(4)]
+
+    def slow():
+        time.sleep(0.05)
+
+    for sender in senders:
+        bus.connect(slow, signal="update", sender=sender, mode=MODE_THREAD)
+    loop = asyncio.new_event_loop()
+    try:
+        @asyncio.coroutine
+        def send_all():
+            futures = [bus.send("update", sender)[0][1] for sender in senders]
+            yield from asyncio.wait(futures)
+        loop.run_until_complete(send_all())
+    finally:
+        loop.close()
+        bus.shutdown()
+
+    # one entry per sender, the last call waited ~0.15s in the single worker
+    timings = bus.timings()
+    assert [calls for _name, _mode, calls, _seconds, _slowest in timings] == [1, 1, 1, 1]
+    assert all(0.05 <= slowest < 0.1 for _name, _mode, _calls, _seconds, slowest in timings)
@@ -0,0 +1,139 @@
+"""Aqara Gateway Test"""
+# pylint: disable=protected-access
+import asyncio
+
+import pytest
+from unittest.mock import (ANY, MagicMock)
+from aqara.client import AqaraClient
+from aqara.gateway import AqaraGateway
+
+GW_ADDR = "10.10.10.10"
+GW_SID = "123456"
+DEVICE_SID = "abcdef"
+
+def _make_gateway():
+    client = AqaraClient()
+    client.unicast = MagicMock()
+    gateway = AqaraGateway(client, GW_SID, GW_ADDR, None)
+    client._gateways[GW_SID] = gateway
+    client._device_to_gw[GW_SID] = gateway
+    client._device_to_gw[DEVICE_SID] = gateway
+    return client, gateway
+
+def test_read_single_flight():
+    """Test if concurrent reads of a sid share one request and get the ack data"""
+    loop = asyncio.new_event_loop()
+    client, gateway = _make_gateway()
+
+    @asyncio.coroutine
+    def scenario():
+        reads = [asyncio.ensure_future(gateway.read(DEVICE_SID)) for _ in range(3)]
+        yield from asyncio.sleep(0)
+        gateway.on_read_ack("magnet", DEVICE_SID, {"status": "open"})
+        return (yield from asyncio.gather(*reads))
+
+    results = loop.run_until_complete(scenario())
+    loop.close()
+
+    client.unicast.assert_called_once_with(GW_ADDR, {"cmd": "read", "sid": DEVICE_SID})
+    assert results == [{"status": "open"}] * 3
+    assert len(gateway.read_requests.latencies) == 1
+    assert not gateway.read_requests
+
+def test_read_timeout():
+    """Test if a read without ack times out and the next read is sent again"""
+    loop = asyncio.new_event_loop()
+    client, gateway = _make_gateway()
+
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(gateway.read(DEVICE_SID, timeout=0.01))
+    loop.run_until_complete(asyncio.sleep(0.02))
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(gateway.read(DEVICE_SID, timeout=0.01))
+    loop.close()
+
+    assert client.unicast.call_count == 2
+
+def test_write():
+    """Test if write resolves with the write_ack, and fails on a write error"""
+    loop = asyncio.new_event_loop()
+    _client, gateway = _make_gateway()
+    gateway.write_requests.rate = 1000
+
+    @asyncio.coroutine
+    def scenario():
+        write = asyncio.ensure_future(gateway.write(gateway, {"rgb": 1}))
+        yield from asyncio.sleep(0)
+        gateway.on_write_ack("gateway", GW_SID, {"rgb": 1})
+        return (yield from write)
+
+    assert loop.run_until_complete(scenario()) == {"rgb": 1}
+    assert gateway.rgbw == 1
+
+    @asyncio.coroutine
+    def failing():
+        write = asyncio.ensure_future(gateway.write(gateway, {"rgb": 2}))
+        yield from asyncio.sleep(0.01)
+        gateway.on_write_error(GW_SID, {"error": "Invalid key"})
+        return (yield from write)
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(failing())
+    loop.close()
+
+def test_write_coalescing():
+    """Test if pending writes to the same field collapse into the newest value"""
+    loop = asyncio.new_event_loop()
+    client, gateway = _make_gateway()
+    client.write_device = MagicMock()
+
+    @asyncio.coroutine
+    def scenario():
+        for rgbw in range(10):
+            gateway.set_light(rgbw)
+        yield from asyncio.sleep(0)
+        gateway.on_write_ack("gateway", GW_SID, {"rgb": 0})
+        yield from asyncio.sleep(0.2)
+
+    loop.run_until_complete(scenario())
+    loop.close()
+
+    assert client.write_device.call_count == 2
+    client.write_device.assert_called_with(
+        GW_ADDR, "gateway", GW_SID, {"rgb": 9}, {"short_id": 0, "key": 8}, on_sent=ANY
+    )
+    assert gateway.write_requests.coalesced == 8
+
+def test_write_held_until_token():
+    """Test if writes before the first token are sent once any message carries one"""
+    loop = asyncio.new_event_loop()
+    client = AqaraClient(gw_secrets={GW_SID: "0123456789abcdef"})
+    client.write_device = MagicMock()
+    gateway = client._add_gateway(GW_SID, GW_ADDR)
+    gateway.refresh_scheduler.cancel()
+    gateway.write_requests.hold_timeout = 0.05
+
+    @asyncio.coroutine
+    def scenario():
+        gateway.set_light(1)
+        expiring = asyncio.ensure_future(gateway.write(client.gateways[GW_SID], {"rgb": 2}))
+        yield from asyncio.sleep(0.1)
+        assert not client.write_device.called
+        with pytest.raises(asyncio.TimeoutError):
+            yield from expiring
+
+        gateway.set_light(3)
+        client.handle_message({
+            "cmd": "get_id_list_ack", "sid": GW_SID, "token": "1nw9IXlw6WY2QhTD",
+            "data": "[]",
+        }, GW_ADDR)
+        yield from asyncio.sleep(0)
+
+    loop.run_until_complete(scenario())
+    loop.close()
+
+    assert not gateway.write_requests.held
+    assert client.write_device.call_count == 1
+    data = client.write_device.call_args[0][3]
+    assert data["rgb"] == 3
+    assert len(data["key"]) == 32
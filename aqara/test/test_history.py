@@ -0,0 +1,76 @@
+"""Aqara History Test"""
+import pytest
+from aqara.client import AqaraClient
+from aqara.device import create_device
+from aqara.gateway import AqaraGateway
+
+np = pytest.importorskip("numpy")
+
+def _make_sensors(count):
+    client = AqaraClient()
+    gateway = AqaraGateway(client, "123456", "10.10.10.10", None)
+    history = client.store.enable_history(size=4)
+    sensors = [create_device(gateway, "sensor_ht", str(i)) for i in range(count)]
+    return history, sensors
+
+def test_ring_buffer_wraps():
+    """Test if only the last 'size' samples are kept, oldest first"""
+    history, sensors = _make_sensors(1)
+    index = sensors[0]._index
+    for i in range(6):
+        sensors[0]._store.voltage[index] = 3000 - i
+        history.record(index, {"voltage": 0}, 100.0 + i)
+
+    times, values = history.series("0", "voltage")
+    assert list(times) == [102.0, 103.0, 104.0, 105.0]
+    assert list(values) == [2998, 2997, 2996, 2995]
+
+def test_filled_from_updates():
+    """Test if device updates and heartbeats are recorded"""
+    history, sensors = _make_sensors(20)
+    for sensor in sensors:
+        sensor.on_update({"temperature": "2000"})
+        sensor.on_heartbeat({"voltage": 3000, "temperature": "2200"})
+
+    sids = [sensor.sid for sensor in sensors]
+    stats = history.stats("temperature", sids)
+    assert list(stats["min"]) == [20.0] * 20
+    assert list(stats["max"]) == [22.0] * 20
+    assert list(stats["count"]) == [2] * 20
+    assert list(history.stats("voltage", sids)["count"]) == [1] * 20
+    assert list(history.stats("humidity", sids)["count"]) == [0] * 20
+    # the gateway has a slot too, without samples
+    assert len(history.stats("temperature")["count"]) == 21
+
+def test_window_rate_and_trend():
+    """Test if queries only use samples within the window"""
+    history, sensors = _make_sensors(2)
+    store = sensors[0]._store
+    index = sensors[0]._index
+    for i, voltage in enumerate([3000, 2990, 2980]):
+        store.voltage[index] = voltage
+        history.record(index, {"voltage": 0}, 86400.0 * i)
+
+    stats = history.stats("voltage", sids=["0", "1"], window=86400, now=86400.0 * 2)
+    assert stats["mean"][0] == 2985
+    assert stats["count"][1] == 0
+    assert np.isnan(stats["mean"][1])
+
+    rate = history.rate("voltage", sids=["0", "1"])
+    assert rate[0] == pytest.approx(-10 / 86400.0)
+    assert np.isnan(rate[1])
+    assert history.voltage_trend(["0"])[0] == pytest.approx(-10)
+
+    with pytest.raises(KeyError):
+        history.stats("voltage", sids=["unknown"])
+
+def test_devices_without_samples():
+    """Test if queries of all slots cover the devices added since the last sample"""
+    history, sensors = _make_sensors(20)
+    store = sensors[0]._store
+    # the gateway and 20 sensors, past the initial capacity
+    assert len(store) == 21
+
+    assert list(history.stats("voltage")["count"]) == [0] * 21
+    assert np.all(np.isnan(history.voltage_trend()))
+    assert np.all(np.isnan(history.rate("voltage")))
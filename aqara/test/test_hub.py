@@ -0,0 +1,98 @@
+"""Aqara Hub Test"""
+# pylint: disable=protected-access
+import asyncio
+
+import pytest
+from unittest.mock import MagicMock
+from aqara.hub import AqaraHub
+from aqara.stream import EVENT_NEW_GATEWAY
+
+GW_ADDR = "10.10.10.10"
+GW_SID = "123456"
+SECRET = "0123456789abcdef"
+
+def test_shared_listener():
+    """Test if handles share one client, started by the first and stopped with the last"""
+    loop = asyncio.new_event_loop()
+    hub = AqaraHub()
+    client = hub.client
+    starts = []
+
+    @asyncio.coroutine
+    def start(loop, **kwargs):
+        starts.append(kwargs)
+    client.start = start
+    client.stop = MagicMock()
+
+    integration = hub.attach()
+    recorder = hub.attach()
+
+    @asyncio.coroutine
+    def scenario():
+        yield from asyncio.gather(integration.start(loop, batch_receive=True),
+                                  recorder.start(loop))
+
+    loop.run_until_complete(scenario())
+    assert starts == [{"batch_receive": True}]
+
+    new_gateways = []
+    def on_new_gateway(gateway):
+        new_gateways.append(gateway.sid)
+    integration.subscribe(on_new_gateway)
+    streams = [integration.events(), recorder.events()]
+    client._add_gateway(GW_SID, GW_ADDR)
+
+    assert new_gateways == [GW_SID]
+    assert recorder.gateways is integration.gateways
+    assert [stream.depth for stream in streams] == [1, 1]
+    assert streams[0]._queue[0].kind == EVENT_NEW_GATEWAY
+
+    integration.stop()
+    assert not client.stop.called
+    assert integration not in hub.handles
+    client._add_gateway("654321", GW_ADDR)
+    assert new_gateways == [GW_SID]
+    assert streams[1].depth == 2
+
+    recorder.stop()
+    client.stop.assert_called_once_with()
+    assert not hub.running
+    loop.close()
+
+def test_subscriptions_per_handle():
+    """Test if the same handler subscribed by two handles stays subscribed for the other"""
+    hub = AqaraHub()
+    first = hub.attach()
+    second = hub.attach()
+    new_gateways = []
+    def on_new_gateway(gateway):
+        new_gateways.append(gateway.sid)
+    first.subscribe(on_new_gateway)
+    second.subscribe(on_new_gateway)
+
+    hub.client._add_gateway(GW_SID, GW_ADDR)
+    assert new_gateways == [GW_SID, GW_SID]
+
+    first.stop()
+    hub.client._add_gateway("654321", GW_ADDR)
+    assert new_gateways == [GW_SID, GW_SID, "654321"]
+
+    second.unsubscribe(on_new_gateway)
+    hub.client._add_gateway("abcdef", GW_ADDR)
+    assert new_gateways == [GW_SID, GW_SID, "654321"]
+
+def test_secrets():
+    """Test if the secrets of a handle apply to discovered gateways, and may not differ"""
+    hub = AqaraHub()
+    hub.client.write_device = MagicMock()
+    gateway = hub.client._add_gateway(GW_SID, GW_ADDR)
+    gateway.refresh_scheduler.cancel()
+    hub.attach()
+    assert not gateway.write_requests.held
+
+    hub.attach({GW_SID: SECRET})
+    assert gateway.write_requests.held
+    assert hub.attach({GW_SID: SECRET}) in hub.handles
+    with pytest.raises(ValueError):
+        hub.attach({GW_SID: "fedcba9876543210"})
+    assert len(hub.handles) == 3
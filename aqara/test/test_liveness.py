@@ -0,0 +1,66 @@
+"""Aqara Liveness Test"""
+# pylint: disable=protected-access
+import time
+
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.liveness import TimerWheel, LivenessTracker
+
+def test_timer_wheel_expire():
+    """Test if keys expire once their deadline passed, including after more than one turn"""
+    on_expire = MagicMock()
+    wheel = TimerWheel(on_expire, tick=1.0, slots=8, now=100.0)
+    wheel.schedule("a", 103.5)
+    wheel.schedule("b", 120.0)
+    assert len(wheel) == 2
+
+    wheel.advance(102.0)
+    on_expire.assert_not_called()
+    wheel.advance(104.0)
+    on_expire.assert_called_once_with("a", 104.0)
+    # "b" shares a bucket with tick 112, but is one turn later
+    wheel.advance(112.0)
+    assert on_expire.call_count == 1
+    wheel.advance(200.0)
+    on_expire.assert_called_with("b", 200.0)
+    assert len(wheel) == 0
+
+def test_offline_online():
+    """Test if a silent device goes offline and back online on its next message"""
+    client = AqaraClient()
+    gateway = client._add_gateway("123456", "10.10.10.10")
+    gateway.on_read_ack("magnet", "abcdef", {"status": "open"})
+    sensor = gateway.devices["abcdef"]
+    liveness = client.liveness
+    events = []
+    def handle_availability(available):
+        events.append(available)
+    sensor.subscribe_availability(handle_availability)
+    last_seen = sensor.last_seen
+    interval = liveness.interval("magnet")
+
+    liveness.wheel.advance(last_seen + interval - 10)
+    assert sensor.available
+    liveness.wheel.advance(last_seen + interval + 10)
+    assert not sensor.available
+    assert events == [False]
+
+    gateway.on_device_report("magnet", "abcdef", {"status": "close"})
+    assert sensor.available
+    assert events == [False, True]
+
+def test_rescheduled_when_seen():
+    """Test if a device heard from before its deadline is not reported offline"""
+    store = MagicMock()
+    now = time.time()
+    store.last_seen = [now]
+    store.offline = [0]
+    device = MagicMock(_index=0, model="magnet")
+    liveness = LivenessTracker(store, intervals={"magnet": 60})
+    liveness.track(device)
+
+    store.last_seen[0] = now + 50
+    liveness.wheel.advance(now + 70)
+    assert store.offline[0] == 0
+    liveness.wheel.advance(now + 120)
+    assert store.offline[0] == 1
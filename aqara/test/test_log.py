@@ -0,0 +1,50 @@
+"""Aqara Logging Test"""
+import logging
+
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.log import (MESSAGE_LOGGER, SamplingFilter, LazyJSON)
+
+class Records(logging.Handler):
+    """keep the records emitted"""
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def test_message_records():
+    """Test if per-message records carry structured fields and are sampled"""
+    client = AqaraClient()
+    gateway = client._add_gateway("123456", "10.10.10.10") # pylint: disable=protected-access
+    handler = Records()
+    clock = MagicMock(return_value=0.0)
+    sampling = SamplingFilter(2, clock)
+    MESSAGE_LOGGER.addHandler(handler)
+    MESSAGE_LOGGER.addFilter(sampling)
+    MESSAGE_LOGGER.setLevel(logging.INFO)
+    try:
+        for status in ("open", "close", "open"):
+            gateway.on_read_ack("magnet", "abcdef", {"status": status})
+        clock.return_value = 1.0
+        gateway.on_device_report("magnet", "abcdef", {"status": "close"})
+    finally:
+        MESSAGE_LOGGER.removeHandler(handler)
+        MESSAGE_LOGGER.removeFilter(sampling)
+        MESSAGE_LOGGER.setLevel(logging.NOTSET)
+
+    assert len(handler.records) == 3
+    record = handler.records[0]
+    assert (record.aqara_event, record.aqara_sid, record.aqara_model) == \
+        ("on_update", "abcdef", "magnet")
+    assert record.getMessage() == 'on_update abcdef [magnet]: {"status": "open"}'
+    assert handler.records[2].aqara_suppressed == 1
+
+def test_lazy_json():
+    """Test if payloads are only serialized when formatted"""
+    value = MagicMock()
+    lazy = LazyJSON(value)
+    value.assert_not_called()
+    assert str(LazyJSON({"a": 1})) == '{"a": 1}'
+    assert str(lazy) == repr(value)
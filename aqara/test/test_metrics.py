@@ -0,0 +1,52 @@
+"""Aqara Metrics Test"""
+import json
+
+from aqara.client import AqaraClient
+from aqara.metrics import MetricsRegistry
+
+def test_prometheus_export():
+    """Test if counters and histograms are exported in the Prometheus text format"""
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A counter", ("cmd",))
+    histogram = registry.histogram("test_seconds", "A histogram", ("cmd",), (0.1, 1.0))
+    counter.inc("report")
+    counter.inc("report")
+    histogram.observe(0.05, "report")
+    histogram.observe(0.5, "report")
+
+    assert registry.snapshot()["test_total"] == {("report",): 2}
+    assert registry.prometheus().splitlines() == [
+        '# HELP test_seconds A histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{cmd="report",le="0.1"} 1',
+        'test_seconds_bucket{cmd="report",le="1.0"} 2',
+        'test_seconds_bucket{cmd="report",le="+Inf"} 2',
+        'test_seconds_sum{cmd="report"} 0.55',
+        'test_seconds_count{cmd="report"} 2',
+        '# HELP test_total A counter',
+        '# TYPE test_total counter',
+        'test_total{cmd="report"} 2',
+    ]
+
+def test_client_metrics():
+    """Test if received datagrams, decode errors and unknown sids are counted"""
+    client = AqaraClient()
+    metrics = client.metrics
+    iam = {"cmd": "iam", "ip": "10.10.10.10", "sid": "123456"}
+    report = {"cmd": "report", "model": "magnet", "sid": "abcdef",
+              "data": json.dumps({"status": "open"})}
+
+    client.datagram_received(json.dumps(iam).encode('utf-8'), "10.10.10.10")
+    client.datagram_received(b'{"cmd":"heartbeat", broken', "10.10.10.10")
+    client.datagram_received(json.dumps(report).encode('utf-8'), "10.10.10.10")
+    client.on_heartbeat("gateway", "123456", {}, "token")
+    client.on_heartbeat("gateway", "123456", {}, "token")
+
+    assert metrics.datagrams.value("iam") == 1
+    assert metrics.datagrams.value("heartbeat") == 1
+    assert metrics.decode_errors.value() == 1
+    assert metrics.unknown_sids.value("report") == 1
+    assert metrics.handler_latency.count("iam") == 1
+    assert metrics.gateway_messages.value("123456", "heartbeat") == 2
+    assert metrics.heartbeat_gap.count("123456") == 1
+    assert "aqara_decode_errors_total 1" in metrics.prometheus()
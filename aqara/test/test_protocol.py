@@ -46,3 +46,21 @@ def test_broadcast():
 
     test_data_encoded = json.dumps(test_data).encode('utf-8')
     mock_transport.sendto.assert_called_with(test_data_encoded, (MCAST_ADDR, MCAST_PORT))
+
+def test_datagrams_received():
+    """test_datagrams_received"""
+    mock_protocol = protocol.AqaraProtocol()
+    mock_protocol.handle_messages = MagicMock()
+    mock_protocol.accept_message = lambda cmd, sid: sid != "dropped"
+    batch = [
+        (json.dumps({"cmd": "report", "sid": "1"}).encode('utf-8'), "10.10.10.10"),
+        (json.dumps({"cmd": "report", "sid": "dropped"}).encode('utf-8'), "10.10.10.10"),
+        (json.dumps({"cmd": "report", "sid": "2"}).encode('utf-8'), "10.10.10.11")
+    ]
+
+    mock_protocol.datagrams_received(batch)
+
+    mock_protocol.handle_messages.assert_called_once_with([
+        ({"cmd": "report", "sid": "1"}, "10.10.10.10"),
+        ({"cmd": "report", "sid": "2"}, "10.10.10.11")
+    ])
@@ -0,0 +1,40 @@
+"""Aqara Receiver Test"""
+import asyncio
+import socket
+
+from unittest.mock import MagicMock
+from aqara.receiver import create_batch_endpoint
+
+def test_batch_receive_and_send():
+    """Test if pending datagrams are handed over in one batch, and sendto works"""
+    loop = asyncio.new_event_loop()
+    protocol = MagicMock()
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(("127.0.0.1", 0))
+    peer.settimeout(1)
+
+    transport, _protocol = loop.run_until_complete(
+        create_batch_endpoint(loop, lambda: protocol, ("127.0.0.1", 0))
+    )
+    protocol.connection_made.assert_called_once_with(transport)
+    assert transport.get_protocol() is protocol
+    local_addr = transport.get_extra_info("sockname")
+
+    for i in range(20):
+        peer.sendto(str(i).encode('utf-8'), local_addr)
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+    batches = [args[0][0] for args in protocol.datagrams_received.call_args_list]
+    assert len(batches) < 20
+    assert [data for batch in batches for data, _addr in batch] == \
+        [str(i).encode('utf-8') for i in range(20)]
+    assert batches[0][0][1] == peer.getsockname()
+
+    transport.sendto(b"pong", peer.getsockname())
+    assert peer.recvfrom(16)[0] == b"pong"
+
+    transport.close()
+    loop.run_until_complete(asyncio.sleep(0))
+    protocol.connection_lost.assert_called_once_with(None)
+    loop.close()
+    peer.close()
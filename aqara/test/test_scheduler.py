@@ -0,0 +1,160 @@
+"""Aqara Scheduler Test"""
+import asyncio
+
+from unittest.mock import MagicMock
+from aqara.scheduler import (RefreshScheduler, WriteQueue, OutboundScheduler,
+                             PRIORITY_CONTROL, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+
+def _sender():
+    """send function of a scheduler, the datagram is on the wire at once"""
+    return MagicMock(side_effect=lambda *args: args[-1]())
+
+def test_window():
+    """Test if no more than 'window' reads are in flight"""
+    loop = asyncio.new_event_loop()
+    send_read = _sender()
+    scheduler = RefreshScheduler(send_read, window=2, rate=1000)
+
+    @asyncio.coroutine
+    def scenario():
+        scheduler.refresh(["1", "2", "3", "4"])
+        yield from asyncio.sleep(0.01)
+        sent_before_ack = send_read.call_count
+        scheduler.ack("1")
+        scheduler.ack("2")
+        yield from asyncio.sleep(0.01)
+        scheduler.ack("3")
+        scheduler.ack("4")
+        return sent_before_ack, (yield from scheduler.wait())
+
+    sent_before_ack, result = loop.run_until_complete(scenario())
+    loop.close()
+
+    assert sent_before_ack == 2
+    assert [args[0][0] for args in send_read.call_args_list] == ["1", "2", "3", "4"]
+    assert result == (4, 0)
+
+def test_retransmit():
+    """Test if unanswered reads are retransmitted, then given up"""
+    loop = asyncio.new_event_loop()
+    send_read = _sender()
+    on_progress = MagicMock()
+    scheduler = RefreshScheduler(send_read, on_progress, rate=1000,
+                                 retry_timeout=0.01, max_retries=2)
+
+    @asyncio.coroutine
+    def scenario():
+        scheduler.refresh(["1", "2"])
+        yield from asyncio.sleep(0.015)
+        scheduler.ack("1")
+        return (yield from scheduler.wait())
+
+    result = loop.run_until_complete(scenario())
+    loop.close()
+
+    assert result == (1, 1)
+    assert [args[0][0] for args in send_read.call_args_list] == ["1", "2", "1", "2", "2"]
+    on_progress.assert_called_with(1, 1, 2, True)
+
+def test_rate():
+    """Test if reads are paced to 'rate' per second"""
+    loop = asyncio.new_event_loop()
+    send_read = _sender()
+    scheduler = RefreshScheduler(send_read, window=10, rate=100)
+
+    @asyncio.coroutine
+    def scenario():
+        scheduler.refresh([str(i) for i in range(5)])
+        sent_now = send_read.call_count
+        yield from asyncio.sleep(0.1)
+        return sent_now
+
+    assert loop.run_until_complete(scenario()) == 1
+    loop.close()
+    assert send_read.call_count == 5
+
+def test_write_queue():
+    """Test if pending writes merge by field and are released by ack or timeout"""
+    loop = asyncio.new_event_loop()
+    send_write = _sender()
+    queue = WriteQueue(send_write, rate=1000, ack_timeout=0.01)
+    device = MagicMock(sid="1")
+
+    @asyncio.coroutine
+    def scenario():
+        first = queue.put(device, {"rgb": 1}, track=True)
+        queue.put(device, {"rgb": 2})
+        queue.put(device, {"mid": 3})
+        second = queue.put(device, {"rgb": 4}, track=True)
+        assert len(queue) == 2
+        queue.ack("1", {"rgb": 1})
+        result = yield from first
+        try:
+            yield from second
+        except asyncio.TimeoutError:
+            return result, "timeout"
+
+    assert loop.run_until_complete(scenario()) == ({"rgb": 1}, "timeout")
+    loop.close()
+
+    assert [args[0][1] for args in send_write.call_args_list] == [
+        {"rgb": 1}, {"rgb": 4, "mid": 3}
+    ]
+    assert not queue
+
+def test_timers_start_on_send():
+    """Test if ack and retry timers only run once the datagram is sent"""
+    loop = asyncio.new_event_loop()
+    send_write = MagicMock()
+    send_read = MagicMock()
+    queue = WriteQueue(send_write, rate=1000, ack_timeout=0.01)
+    refresh = RefreshScheduler(send_read, rate=1000, retry_timeout=0.01, max_retries=0)
+    device = MagicMock(sid="1")
+
+    @asyncio.coroutine
+    def scenario():
+        write = queue.put(device, {"rgb": 1}, track=True)
+        refresh.refresh(["2"])
+        # still paced by the outbound scheduler
+        yield from asyncio.sleep(0.03)
+        assert not write.done() and queue.in_flight == "1"
+        assert refresh.in_flight == 1
+        send_write.call_args[0][3]()
+        send_read.call_args[0][1]()
+        yield from asyncio.sleep(0.03)
+        return write.done(), refresh.failed
+
+    assert loop.run_until_complete(scenario()) == (True, 1)
+    loop.close()
+
+def test_outbound_priorities():
+    """Test if control goes before user reads before background, gateways taking turns"""
+    loop = asyncio.new_event_loop()
+    sent = []
+    on_wait = MagicMock()
+    clock = MagicMock(return_value=0.0)
+    scheduler = OutboundScheduler(lambda addr, msg: sent.append((addr, msg)), rate=1000,
+                                  gateway_rate=100, burst=2, on_wait=on_wait, clock=clock)
+
+    @asyncio.coroutine
+    def scenario():
+        # the first datagram goes out at once, the others queue up
+        scheduler.put("a", "refresh 1", PRIORITY_BACKGROUND)
+        scheduler.put("a", "refresh 2", PRIORITY_BACKGROUND)
+        scheduler.put("a", "refresh 3", PRIORITY_BACKGROUND)
+        scheduler.put("b", "refresh 4", PRIORITY_BACKGROUND)
+        scheduler.put("a", "read", PRIORITY_INTERACTIVE)
+        scheduler.put("a", "set_light", PRIORITY_CONTROL)
+        assert scheduler.queued(PRIORITY_BACKGROUND) == 2
+        # the scheduler clock runs at half the loop pace, timers fire before it
+        while len(scheduler):
+            clock.return_value += 0.001
+            yield from asyncio.sleep(0.002)
+
+    loop.run_until_complete(scenario())
+    loop.close()
+
+    assert sent == [("a", "refresh 1"), ("a", "refresh 2"), ("b", "refresh 4"),
+                    ("a", "set_light"), ("a", "read"), ("a", "refresh 3")]
+    assert [args[0][1] for args in on_wait.call_args_list] == [
+        "background", "background", "background", "control", "interactive", "background"]
@@ -0,0 +1,103 @@
+"""Aqara Sharding Test"""
+# pylint: disable=protected-access
+import asyncio
+import json
+import socket
+import sys
+
+import pytest
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.decoder import AqaraDecoder
+from aqara.sharding import (ShardPool, make_record, shard_of,
+                            RECORD_MESSAGE, RECORD_DROPPED, RECORD_ERROR)
+
+def test_shard_of():
+    """Test if gateways are spread over all workers, always to the same one"""
+    addrs = ["192.168.1.{}".format(i) for i in range(64)]
+    shards = [shard_of(addr, 4) for addr in addrs]
+    assert set(shards) == set(range(4))
+    assert shards == [shard_of(addr, 4) for addr in addrs]
+
+def test_record_applied_by_client():
+    """Test if a message decoded by a worker is handled like a datagram"""
+    datagram = json.dumps({
+        "cmd": "heartbeat",
+        "model": "gateway",
+        "sid": "123456",
+        "token": "ffffff",
+        "data": json.dumps({"ip": "10.10.10.10"})
+    }).encode('utf-8')
+    record = make_record(AqaraDecoder(), datagram, ("10.10.10.10", 4321), {"123456"})
+    assert record == (
+        RECORD_MESSAGE,
+        ("10.10.10.10", 4321),
+        {"cmd": "heartbeat", "model": "gateway", "sid": "123456", "token": "ffffff"},
+        {"ip": "10.10.10.10"}
+    )
+
+    client = AqaraClient()
+    client.on_heartbeat = MagicMock()
+    client._device_to_gw["123456"] = MagicMock()
+    client.handle_decoded([record])
+
+    client.on_heartbeat.assert_called_once_with(
+        "gateway", "123456", {"ip": "10.10.10.10"}, "ffffff"
+    )
+
+def test_records_filtered_by_worker():
+    """Test if workers drop unknown sids and forward decode errors to the client"""
+    decoder = AqaraDecoder()
+    addr = ("10.10.10.10", 4321)
+    report = json.dumps({
+        "cmd": "report", "model": "magnet", "sid": "0a0b0c", "data": json.dumps({"status": "open"})
+    }).encode('utf-8')
+    broken = b'{"cmd":"report","sid":"123456","data":'
+
+    dropped = make_record(decoder, report, addr, {"123456"})
+    assert dropped == (RECORD_DROPPED, "report", "0a0b0c")
+    assert make_record(decoder, report, addr, {"0a0b0c"})[0] == RECORD_MESSAGE
+    error = make_record(decoder, broken, addr, {"123456"})
+    assert error[:4] == (RECORD_ERROR, addr, broken, "report")
+
+    client = AqaraClient()
+    client._device_to_gw["123456"] = MagicMock()
+    client.handle_decoded([dropped, error])
+    assert client.metrics.datagrams.value("report") == 2
+    assert client.metrics.unknown_sids.value("report") == 1
+    assert client.metrics.decode_errors.value() == 1
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="SO_REUSEPORT balancing")
+def test_workers_forward_all_datagrams():
+    """Test if datagrams received by any worker reach the coordinator once"""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(("127.0.0.1", 0))
+    listen_addr = probe.getsockname()
+    probe.close()
+
+    loop = asyncio.new_event_loop()
+    received = []
+    pool = ShardPool(2, received.extend, "json", listen_addr=listen_addr)
+    pool.start(loop)
+    pool.set_known_sids(str(i) for i in range(40))
+
+    senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(8)]
+    for i in range(40):
+        msg = {"cmd": "report", "sid": str(i), "data": json.dumps({"status": "open"})}
+        senders[i % len(senders)].sendto(json.dumps(msg).encode('utf-8'), listen_addr)
+
+    @asyncio.coroutine
+    def wait_all():
+        for _ in range(200):
+            if len(received) >= 40:
+                return
+            yield from asyncio.sleep(0.01)
+
+    loop.run_until_complete(wait_all())
+    pool.stop()
+    loop.close()
+    for sender in senders:
+        sender.close()
+
+    assert sorted(int(fields["sid"]) for _kind, _addr, fields, _payload in received) \
+        == list(range(40))
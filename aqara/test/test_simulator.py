@@ -0,0 +1,79 @@
+"""Aqara Simulator Test"""
+import asyncio
+
+import pytest
+from aqara.client import AqaraClient
+from aqara.crypto import available_crypto_backends
+from aqara.simulator import GatewaySimulator
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro(loop))
+    finally:
+        loop.close()
+
+@asyncio.coroutine
+def _start(loop, simulator):
+    yield from simulator.start(loop)
+    client = AqaraClient(simulator.secrets)
+    client.listen_addr = ("127.0.0.1", 0)
+    client.discovery_addr = simulator.discovery_addr
+    gateways = []
+    def handle_new_gateway(gateway):
+        gateways.append(gateway)
+        gateway.connect()
+    client.subscribe(handle_new_gateway)
+    yield from client.start(loop)
+    while len(gateways) < len(simulator.gateways):
+        yield from asyncio.sleep(0.01)
+    for gateway in gateways:
+        yield from gateway.wait_refreshed()
+    return client, handle_new_gateway
+
+def test_discovery_and_reports():
+    """Test if a client discovers the simulated site and receives its reports"""
+    @asyncio.coroutine
+    def scenario(loop):
+        simulator = GatewaySimulator(gateways=3, devices=5)
+        client, _handler = yield from _start(loop, simulator)
+        last_seen = client.store.last_seen
+        sids = [sid for gateway in client.gateways.values() for sid in gateway.devices]
+        assert len(sids) == 3 * 6
+
+        simulator.report_rate = 2000
+        yield from asyncio.sleep(0.2)
+        client.stop()
+        simulator.stop()
+        assert simulator.sent > 100
+        return sum(1 for sid in sids if last_seen[client.store.index(sid)] > 0)
+
+    # every device was read, then some of them reported
+    assert _run(scenario) == 3 * 6
+
+def test_write_key_checked():
+    """Test if writes are accepted with the key of the current token only"""
+    if not available_crypto_backends():
+        pytest.skip("no crypto backend")
+
+    @asyncio.coroutine
+    def scenario(loop):
+        simulator = GatewaySimulator(gateways=1, devices=1, gateway_heartbeat_interval=3600)
+        client, _handler = yield from _start(loop, simulator)
+        gateway = list(client.gateways.values())[0]
+        simulator.gateways[0].heartbeat(simulator.target)
+        yield from asyncio.sleep(0.05)
+        data = yield from gateway.write(gateway, {"rgb": 42}, {"short_id": 0, "key": 8})
+        simulator.gateways[0].token = "0" * 16
+        error = None
+        try:
+            yield from gateway.write(gateway, {"rgb": 7}, {"short_id": 0, "key": 8})
+        except RuntimeError as exc:
+            error = str(exc)
+        client.stop()
+        simulator.stop()
+        return data, error
+
+    data, error = _run(scenario)
+    assert data["rgb"] == 42
+    assert error == "write error: Invalid key"
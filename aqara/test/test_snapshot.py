@@ -0,0 +1,69 @@
+"""Aqara Snapshot Test"""
+# pylint: disable=protected-access
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.snapshot import (take_snapshot, save_snapshot, load_snapshot)
+
+def _make_client():
+    client = AqaraClient()
+    client.unicast = MagicMock()
+    client.on_gateway_discovered("123456", "10.10.10.10")
+    gateway = client.gateways["123456"]
+    gateway.on_read_ack("sensor_ht", "abcdef", {"voltage": 3005, "temperature": "2351"})
+    gateway.on_read_ack("magnet", "fedcba", {"status": "open"})
+    gateway.on_read_ack("plug", "0a0b0c", {"status": "on", "load_power": "12.5"})
+    return client
+
+def test_save_and_load(tmpdir):
+    """Test if a snapshot round-trips through a file, missing files give None"""
+    path = str(tmpdir.join("aqara.json"))
+    assert load_snapshot(path) is None
+
+    snapshot = take_snapshot(_make_client())
+    save_snapshot(snapshot, path)
+
+    assert load_snapshot(path) == snapshot
+    assert tmpdir.listdir() == [tmpdir.join("aqara.json")]
+
+def test_restore_snapshot():
+    """Test if gateways, devices and state are restored with their events"""
+    snapshot = take_snapshot(_make_client())
+    handle_new_device = MagicMock()
+    def handle_new_gateway(gateway):
+        gateway.subscribe(handle_new_device)
+    client = AqaraClient()
+    client.subscribe(handle_new_gateway)
+
+    client.restore_snapshot(snapshot)
+
+    gateway = client.gateways["123456"]
+    assert gateway.addr == "10.10.10.10"
+    assert sorted(gateway.devices) == ["0a0b0c", "123456", "abcdef", "fedcba"]
+    assert gateway.devices["abcdef"].temperature == 23.5
+    assert gateway.devices["abcdef"].voltage == 3005
+    assert gateway.devices["fedcba"].triggered
+    # columns of the model, added when the first plug is created
+    assert gateway.devices["0a0b0c"].is_on
+    assert gateway.devices["0a0b0c"].load_power == 12.5
+    assert handle_new_device.call_count == 3
+    # reports of restored devices are accepted before the gateway answers
+    assert client.accept_message("report", "fedcba")
+
+def test_reconcile_restored_gateway():
+    """Test if live traffic updates a restored gateway instead of replacing it"""
+    client = AqaraClient()
+    client.unicast = MagicMock()
+    client.restore_snapshot(take_snapshot(_make_client()))
+    gateway = client.gateways["123456"]
+    handle_new_gateway = MagicMock()
+    client.subscribe(handle_new_gateway)
+
+    client.on_gateway_discovered("123456", "10.10.10.11")
+    client.on_devices_discovered("123456", ["abcdef"])
+
+    assert client.gateways["123456"] is gateway
+    handle_new_gateway.assert_not_called()
+    assert gateway.addr == "10.10.10.11"
+    client.unicast.assert_any_call("10.10.10.11", {"cmd": "get_id_list"})
+    assert sorted(gateway.devices) == ["123456", "abcdef"]
+    assert not client.accept_message("report", "fedcba")
@@ -0,0 +1,80 @@
+"""Aqara Event Stream Test"""
+# pylint: disable=protected-access
+import asyncio
+
+from unittest.mock import MagicMock
+from aqara.client import AqaraClient
+from aqara.stream import (EventHub, StreamClosed, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST,
+                          OVERFLOW_COALESCE, OVERFLOW_BLOCK, EVENT_UPDATE)
+
+def _publish(hub, *temperatures):
+    for sid, old, new in temperatures:
+        hub.publish(EVENT_UPDATE, sid, "sensor_ht", {"temperature": (old, new)})
+
+def _drain(stream):
+    loop = asyncio.new_event_loop()
+    try:
+        return [loop.run_until_complete(stream.get()) for _ in range(stream.depth)]
+    finally:
+        loop.close()
+
+def test_overflow_policies():
+    """Test if full streams drop the oldest, the newest or coalesce per sid"""
+    hub = EventHub()
+    oldest = hub.open(maxsize=2, policy=OVERFLOW_DROP_OLDEST)
+    newest = hub.open(maxsize=2, policy=OVERFLOW_DROP_NEWEST)
+    coalesce = hub.open(maxsize=2, policy=OVERFLOW_COALESCE)
+
+    _publish(hub, ("1", 20, 21), ("2", 20, 22), ("1", 21, 23))
+
+    assert [event.sid for event in _drain(oldest)] == ["2", "1"]
+    assert [event.sid for event in _drain(newest)] == ["1", "2"]
+    assert oldest.dropped == newest.dropped == 1
+    events = _drain(coalesce)
+    assert [event.sid for event in events] == ["2", "1"]
+    assert events[1].data == {"temperature": (20, 23)}
+    assert coalesce.coalesced == 1 and coalesce.dropped == 0
+
+def test_block_pauses_reading():
+    """Test if a full blocking stream pauses the transport until it drains"""
+    hub = EventHub()
+    hub.transport = MagicMock()
+    stream = hub.open(maxsize=2, policy=OVERFLOW_BLOCK)
+
+    _publish(hub, ("1", 20, 21), ("2", 20, 22))
+    hub.transport.pause_reading.assert_called_once_with()
+    _publish(hub, ("3", 20, 23))
+    assert stream.depth == 3 and stream.dropped == 0
+
+    _drain(stream)
+    hub.transport.resume_reading.assert_called_once_with()
+
+def test_client_events():
+    """Test if device updates matching the filter are streamed until the stream is closed"""
+    client = AqaraClient()
+    gateway = client._add_gateway("123456", "10.10.10.10")
+    stream = client.events(filter=lambda event: event.model == "magnet")
+    received = []
+
+    @asyncio.coroutine
+    def consume():
+        while True:
+            try:
+                event = yield from stream.get()
+            except StreamClosed:
+                return
+            received.append((event.kind, event.sid, event.data))
+
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(consume())
+        loop.call_soon(gateway.on_read_ack, "magnet", "abcdef", {"status": "open"})
+        loop.call_soon(gateway.on_read_ack, "sensor_ht", "ghijkl", {"temperature": "2351"})
+        loop.call_later(0.01, stream.close)
+        loop.run_until_complete(asyncio.wait_for(task, 1))
+    finally:
+        loop.close()
+
+    assert received == [("new_device", "abcdef", None),
+                        ("update", "abcdef", {"triggered": (0, 1)})]
+    assert not client._events.streams
@@ -0,0 +1 @@
+"""Benchmarks for pyaqara, run each module with 'python -m bench.<name>'"""
@@ -0,0 +1,46 @@
+"""
+Write burst benchmark, with encryption enabled
+
+Writes per second through AqaraGateway when the write key is derived on
+every write (previous behaviour) and when it is cached per token, for each
+installed crypto backend.
+
+    python -m bench.crypto [writes]
+"""
+# pylint: disable=protected-access
+import sys
+import time
+
+from aqara.client import AqaraClient
+from aqara.crypto import (available_crypto_backends, make_key)
+from aqara.gateway import AqaraGateway
+
+SECRET = "0123456789abcdef"
+TOKEN = "1nw9IXlw6WY2QhTD"
+
+class NullClient(AqaraClient):
+    """client which drops outgoing writes"""
+    def write_device(self, gw_addr, model, sid, data, meta=None):
+        pass
+
+def _burst(gateway, n_writes, derive_each_write):
+    start = time.perf_counter()
+    for i in range(n_writes):
+        if derive_each_write:
+            gateway._key = None
+        gateway._send_write(gateway, {"rgb": i}, {"short_id": 0, "key": 8})
+    return n_writes / (time.perf_counter() - start)
+
+def main(n_writes=20000):
+    """run the benchmark and print writes per second per backend"""
+    print("{:<14} {:>14} {:>14}".format("writes/s", "per write key", "cached key"))
+    for backend in available_crypto_backends():
+        make_key(SECRET, TOKEN, backend)
+        gateway = AqaraGateway(NullClient(), "7811dcb25c1f", "127.0.0.1", SECRET, backend)
+        gateway.on_device_heartbeat("gateway", "7811dcb25c1f", {}, TOKEN)
+        uncached = _burst(gateway, n_writes, True)
+        cached = _burst(gateway, n_writes, False)
+        print("{:<14} {:>14.0f} {:>14.0f}".format(backend, uncached, cached))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,52 @@
+"""
+Decoder micro-benchmark
+
+Compare the decode cost per datagram of every installed JSON backend with
+the original str-decode + double json.loads path, on recorded payloads.
+
+    python -m bench.decoder [iterations]
+"""
+import json
+import sys
+import timeit
+
+from aqara.decoder import (AqaraDecoder, available_json_backends)
+from bench.payloads import (REPORTS, HEARTBEATS, MIXED)
+
+def legacy_decode(data):
+    """decode path before aqara.decoder"""
+    msg = json.loads(data.decode('utf-8'))
+    msg["data"] = json.loads(msg["data"])
+    return msg
+
+def _per_msg_us(func, payloads, iterations):
+    def run():
+        for data in payloads:
+            func(data)
+    total = min(timeit.repeat(run, number=iterations, repeat=3))
+    return total / (iterations * len(payloads)) * 1e6
+
+def main(iterations=20000):
+    """run the benchmark and print one line per backend and payload set"""
+    sets = (("report", REPORTS), ("heartbeat", HEARTBEATS), ("mixed", MIXED))
+    print("{:<24} {:>10} {:>10} {:>10}".format("decoder (us/msg)", *[n for n, _ in sets]))
+
+    row = [_per_msg_us(legacy_decode, p, iterations) for _, p in sets]
+    print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format("legacy", *row))
+
+    for backend in available_json_backends():
+        decoder = AqaraDecoder(backend)
+
+        def full(data, decoder=decoder):
+            return decoder.decode(data).payload
+
+        row = [_per_msg_us(decoder.decode, p, iterations) for _, p in sets]
+        print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format(backend + " (lazy)", *row))
+        row = [_per_msg_us(full, p, iterations) for _, p in sets]
+        print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format(backend + " (payload)", *row))
+
+    row = [_per_msg_us(AqaraDecoder.peek, p, iterations) for _, p in sets]
+    print("{:<24} {:>10.2f} {:>10.2f} {:>10.2f}".format("peek (unknown sid)", *row))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,71 @@
+"""
+Dispatch benchmark
+
+Cost of one device update fan-out with 10k devices x N subscribers, on the
+aqara event bus and on pydispatch (when installed).
+
+    python -m bench.dispatch [devices] [updates]
+"""
+import sys
+import time
+
+from aqara.dispatch import EventBus
+from aqara.device import HASS_UPDATE_SIGNAL
+
+SUBSCRIBERS = (1, 4, 16)
+
+class Device(object):
+    """stand-in sender"""
+    pass
+
+class Subscriber(object):
+    """HomeAssistant style subscriber, a bound method without arguments"""
+    def __init__(self):
+        self.count = 0
+
+    def on_update(self):
+        """handle update"""
+        self.count += 1
+
+def _run(connect, send, n_devices, n_subscribers, n_updates):
+    devices = [Device() for _ in range(n_devices)]
+    subscribers = []
+    for device in devices:
+        for _ in range(n_subscribers):
+            subscriber = Subscriber()
+            subscribers.append(subscriber)
+            connect(subscriber.on_update, HASS_UPDATE_SIGNAL, device)
+
+    start = time.perf_counter()
+    for i in range(n_updates):
+        send(HASS_UPDATE_SIGNAL, devices[i % n_devices])
+    elapsed = time.perf_counter() - start
+    assert sum(s.count for s in subscribers) == n_updates * n_subscribers
+    return elapsed / n_updates * 1e6
+
+def main(n_devices=10000, n_updates=100000):
+    """run the benchmark and print the cost of one update per bus"""
+    buses = []
+
+    bus = EventBus()
+    buses.append(("aqara", bus.connect, bus.send))
+    try:
+        from pydispatch import dispatcher
+        buses.append(("pydispatch", dispatcher.connect, dispatcher.send))
+    except ImportError:
+        pass
+
+    print("{} devices, {} updates".format(n_devices, n_updates))
+    print("{:<12} {}".format("us/update", " ".join("{:>8}".format(n) for n in SUBSCRIBERS)))
+    for name, connect, send in buses:
+        def connect_kw(receiver, signal, sender, connect=connect):
+            connect(receiver, signal=signal, sender=sender)
+
+        def send_kw(signal, sender, send=send):
+            send(signal=signal, sender=sender)
+
+        row = [_run(connect_kw, send_kw, n_devices, n, n_updates) for n in SUBSCRIBERS]
+        print("{:<12} {}".format(name, " ".join("{:>8.2f}".format(us) for us in row)))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
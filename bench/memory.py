@@ -0,0 +1,72 @@
+"""
+Device memory benchmark
+
+Bytes per device for a fleet of simulated sensors registered on a gateway,
+each updated by a heartbeat, with the store-backed __slots__ devices and
+with dict based objects shaped like the previous device classes.
+
+    python -m bench.memory [devices]
+"""
+# pylint: disable=protected-access
+import sys
+import time
+import tracemalloc
+
+from aqara.client import AqaraClient
+from aqara.device import create_device
+from aqara.gateway import AqaraGateway
+
+MODELS = ("sensor_ht", "magnet", "motion", "switch")
+HEARTBEAT = {"voltage": 3005, "temperature": "2351", "humidity": "6015", "status": "open"}
+
+class LegacyDevice(object):
+    """device with an instance __dict__, as before the device store"""
+    def __init__(self, model, gateway, sid):
+        self._gateway = gateway
+        self._model = model
+        self._sid = sid
+        self._voltage = None
+        self._temperature = 0
+        self._humidity = 0
+        self._triggered = False
+        self._last_seen = None
+
+    def on_heartbeat(self, data):
+        """apply a heartbeat like the previous do_heartbeat implementations"""
+        self._last_seen = time.time()
+        self._voltage = int(data["voltage"])
+        if self._model == "sensor_ht":
+            self._temperature = round(int(data["temperature"]) / 100, 1)
+            self._humidity = round(int(data["humidity"]) / 100, 1)
+        else:
+            self._triggered = data["status"] == "open"
+
+def _sid(i):
+    return "158d{:010x}".format(i)
+
+def _measure(make_device, n_devices):
+    client = AqaraClient()
+    gateway = AqaraGateway(client, "7811dcb25c1f", "127.0.0.1", None)
+    sids = [_sid(i) for i in range(n_devices)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i, sid in enumerate(sids):
+        device = make_device(gateway, MODELS[i % len(MODELS)], sid)
+        gateway._devices[sid] = device
+        client._device_to_gw[sid] = gateway
+        device.on_heartbeat(HEARTBEAT)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+def main(n_devices=10000):
+    """run the benchmark and print the memory used per device"""
+    legacy = _measure(lambda gw, model, sid: LegacyDevice(model, gw, sid), n_devices)
+    store = _measure(create_device, n_devices)
+    print("{} devices".format(n_devices))
+    print("{:<10} {:>12} {:>12}".format("devices", "total (KiB)", "bytes/device"))
+    print("{:<10} {:>12.0f} {:>12.0f}".format("legacy", legacy / 1024, legacy / n_devices))
+    print("{:<10} {:>12.0f} {:>12.0f}".format("store", store / 1024, store / n_devices))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
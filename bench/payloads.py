@@ -0,0 +1,89 @@
+"""Recorded gateway traffic used by the benchmarks"""
+import json
+
+GATEWAY_SID = "7811dcb25c1f"
+GATEWAY_ADDR = ("192.168.1.20", 4321)
+
+def _datagram(msg):
+    return json.dumps(msg, separators=(',', ':')).encode('utf-8')
+
+REPORT_HT = _datagram({
+    "cmd": "report", "model": "sensor_ht", "sid": "158d0001148a4c", "short_id": 44103,
+    "data": "{\"temperature\":\"2351\",\"humidity\":\"6015\"}"
+})
+
+REPORT_MAGNET = _datagram({
+    "cmd": "report", "model": "magnet", "sid": "158d00011a1b2c", "short_id": 21234,
+    "data": "{\"status\":\"open\"}"
+})
+
+REPORT_MOTION = _datagram({
+    "cmd": "report", "model": "motion", "sid": "158d00012c3d4e", "short_id": 12785,
+    "data": "{\"status\":\"motion\"}"
+})
+
+REPORT_SWITCH = _datagram({
+    "cmd": "report", "model": "switch", "sid": "158d00013e4f5a", "short_id": 36622,
+    "data": "{\"status\":\"click\"}"
+})
+
+HEARTBEAT_GATEWAY = _datagram({
+    "cmd": "heartbeat", "model": "gateway", "sid": GATEWAY_SID, "short_id": "0",
+    "token": "1nw9IXlw6WY2QhTD",
+    "data": "{\"ip\":\"192.168.1.20\"}"
+})
+
+HEARTBEAT_HT = _datagram({
+    "cmd": "heartbeat", "model": "sensor_ht", "sid": "158d0001148a4c", "short_id": 44103,
+    "data": "{\"voltage\":3005,\"temperature\":\"2351\",\"humidity\":\"6015\"}"
+})
+
+HEARTBEAT_MAGNET = _datagram({
+    "cmd": "heartbeat", "model": "magnet", "sid": "158d00011a1b2c", "short_id": 21234,
+    "data": "{\"voltage\":3015,\"status\":\"close\"}"
+})
+
+REPORTS = [REPORT_HT, REPORT_MAGNET, REPORT_MOTION, REPORT_SWITCH]
+HEARTBEATS = [HEARTBEAT_GATEWAY, HEARTBEAT_HT, HEARTBEAT_MAGNET]
+
+# a site mix: mostly reports, one gateway heartbeat every ~10 datagrams
+MIXED = REPORTS * 2 + HEARTBEATS
+
+# the same devices with other values, alternated with REPORTS / HEARTBEATS so
+# that every message changes the state of its device
+REPORTS_ALT = [
+    _datagram({
+        "cmd": "report", "model": "sensor_ht", "sid": "158d0001148a4c", "short_id": 44103,
+        "data": "{\"temperature\":\"2352\",\"humidity\":\"6016\"}"
+    }),
+    _datagram({
+        "cmd": "report", "model": "magnet", "sid": "158d00011a1b2c", "short_id": 21234,
+        "data": "{\"status\":\"close\"}"
+    }),
+    _datagram({
+        "cmd": "report", "model": "motion", "sid": "158d00012c3d4e", "short_id": 12785,
+        "data": "{\"no_motion\":\"120\"}"
+    }),
+    _datagram({
+        "cmd": "report", "model": "switch", "sid": "158d00013e4f5a", "short_id": 36622,
+        "data": "{\"status\":\"double_click\"}"
+    }),
+]
+HEARTBEATS_ALT = [
+    HEARTBEAT_GATEWAY,
+    _datagram({
+        "cmd": "heartbeat", "model": "sensor_ht", "sid": "158d0001148a4c", "short_id": 44103,
+        "data": "{\"voltage\":3005,\"temperature\":\"2352\",\"humidity\":\"6016\"}"
+    }),
+    _datagram({
+        "cmd": "heartbeat", "model": "magnet", "sid": "158d00011a1b2c", "short_id": 21234,
+        "data": "{\"voltage\":3015,\"status\":\"open\"}"
+    }),
+]
+
+DEVICE_MODELS = {
+    "158d0001148a4c": "sensor_ht",
+    "158d00011a1b2c": "magnet",
+    "158d00012c3d4e": "motion",
+    "158d00013e4f5a": "switch",
+}
@@ -0,0 +1,87 @@
+"""
+Receive path benchmark
+
+Datagrams per second through the asyncio datagram transport and through the
+batched receive engine (aqara.receiver), decode included. Each round queues
+a burst of recorded datagrams in the socket buffer, then times how long the
+event loop takes to drain and handle them.
+
+    python -m bench.receive [burst] [rounds]
+"""
+import asyncio
+import socket
+import sys
+import time
+
+from aqara.protocol import AqaraProtocol
+from aqara.receiver import create_batch_endpoint
+from bench.payloads import MIXED
+
+RECV_BUFFER = 4 * 1024 * 1024
+
+class CountingProtocol(AqaraProtocol):
+    """protocol counting the messages handled"""
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.wakeups = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        pass
+
+    def datagram_received(self, data, addr):
+        self.wakeups += 1
+        super().datagram_received(data, addr)
+
+    def datagrams_received(self, batch):
+        self.wakeups += 1
+        super().datagrams_received(batch)
+
+    def handle_message(self, msg, src_addr):
+        self.count += 1
+
+def _run(loop, batch, burst, rounds):
+    if batch:
+        endpoint = create_batch_endpoint(loop, CountingProtocol, ("127.0.0.1", 0))
+    else:
+        endpoint = loop.create_datagram_endpoint(CountingProtocol, local_addr=("127.0.0.1", 0))
+    transport, protocol = loop.run_until_complete(endpoint)
+    sock = transport.get_extra_info("socket")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+    addr = sock.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    @asyncio.coroutine
+    def drain(expected):
+        while protocol.count < expected:
+            yield from asyncio.sleep(0)
+
+    elapsed = 0
+    for _ in range(rounds):
+        expected = protocol.count + burst
+        for i in range(burst):
+            sender.sendto(MIXED[i % len(MIXED)], addr)
+        start = time.perf_counter()
+        loop.run_until_complete(drain(expected))
+        elapsed += time.perf_counter() - start
+
+    transport.close()
+    sender.close()
+    loop.run_until_complete(asyncio.sleep(0))
+    return burst * rounds / elapsed, protocol.wakeups
+
+def main(burst=2000, rounds=20):
+    """run the benchmark and print datagrams per second per engine"""
+    loop = asyncio.new_event_loop()
+    print("{} datagrams x {} rounds".format(burst, rounds))
+    print("{:<10} {:>12} {:>10}".format("engine", "datagrams/s", "wakeups"))
+    for name, batch in (("asyncio", False), ("batch", True)):
+        rate, wakeups = _run(loop, batch, burst, rounds)
+        print("{:<10} {:>12.0f} {:>10}".format(name, rate, wakeups))
+    loop.close()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
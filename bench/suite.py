@@ -0,0 +1,273 @@
+"""
+Message path benchmark suite
+
+Measure each stage of a received message separately and end to end, on
+recorded payloads (bench.payloads):
+
+- decode: peek + decode of the datagram and its payload
+- route: AqaraClient.handle_message, gateway callbacks excluded
+- update: AqaraGateway._try_update_device, one subscriber per device
+- parse: do_update of the device (e.g. AqaraHTSensor.parse_value)
+- dispatch: update signal sent to one subscriber
+- end_to_end: AqaraClient.datagram_received to the subscriber
+
+Each pass alternates the recorded payloads with the same devices at other
+values (REPORTS_ALT / HEARTBEATS_ALT), so that every update changes the
+state and reaches the subscribers, as checked after each stage.
+
+For each stage: messages/s, p50 / p99 latency, and per message the peak of
+traced memory and the blocks still allocated after it (tracemalloc).
+Results are printed as a table, and written as JSON with --json. With
+--baseline, the run fails when a stage is slower than the baseline by more
+than --tolerance.
+
+    python -m bench.suite [--iterations N] [--json FILE] [--baseline FILE]
+"""
+# pylint: disable=protected-access
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from aqara.client import AqaraClient
+from aqara.dispatch import dispatcher
+from aqara.device import HASS_UPDATE_SIGNAL
+from aqara.decoder import available_json_backends
+from aqara.const import AQARA_EVENT_NEW_DEVICE
+from bench.payloads import (REPORTS, HEARTBEATS, REPORTS_ALT, HEARTBEATS_ALT, GATEWAY_SID,
+                            GATEWAY_ADDR, DEVICE_MODELS)
+
+# 2: payloads alternated, the update stages measure notified changes
+SUITE_VERSION = 2
+
+class Subscriber(object):
+    """HomeAssistant style subscriber, a bound method without arguments"""
+    def __init__(self):
+        self.count = 0
+
+    def on_update(self):
+        """handle update"""
+        self.count += 1
+
+def _make_client():
+    """client with the recorded gateway and devices, one subscriber per device"""
+    client = AqaraClient()
+    client.unicast = lambda addr, msg: None
+    client.on_gateway_discovered(GATEWAY_SID, GATEWAY_ADDR[0])
+    gateway = client.gateways[GATEWAY_SID]
+    subscribers = []
+    def on_new_device(device):
+        subscriber = Subscriber()
+        subscribers.append(subscriber)
+        device.subscribe_update(subscriber.on_update)
+        device.subscribe_heartbeat(subscriber.on_update)
+    dispatcher.connect(on_new_device, signal=AQARA_EVENT_NEW_DEVICE, sender=gateway)
+    client.on_devices_discovered(GATEWAY_SID, list(DEVICE_MODELS))
+    for sid, model in DEVICE_MODELS.items():
+        gateway.on_read_ack(model, sid, {"voltage": 3005})
+    gateway.refresh_scheduler.cancel()
+    dispatcher.disconnect(on_new_device, signal=AQARA_EVENT_NEW_DEVICE, sender=gateway)
+    return client, gateway, subscribers
+
+def _stages(payloads):
+    """Return [(name, func, args, notified)], args being the per-message arguments of func
+
+    'notified' is the number of subscriber calls per pass over args, None for
+    stages which stop before the subscribers.
+    """
+    client, gateway, subscribers = _make_client()
+    decoder = client._decoder
+    addr = GATEWAY_ADDR
+    messages = [decoder.decode(data) for data in payloads]
+    for msg in messages:
+        msg.payload # pylint: disable=pointless-statement
+    updates = [(msg["model"], msg["sid"], msg.payload) for msg in messages]
+    devices = [(gateway.devices[msg["sid"]], msg.payload) for msg in messages
+               if msg["sid"] in gateway.devices and msg["sid"] != GATEWAY_SID]
+
+    def decode(data):
+        decoder.peek(data)
+        return decoder.decode(data).payload
+
+    # route only, stop at the gateway
+    router, _gateway, _subscribers = _make_client()
+    router_gateway = router.gateways[GATEWAY_SID]
+    router_gateway.on_device_report = lambda model, sid, data: None
+    router_gateway.on_device_heartbeat = lambda model, sid, data, token: None
+
+    def route(msg):
+        router.handle_message(msg, addr)
+
+    def update(model, sid, data):
+        gateway._try_update_device(model, sid, data)
+
+    def parse(device, data):
+        device.do_update(data)
+
+    def dispatch(device, _data):
+        dispatcher.send(signal=HASS_UPDATE_SIGNAL, sender=device)
+
+    def end_to_end(data):
+        client.datagram_received(data, addr)
+
+    stages = [
+        ("decode", decode, [(data,) for data in payloads], None),
+        ("route", route, [(msg,) for msg in messages], None),
+        ("update", update, updates, len(devices)),
+        ("parse", parse, devices, None),
+        ("dispatch", dispatch, devices, len(devices)),
+        ("end_to_end", end_to_end, [(data,) for data in payloads], len(devices)),
+    ]
+    # keep the subscribers alive, the bus only holds weak references
+    return stages, subscribers
+
+def _percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+def _throughput(func, args, iterations):
+    """messages/s, best of 3 runs without per message timers"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for arg in args:
+                func(*arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return iterations * len(args) / best
+
+def _latencies(func, args, iterations):
+    """per message latency samples (unit: us)"""
+    clock = time.perf_counter
+    samples = []
+    for _ in range(iterations):
+        for arg in args:
+            start = clock()
+            func(*arg)
+            samples.append(clock() - start)
+    samples.sort()
+    return [sample * 1e6 for sample in samples]
+
+def _allocations(func, args, iterations):
+    """(peak bytes, retained blocks) per message
+
+    tracemalloc only traces live blocks: the peak is the memory a message
+    needs while it is handled, the retained blocks are still alive after it.
+    """
+    for arg in args:
+        func(*arg)
+    peak = 0
+    blocks = 0
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            for arg in args:
+                # also resets the peak
+                tracemalloc.clear_traces()
+                func(*arg)
+                peak += tracemalloc.get_traced_memory()[1]
+                stats = tracemalloc.take_snapshot().statistics("filename")
+                blocks += sum(stat.count for stat in stats)
+    finally:
+        tracemalloc.stop()
+    count = iterations * len(args)
+    return peak / count, blocks / count
+
+def _check_notified(name, subscribers, expected):
+    """raise if the subscribers were not called 'expected' times, e.g. updates without changes"""
+    count = sum(subscriber.count for subscriber in subscribers)
+    if count != expected:
+        raise RuntimeError('{}: {} subscriber calls, expected {}'.format(name, count, expected))
+
+def run(iterations=2000, alloc_iterations=20):
+    """Run every stage on every payload set, return the results as a dict"""
+    sets = (("report", REPORTS + REPORTS_ALT), ("heartbeat", HEARTBEATS + HEARTBEATS_ALT))
+    results = {}
+    for set_name, payloads in sets:
+        stages, subscribers = _stages(payloads)
+        for stage_name, func, args, notified in stages:
+            if not args:
+                continue
+            for subscriber in subscribers:
+                subscriber.count = 0
+            latencies = _latencies(func, args, iterations)
+            if notified is not None:
+                _check_notified("{}.{}".format(stage_name, set_name), subscribers,
+                                notified * iterations)
+            peak, blocks = _allocations(func, args, alloc_iterations)
+            results["{}.{}".format(stage_name, set_name)] = {
+                "msgs_per_sec": round(_throughput(func, args, iterations)),
+                "p50_us": round(_percentile(latencies, 0.5), 3),
+                "p99_us": round(_percentile(latencies, 0.99), 3),
+                "peak_bytes_per_msg": round(peak),
+                "retained_blocks_per_msg": round(blocks, 2),
+            }
+    return {
+        "version": SUITE_VERSION,
+        "time": time.time(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        # the backend picked by JSON_BACKEND_AUTO
+        "json_backend": available_json_backends()[0],
+        "iterations": iterations,
+        "results": results,
+    }
+
+def compare(report, baseline, tolerance):
+    """Return the stages slower than 'baseline' by more than 'tolerance'"""
+    regressions = []
+    for name, result in sorted(report["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["msgs_per_sec"] < base["msgs_per_sec"] * (1 - tolerance):
+            regressions.append((name, base["msgs_per_sec"], result["msgs_per_sec"]))
+    return regressions
+
+def _print_table(report):
+    print("python {} ({}), json backend: {}".format(
+        report["python"], report["implementation"], report["json_backend"]))
+    print("{:<22} {:>12} {:>10} {:>10} {:>12} {:>10}".format(
+        "stage", "msgs/s", "p50 us", "p99 us", "peak bytes", "retained"))
+    for name, result in sorted(report["results"].items()):
+        print("{:<22} {:>12} {:>10.2f} {:>10.2f} {:>12} {:>10.2f}".format(
+            name, result["msgs_per_sec"], result["p50_us"], result["p99_us"],
+            result["peak_bytes_per_msg"], result["retained_blocks_per_msg"]))
+
+def main():
+    """run the suite, print the results, exit 1 on a regression"""
+    parser = argparse.ArgumentParser(description="pyaqara message path benchmarks")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", help="write the results to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed throughput drop versus the baseline (fraction)")
+    args = parser.parse_args()
+
+    report = run(args.iterations)
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        _print_table(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as json_file:
+                json.dump(report, json_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("version") != SUITE_VERSION:
+            print("baseline of suite version {}, expected {}: not comparable".format(
+                baseline.get("version"), SUITE_VERSION), file=sys.stderr)
+            sys.exit(1)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print("regression: {} {} -> {} msgs/s".format(name, before, after), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()